@@ -1,9 +1,66 @@
+# Shell page of the admin UI. The stylesheet and script are served as separate content-hashed
+# static assets; main.py fills in their URLs once at startup.
 HTML_ADMIN_INTERFACE = """
 <!DOCTYPE html>
 <html>
 <head>
     <title>WebSocket Admin Chat</title>
-    <style>
+    <link rel="stylesheet" href="__ADMIN_CSS_URL__">
+</head>
+<body>
+    <div class="sidebar">
+        <h2>Connected Clients</h2>
+        <ul id="clientList" class="client-list">
+            </ul>
+        <div id="noClientsMessage" style="padding: 10px; text-align: center; color: #aaa; font-style: italic;">
+            No clients connected.
+        </div>
+    </div>
+
+    <div class="main-content">
+        <div class="header">
+            <div style="display: flex; justify-content: space-between; align-items: center;">
+                <h1>Human Agent Dashboard</h1>
+                <div>Welcome, <span id="adminUsername"></span><button class="logout-btn" style="border: none;"><a href="/logout" style="text-decoration: none; color:white;">Logout</a></button></div>
+            </div>
+            <div class="status-bar">
+                <div id="adminStatus" class="status disconnected">Admin: Disconnected</div>
+                <div class="clients-count">Total Active Clients: <span id="totalClientCount">0</span></div>
+            </div>
+        </div>
+
+        <div class="main-layout-container">
+             <div class="content-below-header">
+                <div class="connection-requests-panel">
+                    <h2>Connection Requests</h2>
+                    <div id="connectionRequests">
+                        </div>
+                    <div id="noRequestsMessage">No pending connection requests.</div>
+                </div>
+
+                <div class="chat-area">
+                    <div class="chat-header">
+                        Chatting with: <span id="currentChatClient">No client selected</span>
+                    </div>
+                    <div class="chat-messages" id="chatMessages">
+                        <div id="chatMessageList"></div>
+                    </div>
+                    <div class="chat-input-area">
+                        <input type="text" class="chat-input" id="chatInput" placeholder="Type message..." maxlength="500">
+                        <button class="send-btn" id="sendBtn" onclick="sendMessageToClient()" disabled>Send</button>
+                    </div>
+                </div>
+            </div>
+        </div>
+    </div>
+    <div id="notificationArea" class="notification-area"></div>
+
+    <script src="__ADMIN_JS_URL__"></script>
+</body>
+</html>
+"""
+
+ADMIN_CSS = """
         body { font-family: Arial, sans-serif; display: flex; height: 100vh; margin: 0; background-color: #f0f0f0; }
         .sidebar { width: 250px; background: #333; color: white; padding: 15px; overflow-y: auto; border-right: 1px solid #444; }
         .main-content { flex: 1; display: flex; flex-direction: column; background: #fff; }
@@ -50,11 +107,14 @@ HTML_ADMIN_INTERFACE = """
         }
         #currentChatClient { font-style: italic; }
         .chat-messages { flex: 1; padding: 15px; overflow-y: auto; background: #fdfdfd; overflow-y: scroll; height: 100%; }
+        /* Rows of a virtual list contain their children's margins so their height can be measured */
+        .virtual-row { display: flow-root; }
         .message { margin: 8px 0; padding: 8px 12px; border-radius: 12px; word-wrap: break-word; }
         .message.admin { background: #e9ecef; color: #333; margin-right: auto; }
         .message.user { background: #28a745; color: white; margin-right: auto; }
         .message.assistant { background: #e9ecef; color: #333; margin-right: auto; }
         .message.system { background: #fff3cd; color: #856404; border: 1px solid #ffeaa7; margin: 10px auto; text-align: center; font-style: italic; max-width: 90%;}
+        .virtual-row > .message { margin-top: 4px; margin-bottom: 4px; }
         .message-sender { font-size: 10px; opacity: 0.7; margin-bottom: 4px; display: block; }
         .message-content { font-size: 14px; }
         .message-time { font-size: 10px; opacity: 0.5; margin-top: 4px; }
@@ -130,59 +190,9 @@ HTML_ADMIN_INTERFACE = """
             color: white;
             margin-left: 10px;
         }
-    </style>
-</head>
-<body>
-    <div class="sidebar">
-        <h2>Connected Clients</h2>
-        <ul id="clientList" class="client-list">
-            </ul>
-        <div id="noClientsMessage" style="padding: 10px; text-align: center; color: #aaa; font-style: italic;">
-            No clients connected.
-        </div>
-    </div>
+"""
 
-    <div class="main-content">
-        <div class="header">
-            <div style="display: flex; justify-content: space-between; align-items: center;">
-                <h1>Human Agent Dashboard</h1>
-                <div>Welcome, ' +username+ '<button class="logout-btn" style="border: none;"><a href="/logout" style="text-decoration: none; color:white;">Logout</a></button></div>
-            </div>
-            <div class="status-bar">
-                <div id="adminStatus" class="status disconnected">Admin: Disconnected</div>
-                <div class="clients-count">Total Active Clients: <span id="totalClientCount">0</span></div>
-            </div>
-        </div>
-
-        <div class="main-layout-container">
-             <div class="content-below-header">
-                <div class="connection-requests-panel">
-                    <h2>Connection Requests</h2>
-                    <div id="connectionRequests">
-                        </div>
-                    <div id="noRequestsMessage">No pending connection requests.</div>
-                </div>
-
-                <div class="chat-area">
-                    <div class="chat-header">
-                        Chatting with: <span id="currentChatClient">No client selected</span>
-                    </div>
-                    <div class="chat-messages" id="chatMessages">
-                         <div class="message system">
-                            <div class="message-content">Select a client from the list to start chatting or view pending requests.</div>
-                        </div>
-                    </div>
-                    <div class="chat-input-area">
-                        <input type="text" class="chat-input" id="chatInput" placeholder="Type message..." maxlength="500">
-                        <button class="send-btn" id="sendBtn" onclick="sendMessageToClient()" disabled>Send</button>
-                    </div>
-                </div>
-            </div>
-        </div>
-    </div>
-    <div id="notificationArea" class="notification-area"></div>
-
-    <script>
+ADMIN_JS = """
         let adminWs = null;
         let currentChatTargetClientId = null;
         let chatHistories = {}; // { clientId: [messages] }
@@ -190,6 +200,266 @@ HTML_ADMIN_INTERFACE = """
         let unreadMessages = new Set(); // Set of clientIds with unread messages
         let isLoadingHistory = false; // Prevent multiple simultaneous loads
         let apiHistoryLoaded = new Set(); // Track which clients have had their API history loaded
+        let historyCursors = {}; // { clientId: cursor for the next older page, null once all history is loaded }
+        const HISTORY_PAGE_SIZE = 50;
+        // Chatbot service holding the conversation the visitor had before asking for an agent
+        const BOT_HISTORY_URL = 'http://127.0.0.1:8000';
+        let clientCount = 0;
+        // Versions of the last applied list snapshot/delta; null until a snapshot arrives
+        let clientListVersion = null;
+        let pendingListVersion = null;
+        let clientListResyncRequested = false;
+        let pendingListResyncRequested = false;
+
+        // Keeps only the rows in (or near) the visible part of a scrolling element in the DOM.
+        // Every row is positioned by its measured height (an estimate until it is first rendered),
+        // and padding on the list element stands in for the rows above and below the window.
+        // Rows must not have vertical margins outside themselves.
+        class VirtualList {
+            constructor(viewport, list, { keyOf, render, estimatedHeight = 40, overscan = 5, followTail = false }) {
+                this.viewport = viewport;
+                this.list = list;
+                this.keyOf = keyOf;
+                this.renderItem = render;
+                this.estimatedHeight = estimatedHeight;
+                this.overscan = overscan;
+                this.followTail = followTail; // Stay scrolled to the end while the user is there
+                this.atTail = true;
+                this.items = [];
+                this.indexByKey = new Map();
+                this.heights = new Map(); // key -> measured row height
+                this.rows = new Map(); // key -> row element currently in the DOM
+                this.offsets = null; // offsets[i] = top of item i within the list; rebuilt after changes
+                this.anchor = null; // Row to hold in place across the next render
+                this.frame = null;
+                viewport.addEventListener('scroll', () => {
+                    if (this.followTail) {
+                        this.atTail = viewport.scrollHeight - viewport.scrollTop - viewport.clientHeight < 40;
+                    }
+                    this.schedule();
+                });
+                window.addEventListener('resize', () => {
+                    this.holdAnchor();
+                    this.heights.clear(); // Wrapping changes with the width
+                    this.invalidate();
+                });
+            }
+
+            get length() { return this.items.length; }
+
+            has(key) { return this.indexByKey.has(key); }
+
+            setItems(items) {
+                this.items = items.slice();
+                this.reindex();
+                this.heights = new Map();
+                this.rows = new Map();
+                this.list.replaceChildren();
+                this.anchor = null;
+                this.atTail = true;
+                this.invalidate();
+            }
+
+            append(items) {
+                items.forEach(item => {
+                    this.indexByKey.set(this.keyOf(item), this.items.length);
+                    this.items.push(item);
+                });
+                this.invalidate();
+            }
+
+            prepend(items) {
+                this.holdAnchor();
+                this.items = items.concat(this.items);
+                this.reindex();
+                this.invalidate();
+            }
+
+            upsert(item) {
+                const key = this.keyOf(item);
+                const index = this.indexByKey.get(key);
+                if (index === undefined) {
+                    this.append([item]);
+                    return;
+                }
+                this.holdAnchor();
+                this.items[index] = item;
+                const row = this.rows.get(key);
+                if (row) {
+                    const replacement = this.renderItem(item);
+                    row.replaceWith(replacement);
+                    this.rows.set(key, replacement);
+                }
+                this.invalidate();
+            }
+
+            remove(key) {
+                const index = this.indexByKey.get(key);
+                if (index === undefined) return;
+                this.holdAnchor();
+                this.items.splice(index, 1);
+                this.reindex();
+                this.heights.delete(key);
+                const row = this.rows.get(key);
+                if (row) row.remove();
+                this.rows.delete(key);
+                this.invalidate();
+            }
+
+            scrollToEnd() {
+                this.atTail = true;
+                this.schedule();
+            }
+
+            reindex() {
+                this.indexByKey = new Map(this.items.map((item, i) => [this.keyOf(item), i]));
+            }
+
+            invalidate() {
+                this.offsets = null;
+                this.schedule();
+            }
+
+            schedule() {
+                if (this.frame === null) {
+                    this.frame = requestAnimationFrame(() => this.render());
+                }
+            }
+
+            layout() {
+                if (this.offsets === null) {
+                    const offsets = new Float64Array(this.items.length + 1);
+                    this.items.forEach((item, i) => {
+                        const height = this.heights.get(this.keyOf(item));
+                        offsets[i + 1] = offsets[i] + (height === undefined ? this.estimatedHeight : height);
+                    });
+                    this.offsets = offsets;
+                }
+                return this.offsets;
+            }
+
+            // Index of the item at y (list coordinates)
+            indexAt(y) {
+                const offsets = this.layout();
+                let low = 0, high = this.items.length - 1;
+                while (low < high) {
+                    const mid = (low + high + 1) >> 1;
+                    if (offsets[mid] <= y) low = mid; else high = mid - 1;
+                }
+                return low;
+            }
+
+            // Top of the list element within the viewport's scrolled content
+            listTop() {
+                return this.list.getBoundingClientRect().top - this.viewport.getBoundingClientRect().top + this.viewport.scrollTop;
+            }
+
+            holdAnchor() {
+                if (this.anchor !== null || this.items.length === 0) return;
+                const y = this.viewport.scrollTop - this.listTop();
+                const index = this.indexAt(y);
+                this.anchor = { key: this.keyOf(this.items[index]), delta: y - this.layout()[index] };
+            }
+
+            // Where the viewport should start, in list coordinates
+            targetTop(anchor) {
+                const offsets = this.layout();
+                if (this.followTail && this.atTail) {
+                    return offsets[this.items.length] - this.viewport.clientHeight;
+                }
+                const index = anchor ? this.indexByKey.get(anchor.key) : undefined;
+                if (index !== undefined) {
+                    return offsets[index] + anchor.delta;
+                }
+                return this.viewport.scrollTop - this.listTop();
+            }
+
+            pin(anchor) {
+                let scrollTop;
+                if (this.followTail && this.atTail) {
+                    scrollTop = this.viewport.scrollHeight - this.viewport.clientHeight;
+                } else {
+                    const index = anchor ? this.indexByKey.get(anchor.key) : undefined;
+                    if (index === undefined) return;
+                    scrollTop = this.listTop() + this.layout()[index] + anchor.delta;
+                }
+                // Sub-pixel moves would only fire another scroll event
+                if (Math.abs(this.viewport.scrollTop - scrollTop) >= 1) {
+                    this.viewport.scrollTop = scrollTop;
+                }
+            }
+
+            render() {
+                this.frame = null;
+                this.holdAnchor();
+                const anchor = this.anchor;
+                this.anchor = null;
+                const count = this.items.length;
+                let offsets = this.layout();
+                const top = this.targetTop(anchor);
+                const start = Math.max(0, this.indexAt(top) - this.overscan);
+                const end = count === 0 ? 0 : Math.min(count, this.indexAt(top + this.viewport.clientHeight) + 1 + this.overscan);
+
+                for (const [key, row] of this.rows) {
+                    const index = this.indexByKey.get(key);
+                    if (index === undefined || index < start || index >= end) {
+                        row.remove();
+                        this.rows.delete(key);
+                    }
+                }
+                let previous = null;
+                for (let i = start; i < end; i++) {
+                    const key = this.keyOf(this.items[i]);
+                    let row = this.rows.get(key);
+                    if (!row) {
+                        row = this.renderItem(this.items[i]);
+                        this.rows.set(key, row);
+                    }
+                    const expected = previous ? previous.nextSibling : this.list.firstChild;
+                    if (row !== expected) this.list.insertBefore(row, expected);
+                    previous = row;
+                }
+
+                let measured = false;
+                for (let i = start; i < end; i++) {
+                    const key = this.keyOf(this.items[i]);
+                    const height = this.rows.get(key).offsetHeight;
+                    if (height !== this.heights.get(key)) {
+                        this.heights.set(key, height);
+                        measured = true;
+                    }
+                }
+                if (measured) {
+                    this.offsets = null;
+                    offsets = this.layout();
+                }
+                this.list.style.paddingTop = `${offsets[start]}px`;
+                this.list.style.paddingBottom = `${offsets[count] - offsets[end]}px`;
+                this.pin(anchor);
+                if (measured) {
+                    // Real heights may leave part of the viewport unfilled; render again with them
+                    this.schedule();
+                }
+            }
+        }
+
+        const clientView = new VirtualList(document.querySelector('.sidebar'), document.getElementById('clientList'), {
+            keyOf: client => client.id,
+            render: client => createClientListItem(client),
+            estimatedHeight: 38
+        });
+        const pendingView = new VirtualList(document.querySelector('.connection-requests-panel'), document.getElementById('connectionRequests'), {
+            keyOf: req => req.request_id,
+            render: req => createConnectionRequestCard(req),
+            estimatedHeight: 140
+        });
+        // Chat entries have no id of their own; the history objects themselves are the keys
+        const chatView = new VirtualList(document.getElementById('chatMessages'), document.getElementById('chatMessageList'), {
+            keyOf: msg => msg,
+            render: msg => createChatRow(msg),
+            estimatedHeight: 60,
+            followTail: true
+        });
 
         function getTokenFromCookie() {
             const cookies = document.cookie.split(';');
@@ -208,6 +478,127 @@ HTML_ADMIN_INTERFACE = """
             return null;
         }
 
+        // Wire encoding: JSON by default, MessagePack when the page is opened with ?encoding=msgpack
+        const MSGPACK_SUBPROTOCOL = 'chatserver.msgpack.v1';
+        const JSON_SUBPROTOCOL = 'chatserver.json.v1';
+        const WIRE_ENCODING = new URLSearchParams(window.location.search).get('encoding') === 'msgpack' ? 'msgpack' : 'json';
+
+        // Minimal MessagePack codec covering what the server exchanges: nil, booleans, numbers, strings,
+        // binary, arrays and maps
+        const textEncoder = new TextEncoder();
+        const textDecoder = new TextDecoder();
+
+        function msgpackEncode(value) {
+            const bytes = [];
+            const pushUint = (n, size) => { for (let i = size - 1; i >= 0; i--) bytes.push(Math.floor(n / 2 ** (8 * i)) & 0xff); };
+            const pushLength = (length, fixBase, fixMax, codes) => {
+                if (length <= fixMax && fixBase !== null) bytes.push(fixBase | length);
+                else if (length < 0x100 && codes[0] !== null) { bytes.push(codes[0]); pushUint(length, 1); }
+                else if (length < 0x10000) { bytes.push(codes[1]); pushUint(length, 2); }
+                else { bytes.push(codes[2]); pushUint(length, 4); }
+            };
+            const write = (v) => {
+                if (v === null || v === undefined) bytes.push(0xc0);
+                else if (v === false) bytes.push(0xc2);
+                else if (v === true) bytes.push(0xc3);
+                else if (typeof v === 'number') {
+                    if (Number.isInteger(v) && v >= 0 && v < 2 ** 32) {
+                        if (v < 0x80) bytes.push(v);
+                        else if (v < 0x100) { bytes.push(0xcc); pushUint(v, 1); }
+                        else if (v < 0x10000) { bytes.push(0xcd); pushUint(v, 2); }
+                        else { bytes.push(0xce); pushUint(v, 4); }
+                    } else if (Number.isInteger(v) && v < 0 && v >= -32) {
+                        bytes.push(v & 0xff);
+                    } else if (Number.isInteger(v) && v < 0 && v >= -(2 ** 31)) {
+                        bytes.push(0xd2);
+                        pushUint(v + 2 ** 32, 4);
+                    } else {
+                        const view = new DataView(new ArrayBuffer(8));
+                        view.setFloat64(0, v);
+                        bytes.push(0xcb, ...new Uint8Array(view.buffer));
+                    }
+                } else if (typeof v === 'string') {
+                    const encoded = textEncoder.encode(v);
+                    pushLength(encoded.length, 0xa0, 31, [0xd9, 0xda, 0xdb]);
+                    for (const b of encoded) bytes.push(b);
+                } else if (v instanceof Uint8Array) {
+                    pushLength(v.length, null, -1, [0xc4, 0xc5, 0xc6]);
+                    for (const b of v) bytes.push(b);
+                } else if (Array.isArray(v)) {
+                    pushLength(v.length, 0x90, 15, [null, 0xdc, 0xdd]);
+                    v.forEach(write);
+                } else {
+                    const keys = Object.keys(v);
+                    pushLength(keys.length, 0x80, 15, [null, 0xde, 0xdf]);
+                    keys.forEach(k => { write(k); write(v[k]); });
+                }
+            };
+            write(value);
+            return new Uint8Array(bytes);
+        }
+
+        function msgpackDecode(buffer) {
+            const bytes = new Uint8Array(buffer);
+            const view = new DataView(bytes.buffer, bytes.byteOffset, bytes.byteLength);
+            let pos = 0;
+            const uint = (size) => {
+                let n = 0;
+                for (let i = 0; i < size; i++) n = n * 256 + bytes[pos++];
+                return n;
+            };
+            const int = (size) => {
+                const n = uint(size);
+                return n >= 2 ** (8 * size - 1) ? n - 2 ** (8 * size) : n;
+            };
+            const str = (length) => { const s = textDecoder.decode(bytes.subarray(pos, pos + length)); pos += length; return s; };
+            const bin = (length) => { const b = bytes.slice(pos, pos + length); pos += length; return b; };
+            const array = (length) => { const a = []; for (let i = 0; i < length; i++) a.push(read()); return a; };
+            const map = (length) => { const m = {}; for (let i = 0; i < length; i++) { const k = read(); m[k] = read(); } return m; };
+            const read = () => {
+                const type = bytes[pos++];
+                if (type < 0x80) return type;
+                if (type < 0x90) return map(type & 0x0f);
+                if (type < 0xa0) return array(type & 0x0f);
+                if (type < 0xc0) return str(type & 0x1f);
+                if (type >= 0xe0) return type - 0x100;
+                switch (type) {
+                    case 0xc0: return null;
+                    case 0xc2: return false;
+                    case 0xc3: return true;
+                    case 0xc4: return bin(uint(1));
+                    case 0xc5: return bin(uint(2));
+                    case 0xc6: return bin(uint(4));
+                    case 0xca: { const f = view.getFloat32(pos); pos += 4; return f; }
+                    case 0xcb: { const f = view.getFloat64(pos); pos += 8; return f; }
+                    case 0xcc: return uint(1);
+                    case 0xcd: return uint(2);
+                    case 0xce: return uint(4);
+                    case 0xcf: return uint(8);
+                    case 0xd0: return int(1);
+                    case 0xd1: return int(2);
+                    case 0xd2: return int(4);
+                    case 0xd3: return int(8);
+                    case 0xd9: return str(uint(1));
+                    case 0xda: return str(uint(2));
+                    case 0xdb: return str(uint(4));
+                    case 0xdc: return array(uint(2));
+                    case 0xdd: return array(uint(4));
+                    case 0xde: return map(uint(2));
+                    case 0xdf: return map(uint(4));
+                    default: throw new Error(`Unsupported MessagePack type 0x${type.toString(16)}`);
+                }
+            };
+            return read();
+        }
+
+        function sendToServer(frame) {
+            if (adminWs.protocol === MSGPACK_SUBPROTOCOL) {
+                adminWs.send(msgpackEncode(frame));
+            } else {
+                adminWs.send(JSON.stringify(frame));
+            }
+        }
+
         function connectAdmin() {
             const token = getTokenFromCookie();
             if (!token) {
@@ -216,12 +607,13 @@ HTML_ADMIN_INTERFACE = """
                 return;
             }
             const protocol = window.location.protocol === 'https:' ? 'wss:' : 'ws:';
-            adminWs = new WebSocket(`${protocol}//${window.location.host}/admin?token=${encodeURIComponent(token)}`);
+            const url = `${protocol}//${window.location.host}/admin?token=${encodeURIComponent(token)}&heartbeat=1`;
+            // The server confirms one of the offered subprotocols; JSON if it has no MessagePack support
+            adminWs = WIRE_ENCODING === 'msgpack' ? new WebSocket(url, [MSGPACK_SUBPROTOCOL, JSON_SUBPROTOCOL]) : new WebSocket(url);
+            adminWs.binaryType = 'arraybuffer';
 
             adminWs.onopen = () => {
-                updateAdminStatus(true);
-                adminWs.send(JSON.stringify({ type: "get_client_list" })); // Request client list on connect
-                adminWs.send(JSON.stringify({ type: "get_pending_requests" })); // Request pending requests
+                updateAdminStatus(true); // The server pushes both list snapshots on connect
             };
 
             adminWs.onclose = () => {
@@ -230,22 +622,37 @@ HTML_ADMIN_INTERFACE = """
             };
 
             adminWs.onmessage = (event) => {
-                const data = JSON.parse(event.data);
+                const data = typeof event.data === 'string' ? JSON.parse(event.data) : msgpackDecode(event.data);
                 logger.log("Admin received:", data);
 
                 switch (data.type) {
-                    case 'connection_request':
-                        showConnectionRequest(data.request_id, data.client_info);
+                    case 'ping': // Heartbeat; the server reaps admins that stay silent
+                        sendToServer({ type: 'pong' });
                         break;
                     case 'pending_requests_list':
+                        pendingListVersion = data.version;
+                        pendingListResyncRequested = false;
                         updatePendingRequestsList(data.requests);
                         break;
+                    case 'pending_requests_delta':
+                        applyPendingRequestsDelta(data);
+                        break;
                     case 'client_list_update':
+                        clientListVersion = data.version;
+                        clientListResyncRequested = false;
                         updateClientList(data.clients);
-                        document.getElementById('totalClientCount').textContent = data.clients.length;
+                        break;
+                    case 'client_list_delta':
+                        applyClientListDelta(data);
                         break;
                     case 'user_message':
-                        handleUserMessage(data.client_id, data.message, data.client_info);
+                        handleUserMessage(data.client_id, data.message, data.client_info, data.created_at);
+                        break;
+                    case 'admin_message_sent': // When our last message to this client was stored
+                        markAdminMessageStored(data.client_id, data.created_at);
+                        break;
+                    case 'user_message_batch':
+                        handleUserMessageBatch(data);
                         break;
                     case 'client_connected_notification': // For admin notification
                         showToastNotification(`Client connected: ${data.client_info.user_agent.substring(0,30)}...`);
@@ -254,19 +661,16 @@ HTML_ADMIN_INTERFACE = """
                         showToastNotification(`Client disconnected: ${data.client_id.substring(0,8)}...`);
                         // Clean up when client disconnects
                         apiHistoryLoaded.delete(data.client_id);
-                        if (currentChatTargetClientId === data.client_id) {
-                            addSystemMessageToChatHistory(data.client_id, "Client has disconnected.");
-                            if(document.getElementById(`client-${data.client_id}`)){
-                                displayChatForClient(currentChatTargetClientId); // Refresh chat view
-                            }
-                        }
                         break;
                     case 'chat_history_loaded':
-                        handleChatHistoryLoaded(data.client_id, data.history);
+                        handleChatHistoryLoaded(data.client_id, { messages: [], next_before: null }, convertBotTranscript(data.history));
                         break;
                     case 'chat_history_error':
                         handleChatHistoryError(data.client_id, data.error);
                         break;
+                    case 'auto_approval_rules': // Sent to every admin when the rules are reloaded
+                        showToastNotification(`Auto-approval rules updated (${data.rules.length} rules)`, 'info');
+                        break;
                 }
                 updateSendButtonState();
             };
@@ -281,35 +685,59 @@ HTML_ADMIN_INTERFACE = """
                 statusEl.textContent = 'Admin: Disconnected';
                 statusEl.className = 'status disconnected';
                 currentChatTargetClientId = null;
+                clientListVersion = null;
+                pendingListVersion = null;
                 updateClientList([]); // Clear client list on disconnect
-                document.getElementById('totalClientCount').textContent = 0;
+                updatePendingRequestsList([]);
                 updateChatUIForNoSelection();
             }
             updateSendButtonState();
         }
         
         function updatePendingRequestsList(requests) {
-            const requestsDiv = document.getElementById('connectionRequests');
-            const noRequestsMsg = document.getElementById('noRequestsMessage');
-            requestsDiv.innerHTML = ''; // Clear existing
+            pendingView.setItems(requests || []);
+            document.getElementById('noRequestsMessage').style.display = pendingView.length > 0 ? 'none' : 'block';
+        }
 
-            if (requests && requests.length > 0) {
-                noRequestsMsg.style.display = 'none';
-                requests.forEach(req => showConnectionRequest(req.request_id, req.client_info));
-            } else {
-                noRequestsMsg.style.display = 'block';
+        function applyPendingRequestsDelta(data) {
+            if (pendingListVersion !== null && data.version <= pendingListVersion) return; // Already covered by a later snapshot
+            if (pendingListVersion === null || data.version !== pendingListVersion + 1) {
+                // Missed a frame (or still waiting for the snapshot): ask for a fresh snapshot once
+                if (!pendingListResyncRequested && adminWs && adminWs.readyState === WebSocket.OPEN) {
+                    pendingListResyncRequested = true;
+                    sendToServer({ type: "get_pending_requests", version: pendingListVersion });
+                }
+                return;
             }
+            pendingListVersion = data.version;
+            data.ops.forEach(op => {
+                if (op.op === 'add') {
+                    showConnectionRequest(op.request.request_id, op.request.client_info);
+                } else if (op.op === 'remove') {
+                    removeConnectionRequest(op.request_id);
+                }
+            });
         }
 
-        function showConnectionRequest(requestId, clientInfo) {
-            const notificationsDiv = document.getElementById('connectionRequests');
-            const noRequestsMsg = document.getElementById('noRequestsMessage');
-            noRequestsMsg.style.display = 'none';
+        function removeConnectionRequest(requestId) {
+            pendingView.remove(requestId);
+            if (pendingView.length === 0) {
+                document.getElementById('noRequestsMessage').style.display = 'block';
+            }
+        }
 
-            const existingNotification = document.getElementById(`req-${requestId}`);
-            if (existingNotification) return; // Avoid duplicates
+        function showConnectionRequest(requestId, clientInfo) {
+            document.getElementById('noRequestsMessage').style.display = 'none';
+            if (pendingView.has(requestId)) return; // Avoid duplicates
+            pendingView.append([{ request_id: requestId, client_info: clientInfo }]);
+        }
 
+        function createConnectionRequestCard(req) {
+            const requestId = req.request_id;
+            const clientInfo = req.client_info;
             const conversationId = clientInfo.conversation_id || 'N/A';
+            const row = document.createElement('div');
+            row.className = 'virtual-row';
             const card = document.createElement('div');
             card.className = 'notification-card';
             card.id = `req-${requestId}`;
@@ -324,59 +752,89 @@ HTML_ADMIN_INTERFACE = """
                     <button class="reject-btn" onclick="handleConnectionResponse('${requestId}', 'reject')">Reject</button>
                 </div>
             `;
-            notificationsDiv.appendChild(card);
+            row.appendChild(card);
+            return row;
         }
 
         function handleConnectionResponse(requestId, action) {
             if (adminWs && adminWs.readyState === WebSocket.OPEN) {
-                adminWs.send(JSON.stringify({
+                sendToServer({
                     type: 'connection_response',
                     request_id: requestId,
                     action: action
-                }));
-                const notificationCard = document.getElementById(`req-${requestId}`);
-                if (notificationCard) notificationCard.remove();
+                });
+                removeConnectionRequest(requestId);
+            }
+        }
+
+        function createClientListItem(client) {
+            const listItem = document.createElement('li');
+            listItem.id = `client-${client.id}`;
+            fillClientListItem(listItem, client);
+            listItem.onclick = () => selectClientForChat(client.id);
+            return listItem;
+        }
+
+        function fillClientListItem(listItem, client) {
+            const conversationId = client.info.conversation_id || 'N/A';
+            listItem.textContent = `${client.info.user_agent ? client.info.user_agent.substring(0, 20) : 'Unknown Client'}... (${conversationId.substring(0,4)})`;
 
-                if (document.getElementById('connectionRequests').children.length === 0) {
-                    document.getElementById('noRequestsMessage').style.display = 'block';
+            const unreadIndicator = document.createElement('span');
+            unreadIndicator.className = 'unread-indicator';
+            listItem.prepend(unreadIndicator); // Add indicator at the beginning
+
+            listItem.classList.toggle('has-unread', unreadMessages.has(client.id));
+            listItem.classList.toggle('active', client.id === currentChatTargetClientId);
+        }
+
+        function setClientCount(count) {
+            clientCount = count;
+            document.getElementById('totalClientCount').textContent = count;
+            document.getElementById('noClientsMessage').style.display = count > 0 ? 'none' : 'block';
+        }
+
+        function applyClientListDelta(data) {
+            if (clientListVersion !== null && data.version <= clientListVersion) return; // Already covered by a later snapshot
+            if (clientListVersion === null || data.version !== clientListVersion + 1) {
+                // Missed a frame (or still waiting for the snapshot): ask for a fresh snapshot once
+                if (!clientListResyncRequested && adminWs && adminWs.readyState === WebSocket.OPEN) {
+                    clientListResyncRequested = true;
+                    sendToServer({ type: "get_client_list", version: clientListVersion });
                 }
+                return;
             }
+            clientListVersion = data.version;
+            data.ops.forEach(op => {
+                if (op.op === 'add' || op.op === 'update') {
+                    if (!clientInfoMap[op.client.id]) clientCount++;
+                    clientInfoMap[op.client.id] = op.client.info;
+                    clientView.upsert(op.client);
+                } else if (op.op === 'remove') {
+                    clientView.remove(op.id);
+                    if (clientInfoMap[op.id]) clientCount--;
+                    delete clientInfoMap[op.id];
+                    if (currentChatTargetClientId === op.id) {
+                        // Leave the transcript up with a notice; clearing the target disables sending
+                        chatView.append([addSystemMessageToChatHistory(op.id, "Client has disconnected.")]);
+                        document.getElementById('currentChatClient').textContent += ' (disconnected)';
+                        currentChatTargetClientId = null;
+                    }
+                }
+            });
+            setClientCount(clientCount);
+            updateSendButtonState();
         }
 
         function updateClientList(clients) {
-            const clientListEl = document.getElementById('clientList');
-            const noClientsMsg = document.getElementById('noClientsMessage');
-            clientListEl.innerHTML = ''; // Clear existing list
-
             clientInfoMap = {}; // Reset map
-
-            if (clients && clients.length > 0) {
-                noClientsMsg.style.display = 'none';
-                clients.forEach(client => {
-                    clientInfoMap[client.id] = client.info; // Store client info
-                    const listItem = document.createElement('li');
-                    listItem.id = `client-${client.id}`;
-                    const conversationId = client.info.conversation_id || 'N/A';
-                    listItem.textContent = `${client.info.user_agent ? client.info.user_agent.substring(0, 20) : 'Unknown Client'}... (${conversationId.substring(0,4)})`;
-                    listItem.onclick = () => selectClientForChat(client.id);
-
-                    const unreadIndicator = document.createElement('span');
-                    unreadIndicator.className = 'unread-indicator';
-                    listItem.prepend(unreadIndicator); // Add indicator at the beginning
-
-                    clientListEl.appendChild(listItem);
-                    if (unreadMessages.has(client.id)) {
-                        listItem.classList.add('has-unread');
-                    }
-                });
-            } else {
-                noClientsMsg.style.display = 'block';
-            }
+            (clients || []).forEach(client => {
+                clientInfoMap[client.id] = client.info; // Store client info
+            });
+            clientView.setItems(clients || []);
+            setClientCount((clients || []).length);
 
             // Reselect current client if still in list, otherwise clear chat
             if (currentChatTargetClientId && clientInfoMap[currentChatTargetClientId]) {
-                const currentClientItem = document.getElementById(`client-${currentChatTargetClientId}`);
-                if (currentClientItem) currentClientItem.classList.add('active');
                  updateChatUIForClient(currentChatTargetClientId);
             } else if (currentChatTargetClientId) { // Current client disconnected
                 currentChatTargetClientId = null;
@@ -417,11 +875,71 @@ HTML_ADMIN_INTERFACE = """
             document.getElementById('chatInput').focus();
         }
 
+        async function fetchHistoryPage(conversationId, before) {
+            let url = `/api/conversations/${encodeURIComponent(conversationId)}/messages?limit=${HISTORY_PAGE_SIZE}`;
+            if (before) url += `&before=${encodeURIComponent(before)}`;
+            const response = await fetch(url, { headers: { 'Authorization': `Bearer ${getTokenFromCookie()}` } });
+            if (!response.ok) {
+                throw new Error(`HTTP ${response.status}: ${response.statusText}`);
+            }
+            return response.json();
+        }
+
+        function convertHistoryPage(page) {
+            // Pages come newest first; chat history is kept oldest first
+            return page.messages.slice().reverse().map(msg => ({
+                id: msg.id,
+                senderType: msg.sender === 'user' ? 'user' : 'admin',
+                text: msg.message,
+                senderName: msg.sender === 'user' ? 'User' : (msg.agent_username || 'Agent'),
+                time: msg.created_at,
+                createdAt: msg.created_at,
+                isHistorical: true
+            }));
+        }
+
+        function convertBotTranscript(history) {
+            return history.map(msg => ({
+                senderType: msg.role === 'user' ? 'user' : 'assistant',
+                text: msg.content,
+                senderName: msg.role === 'user' ? 'User' : 'AI Assistant',
+                time: msg.time,
+                isHistorical: true
+            }));
+        }
+
+        async function fetchBotTranscript(conversationId) {
+            // The bot conversation precedes everything this server stored; without it the agent still gets the rest
+            try {
+                const response = await fetch(`${BOT_HISTORY_URL}/api/conversation/${encodeURIComponent(conversationId)}/`);
+                if (!response.ok) {
+                    throw new Error(`HTTP ${response.status}: ${response.statusText}`);
+                }
+                return convertBotTranscript(await response.json());
+            } catch (error) {
+                logger.error(`Failed to load the chatbot transcript of conversation ${conversationId}:`, error);
+                return [];
+            }
+        }
+
+        function storedMessageKey(msg) {
+            return `${msg.senderType}\n${msg.createdAt}`;
+        }
+
+        function dropRealtimeDuplicates(clientId, messages) {
+            // Real-time messages carry the created_at the server stored them with, so stored copies are recognised exactly
+            const seen = new Set((chatHistories[clientId] || [])
+                .filter(msg => !msg.isHistorical && msg.createdAt)
+                .map(storedMessageKey));
+            return messages.filter(msg => !seen.has(storedMessageKey(msg)));
+        }
+
         async function loadChatHistory(clientId) {
             const clientInfo = clientInfoMap[clientId];
             if (!clientInfo || !clientInfo.conversation_id) {
                 logger.log(`No conversation ID for client ${clientId}`);
                 apiHistoryLoaded.add(clientId); // Mark as attempted even if no conversation ID
+                historyCursors[clientId] = null;
                 displayChatForClient(clientId);
                 return;
             }
@@ -430,66 +948,86 @@ HTML_ADMIN_INTERFACE = """
             showLoadingIndicator();
 
             try {
-                const response = await fetch(`http://127.0.0.1:8000/api/conversation/${clientInfo.conversation_id}/`);
-                if (!response.ok) {
-                    throw new Error(`HTTP ${response.status}: ${response.statusText}`);
-                }
-                
-                const history = await response.json();
-                handleChatHistoryLoaded(clientId, history);
+                const page = await fetchHistoryPage(clientInfo.conversation_id, null);
+                const botHistory = page.next_before ? [] : await fetchBotTranscript(clientInfo.conversation_id);
+                handleChatHistoryLoaded(clientId, page, botHistory);
             } catch (error) {
                 logger.error(`Failed to load chat history for client ${clientId}:`, error);
                 handleChatHistoryError(clientId, error.message);
                 apiHistoryLoaded.add(clientId); // Mark as attempted even on error
+                historyCursors[clientId] = null;
             } finally {
                 isLoadingHistory = false;
             }
         }
 
-        function handleChatHistoryLoaded(clientId, history) {
+        function handleChatHistoryLoaded(clientId, page, botHistory = []) {
             if (!chatHistories[clientId]) {
                 chatHistories[clientId] = [];
             }
 
-            // Convert API history to our format
-            const convertedHistory = history.map(msg => ({
-                senderType: msg.role === 'user' ? 'user' : 'assistant',
-                text: msg.content,
-                senderName: msg.role === 'user' ? 'User' : 'AI Assistant',
-                time: msg.time,
-                isHistorical: true
-            }));
-
-            // Find the split point - where historical messages end and real-time messages begin
             const realtimeMessages = chatHistories[clientId].filter(msg => !msg.isHistorical);
-            
-            // Rebuild the chat history: API history first, then real-time messages
-            chatHistories[clientId] = [...convertedHistory, ...realtimeMessages];
-            
-            // Mark this client's API history as loaded
+            // Real-time messages already persisted by the server also come back in the newest page
+            const convertedHistory = dropRealtimeDuplicates(clientId, convertHistoryPage(page));
+
+            // Rebuild the chat history: the bot conversation, stored history, then real-time messages
+            chatHistories[clientId] = [...botHistory, ...convertedHistory, ...realtimeMessages];
+            historyCursors[clientId] = page.next_before;
             apiHistoryLoaded.add(clientId);
 
             if (currentChatTargetClientId === clientId) {
                 displayChatForClient(clientId);
             }
 
-            logger.log(`Loaded ${history.length} historical messages for client ${clientId}`);
+            logger.log(`Loaded ${page.messages.length} historical messages for client ${clientId}`);
+        }
+
+        async function loadOlderHistory(clientId) {
+            const clientInfo = clientInfoMap[clientId];
+            const cursor = historyCursors[clientId];
+            if (!cursor || !clientInfo || isLoadingHistory) return;
+
+            isLoadingHistory = true;
+            try {
+                const page = await fetchHistoryPage(clientInfo.conversation_id, cursor);
+                const botHistory = page.next_before ? [] : await fetchBotTranscript(clientInfo.conversation_id);
+                const older = [...botHistory, ...dropRealtimeDuplicates(clientId, convertHistoryPage(page))];
+                chatHistories[clientId] = [...older, ...(chatHistories[clientId] || [])];
+                historyCursors[clientId] = page.next_before;
+                if (currentChatTargetClientId === clientId) {
+                    prependMessages(older);
+                }
+            } catch (error) {
+                logger.error(`Failed to load older chat history for client ${clientId}:`, error);
+                showToastNotification(`Failed to load older messages: ${error.message}`, 'error');
+            } finally {
+                isLoadingHistory = false;
+            }
+        }
+
+        function prependMessages(messages) {
+            // The virtual list keeps the message the admin was looking at in place
+            chatView.prepend(messages);
         }
 
+        document.getElementById('chatMessages').addEventListener('scroll', (e) => {
+            if (e.target.scrollTop < 50 && currentChatTargetClientId) {
+                loadOlderHistory(currentChatTargetClientId);
+            }
+        });
+
         function handleChatHistoryError(clientId, error) {
             logger.error(`Chat history error for client ${clientId}:`, error);
             
             if (currentChatTargetClientId === clientId) {
-                addSystemMessageToChatHistory(clientId, `Failed to load chat history: ${error}`);
-                displayChatForClient(clientId);
+                chatView.append([addSystemMessageToChatHistory(clientId, `Failed to load chat history: ${error}`)]);
             }
             
             showToastNotification(`Failed to load chat history: ${error}`, 'error');
         }
 
         function showLoadingIndicator() {
-            const chatMessagesEl = document.getElementById('chatMessages');
-            chatMessagesEl.innerHTML = '<div class="loading-indicator">Loading chat history...</div>';
+            chatView.setItems([{ loading: true }]);
         }
 
         function updateChatUIForClient(clientId) {
@@ -501,22 +1039,22 @@ HTML_ADMIN_INTERFACE = """
 
         function updateChatUIForNoSelection() {
             document.getElementById('currentChatClient').textContent = 'No client selected';
-            document.getElementById('chatMessages').innerHTML = `
-                <div class="message system">
-                    <div class="message-content">Select a client from the list to start chatting or view pending requests.</div>
-                </div>`;
+            chatView.setItems([{ senderType: 'system', text: 'Select a client from the list to start chatting or view pending requests.' }]);
         }
 
         function displayChatForClient(clientId) {
-            const chatMessagesEl = document.getElementById('chatMessages');
-            chatMessagesEl.innerHTML = ''; // Clear current messages
+            chatView.setItems(chatHistories[clientId] || []);
+        }
 
-            const history = chatHistories[clientId] || [];
-            history.forEach(msg => {
-                const messageDiv = createMessageDiv(msg.senderType, msg.text, msg.senderName, msg.clientInfo, msg.time, msg.isHistorical);
-                chatMessagesEl.appendChild(messageDiv);
-            });
-            chatMessagesEl.scrollTop = chatMessagesEl.scrollHeight;
+        function createChatRow(msg) {
+            const row = document.createElement('div');
+            row.className = 'virtual-row';
+            if (msg.loading) {
+                row.innerHTML = '<div class="loading-indicator">Loading chat history...</div>';
+            } else {
+                row.appendChild(createMessageDiv(msg.senderType, msg.text, msg.senderName, msg.clientInfo, msg.time, msg.isHistorical));
+            }
+            return row;
         }
 
         function sendMessageToClient() {
@@ -529,21 +1067,21 @@ HTML_ADMIN_INTERFACE = """
                     target_client_id: currentChatTargetClientId,
                     message: messageText
                 };
-                adminWs.send(JSON.stringify(messageData));
+                sendToServer(messageData);
 
-                addMessageToChatHistory(currentChatTargetClientId, 'admin', messageText, "Admin");
-                displayChatForClient(currentChatTargetClientId); // Refresh view
+                chatView.append([addMessageToChatHistory(currentChatTargetClientId, 'admin', messageText, "Admin")]);
+                chatView.scrollToEnd();
                 input.value = '';
             }
             updateSendButtonState();
         }
 
-        function handleUserMessage(clientId, messageText, clientInfo) {
+        function handleUserMessage(clientId, messageText, clientInfo, createdAt = null) {
             const senderName = clientInfo ? (clientInfo.user_agent ? clientInfo.user_agent.substring(0,20) : 'Client') : 'Client';
-            addMessageToChatHistory(clientId, 'user', messageText, senderName, clientInfo);
+            const entry = addMessageToChatHistory(clientId, 'user', messageText, senderName, clientInfo, createdAt);
 
             if (clientId === currentChatTargetClientId) {
-                displayChatForClient(clientId); // Refresh view if current
+                chatView.append([entry]);
             } else {
                 // Mark as unread
                 unreadMessages.add(clientId);
@@ -555,25 +1093,72 @@ HTML_ADMIN_INTERFACE = """
             }
         }
         
+        function handleUserMessageBatch(batch) {
+            // Append every message first, then update the chat, unread markers and toast once
+            const currentChatEntries = [];
+            const unreadClients = new Set();
+            batch.messages.forEach(msg => {
+                const clientInfo = batch.clients[msg.client_id];
+                const senderName = clientInfo && clientInfo.user_agent ? clientInfo.user_agent.substring(0,20) : 'Client';
+                const entry = addMessageToChatHistory(msg.client_id, 'user', msg.message, senderName, clientInfo, msg.created_at);
+                if (msg.client_id === currentChatTargetClientId) {
+                    currentChatEntries.push(entry);
+                } else {
+                    unreadClients.add(msg.client_id);
+                }
+            });
+
+            if (currentChatEntries.length > 0) {
+                chatView.append(currentChatEntries);
+            }
+            unreadClients.forEach(clientId => {
+                unreadMessages.add(clientId);
+                const clientListItem = document.getElementById(`client-${clientId}`);
+                if (clientListItem) {
+                    clientListItem.classList.add('has-unread');
+                }
+            });
+            if (unreadClients.size === 1) {
+                const clientInfo = batch.clients[unreadClients.values().next().value];
+                showToastNotification(`New messages from ${clientInfo && clientInfo.user_agent ? clientInfo.user_agent.substring(0,20) : 'Client'}...`, 'info');
+            } else if (unreadClients.size > 1) {
+                showToastNotification(`New messages from ${unreadClients.size} clients`, 'info');
+            }
+        }
+
         function addSystemMessageToChatHistory(clientId, text) {
             if (!chatHistories[clientId]) {
                 chatHistories[clientId] = [];
             }
-            chatHistories[clientId].push({ senderType: 'system', text: text });
+            const entry = { senderType: 'system', text: text };
+            chatHistories[clientId].push(entry);
+            return entry;
         }
 
-        function addMessageToChatHistory(clientId, senderType, text, senderName, clientInfoDetails = null) {
+        function addMessageToChatHistory(clientId, senderType, text, senderName, clientInfoDetails = null, createdAt = null) {
             if (!chatHistories[clientId]) {
                 chatHistories[clientId] = [];
             }
-            chatHistories[clientId].push({ 
-                senderType, 
-                text, 
-                senderName, 
+            const entry = {
+                senderType,
+                text,
+                senderName,
                 clientInfo: clientInfoDetails,
                 time: new Date().toISOString(),
+                createdAt, // Server's stored timestamp, used to recognise this message in loaded history
                 isHistorical: false
-            });
+            };
+            chatHistories[clientId].push(entry);
+            return entry;
+        }
+
+        function markAdminMessageStored(clientId, createdAt) {
+            // Our messages to a client are stored in the order we sent them
+            const entry = (chatHistories[clientId] || []).find(
+                msg => msg.senderType === 'admin' && !msg.isHistorical && !msg.createdAt);
+            if (entry) {
+                entry.createdAt = createdAt;
+            }
         }
 
         function createMessageDiv(senderType, text, senderName, clientInfo = null, time = null, isHistorical = false) {
@@ -584,7 +1169,7 @@ HTML_ADMIN_INTERFACE = """
             if (senderType === 'user' && clientInfo) {
                  displayName = `${clientInfo.user_agent ? clientInfo.user_agent.substring(0,20) : 'Client'}... (${clientInfo.client_ip || 'N/A'})`;
             } else if (senderType === 'admin') {
-                displayName = 'Admin (You)';
+                displayName = isHistorical && senderName ? senderName : 'Admin (You)';
             } else if (senderType === 'assistant') {
                 displayName = 'AI Assistant';
             }
@@ -660,8 +1245,22 @@ HTML_ADMIN_INTERFACE = """
             error: (message, ...optionalParams) => console.error("[AdminWS]", message, ...optionalParams)
         };
 
+        // Per-user details come from a small bootstrap call so the page itself stays cacheable
+        async function loadBootstrap() {
+            try {
+                const response = await fetch('/api/me', { headers: { 'Authorization': `Bearer ${getTokenFromCookie()}` } });
+                if (response.status === 401) {
+                    window.location.href = '/login';
+                    return;
+                }
+                const me = await response.json();
+                document.getElementById('adminUsername').textContent = me.username;
+            } catch (error) {
+                logger.error("Failed to load user details:", error);
+            }
+        }
+
+        updateChatUIForNoSelection();
+        loadBootstrap();
         connectAdmin();
-    </script>
-</body>
-</html>
-"""
\ No newline at end of file
+"""
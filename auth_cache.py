@@ -0,0 +1,64 @@
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Dict, Optional, Tuple
+
+
+class SessionCache:
+    """In-process cache of validated sessions: token hash -> user row.
+
+    Entries live for ``ttl`` seconds but never past the session's own
+    ``expires_at``. Once ``max_size`` entries are held the least recently used
+    one is evicted. ``invalidate`` drops a token immediately (e.g. on logout).
+    """
+
+    def __init__(self, max_size: int = 10000, ttl: float = 60.0):
+        self.max_size = max_size
+        self.ttl = ttl
+        # token_hash -> (monotonic deadline, user)
+        self._entries: "OrderedDict[str, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, token_hash: str) -> Optional[Dict[str, Any]]:
+        entry = self._entries.get(token_hash)
+        if entry is None:
+            self.misses += 1
+            return None
+        deadline, user = entry
+        if deadline <= time.monotonic():
+            del self._entries[token_hash]
+            self.misses += 1
+            return None
+        self._entries.move_to_end(token_hash)
+        self.hits += 1
+        return dict(user)
+
+    def put(self, token_hash: str, user: Dict[str, Any], expires_at: datetime):
+        ttl = min(self.ttl, (expires_at - datetime.now()).total_seconds())
+        if ttl <= 0:
+            return
+        self._entries[token_hash] = (time.monotonic() + ttl, dict(user))
+        self._entries.move_to_end(token_hash)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, token_hash: str):
+        self._entries.pop(token_hash, None)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self),
+            "max_size": self.max_size,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+        }
@@ -0,0 +1,190 @@
+"""Rules that decide connection requests without waiting for an agent.
+
+A rules file holds a JSON list (or ``{"rules": [...]}``) such as::
+
+    [
+        {"name": "known bots", "user_agent": "bot|crawler|spider", "action": "reject"},
+        {"name": "office", "cidr": ["10.0.0.0/8", "192.168.0.0/16"], "action": "accept"},
+        {"name": "checkout", "conversation_id": "checkout-*", "action": "queue"}
+    ]
+
+A rule matches on ``conversation_id`` (exact, or a prefix ending in ``*``),
+``cidr`` (client IP networks) and ``user_agent`` (a case-insensitive regular
+expression searched in the header); fields left out match anything. The
+first rule matching every field decides: ``accept`` connects the visitor to
+an agent straight away, ``reject`` closes the socket, ``queue`` leaves the
+request to a human as when no rule matches.
+
+Rules are compiled into one index per field. Each lookup returns a bitmask
+of the rules matching that field; ANDing the masks and taking the lowest set
+bit gives the first rule matching everything. Conversation ids and IPs cost
+one dict lookup per distinct prefix length used by the rules; user agents,
+of which there are few distinct ones, are scanned once and cached.
+"""
+import ipaddress
+import json
+import re
+from functools import lru_cache
+from typing import Any, Dict, List, NamedTuple, Optional, Pattern, Tuple
+
+ACCEPT = "accept"
+REJECT = "reject"
+QUEUE = "queue"
+ACTIONS = (ACCEPT, REJECT, QUEUE)
+
+RULE_FIELDS = frozenset({"name", "action", "conversation_id", "cidr", "user_agent"})
+
+
+class Rule(NamedTuple):
+    name: str
+    action: str
+    conversation_ids: Tuple[str, ...]
+    networks: Tuple[str, ...]
+    user_agent: Optional[str]
+
+    def to_dict(self) -> Dict[str, Any]:
+        spec: Dict[str, Any] = {"name": self.name, "action": self.action}
+        if self.conversation_ids:
+            spec["conversation_id"] = list(self.conversation_ids)
+        if self.networks:
+            spec["cidr"] = list(self.networks)
+        if self.user_agent is not None:
+            spec["user_agent"] = self.user_agent
+        return spec
+
+
+def _string_list(spec: Dict[str, Any], key: str) -> Tuple[str, ...]:
+    value = spec.get(key)
+    if value is None:
+        return ()
+    values = [value] if isinstance(value, str) else value
+    if not isinstance(values, list) or not values or not all(isinstance(v, str) and v for v in values):
+        raise ValueError(f"'{key}' must be a non-empty string or list of strings")
+    return tuple(values)
+
+
+class RuleSet:
+    """Compiled auto-approval rules; ``match`` returns the deciding rule or None"""
+
+    def __init__(self, specs: List[Dict[str, Any]]):
+        if not isinstance(specs, list):
+            raise ValueError("Auto-approval rules must be a list")
+        self.rules: List[Rule] = []
+        # Bitmasks of rule indexes. A rule without a condition on a field is in that field's "any" mask.
+        self._any_conversation = 0
+        self._exact_conversations: Dict[str, int] = {}
+        self._conversation_prefixes: Dict[str, int] = {}
+        self._prefix_lengths: List[int] = []
+        self._any_ip = 0
+        # (IP version, prefix length) -> {network address >> host bits: mask}
+        self._networks: Dict[Tuple[int, int], Dict[int, int]] = {}
+        self._any_user_agent = 0
+        self._user_agent_patterns: List[Tuple[int, Pattern]] = []
+        for index, spec in enumerate(specs):
+            try:
+                self._add(index, spec)
+            except (TypeError, ValueError, re.error) as e:
+                raise ValueError(f"Rule {index + 1}: {e}") from None
+        self._prefix_lengths.sort()
+        self._user_agent_mask = lru_cache(maxsize=4096)(self._scan_user_agent)
+
+    def __len__(self) -> int:
+        return len(self.rules)
+
+    def _add(self, index: int, spec: Dict[str, Any]):
+        if not isinstance(spec, dict):
+            raise ValueError("must be an object")
+        unknown = set(spec) - RULE_FIELDS
+        if unknown:
+            raise ValueError(f"unknown fields {sorted(unknown)}")
+        action = spec.get("action")
+        if action not in ACTIONS:
+            raise ValueError(f"action must be one of {', '.join(ACTIONS)}")
+        user_agent = spec.get("user_agent")
+        if user_agent is not None and (not isinstance(user_agent, str) or not user_agent):
+            raise ValueError("'user_agent' must be a non-empty regular expression")
+        rule = Rule(str(spec.get("name") or f"rule {index + 1}"), action,
+                    _string_list(spec, "conversation_id"), _string_list(spec, "cidr"), user_agent)
+        bit = 1 << index
+
+        if not rule.conversation_ids:
+            self._any_conversation |= bit
+        for pattern in rule.conversation_ids:
+            if pattern == "*":
+                self._any_conversation |= bit
+            elif pattern.endswith("*"):
+                prefix = pattern[:-1]
+                self._conversation_prefixes[prefix] = self._conversation_prefixes.get(prefix, 0) | bit
+                if len(prefix) not in self._prefix_lengths:
+                    self._prefix_lengths.append(len(prefix))
+            else:
+                self._exact_conversations[pattern] = self._exact_conversations.get(pattern, 0) | bit
+
+        if not rule.networks:
+            self._any_ip |= bit
+        for cidr in rule.networks:
+            network = ipaddress.ip_network(cidr, strict=False)
+            host_bits = network.max_prefixlen - network.prefixlen
+            networks = self._networks.setdefault((network.version, network.prefixlen), {})
+            key = int(network.network_address) >> host_bits
+            networks[key] = networks.get(key, 0) | bit
+
+        if user_agent is None:
+            self._any_user_agent |= bit
+        else:
+            self._user_agent_patterns.append((bit, re.compile(user_agent, re.IGNORECASE)))
+
+        self.rules.append(rule)
+
+    def _conversation_mask(self, conversation_id: str) -> int:
+        mask = self._any_conversation | self._exact_conversations.get(conversation_id, 0)
+        for length in self._prefix_lengths:
+            if length > len(conversation_id):
+                break
+            mask |= self._conversation_prefixes.get(conversation_id[:length], 0)
+        return mask
+
+    def _ip_mask(self, client_ip: str) -> int:
+        mask = self._any_ip
+        if not self._networks:
+            return mask
+        try:
+            address = ipaddress.ip_address(client_ip)
+        except ValueError:
+            return mask
+        value = int(address)
+        for (version, prefixlen), networks in self._networks.items():
+            if version == address.version:
+                mask |= networks.get(value >> (address.max_prefixlen - prefixlen), 0)
+        return mask
+
+    def _scan_user_agent(self, user_agent: str) -> int:
+        mask = self._any_user_agent
+        for bit, pattern in self._user_agent_patterns:
+            if pattern.search(user_agent):
+                mask |= bit
+        return mask
+
+    def match(self, client_info: Dict[str, str]) -> Optional[Rule]:
+        if not self.rules:
+            return None
+        mask = self._conversation_mask(client_info.get("conversation_id", ""))
+        if mask:
+            mask &= self._ip_mask(client_info.get("client_ip", ""))
+        if mask:
+            mask &= self._user_agent_mask(client_info.get("user_agent", ""))
+        if not mask:
+            return None
+        return self.rules[(mask & -mask).bit_length() - 1]
+
+    def specs(self) -> List[Dict[str, Any]]:
+        return [rule.to_dict() for rule in self.rules]
+
+
+def load_rules(path: Optional[str]) -> RuleSet:
+    """Compile the rules in a JSON file; no path means no rules. Raises ValueError or OSError."""
+    if not path:
+        return RuleSet([])
+    with open(path) as f:
+        data = json.load(f)
+    return RuleSet(data.get("rules", []) if isinstance(data, dict) else data)
@@ -0,0 +1,96 @@
+"""Auth latency per storage engine: the database work of a login and of a session validation.
+
+For each engine this creates --sessions sessions (the login path minus the
+password KDF: user lookup plus session insert), then validates random
+sessions one at a time and --concurrency at a time, as token validation
+does on a session cache miss. Postgres is included when --database-url
+points at a throwaway database (migrated on start, and left with the
+benchmark's rows in it).
+
+    python benchmarks/bench_auth_storage.py [--sessions 2000] [--lookups 5000] [--database-url postgresql://...]
+"""
+import argparse
+import asyncio
+import os
+import random
+import secrets
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from storage import create_storage  # noqa: E402
+
+
+def summarize(latencies):
+    latencies.sort()
+    return (sum(latencies) / len(latencies) * 1e6, latencies[len(latencies) // 2] * 1e6,
+            latencies[int(len(latencies) * 0.99)] * 1e6)
+
+
+async def timed(fn, *args):
+    start = time.perf_counter()
+    await fn(*args)
+    return time.perf_counter() - start
+
+
+async def login(storage, username, token_hash):
+    user = await storage.get_user_by_username(username)
+    await storage.create_session(user["id"], token_hash, datetime.now() + timedelta(hours=1))
+
+
+async def bench(storage, args):
+    await storage.start(auto_migrate=True)
+    try:
+        username = f"bench-{secrets.token_hex(4)}"
+        await storage.create_user(username, f"{username}@bench", "x", True)
+        token_hashes = [secrets.token_hex(32) for _ in range(args.sessions)]
+        logins = [await timed(login, storage, username, token_hash) for token_hash in token_hashes]
+
+        rng = random.Random(42)
+        validate = [await timed(storage.get_session_user, rng.choice(token_hashes), username) for _ in range(args.lookups)]
+
+        semaphore = asyncio.Semaphore(args.concurrency)
+
+        async def limited(token_hash):
+            async with semaphore:
+                return await timed(storage.get_session_user, token_hash, username)
+
+        start = time.perf_counter()
+        concurrent = await asyncio.gather(*(limited(rng.choice(token_hashes)) for _ in range(args.lookups)))
+        throughput = args.lookups / (time.perf_counter() - start)
+        return summarize(logins), summarize(validate), summarize(list(concurrent)), throughput
+    finally:
+        await storage.close()
+
+
+async def run(args):
+    print(f"{args.sessions} sessions, {args.lookups} validations, concurrency {args.concurrency}")
+    print(f"{'engine':>9} {'step':>22} {'mean us':>10} {'p50 us':>10} {'p99 us':>10}")
+    with tempfile.TemporaryDirectory() as tmp:
+        engines = [("memory", {}), ("sqlite", {"sqlite_path": os.path.join(tmp, "bench.db")})]
+        if args.database_url:
+            engines.append(("postgres", {"database_url": args.database_url}))
+        for engine, options in engines:
+            login, validate, concurrent, throughput = await bench(create_storage(engine, **options), args)
+            for step, (mean, p50, p99) in (("login (no KDF)", login), ("validate", validate),
+                                           (f"validate x{args.concurrency}", concurrent)):
+                print(f"{engine:>9} {step:>22} {mean:>10.1f} {p50:>10.1f} {p99:>10.1f}")
+            print(f"{engine:>9} {'validations/s':>22} {throughput:>10.0f}")
+    if not args.database_url:
+        print("postgres skipped; pass --database-url to include it")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sessions", type=int, default=2000)
+    parser.add_argument("--lookups", type=int, default=5000)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--database-url", default="", help="throwaway Postgres to include")
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+"""Per-message cost of the client receive loop as the number of connections grows.
+
+Builds a ConnectionManager holding N active visitor sessions spread across
+agents, then times the work the /ws loop does for each received frame
+(socket -> session lookup plus forwarding to the agent) and the cost of a
+disconnect. Sockets are in-memory fakes, so the numbers are pure
+ConnectionManager overhead. The old linear scan is timed alongside for
+comparison.
+
+    python benchmarks/bench_connection_index.py [--sizes 10,100,1000,10000,50000]
+"""
+import argparse
+import asyncio
+import logging
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from main import AgentConnection, ClientSession, ConnectionManager, logger  # noqa: E402
+from outbound import OutboundQueue  # noqa: E402
+
+CLIENTS_PER_AGENT = 50
+
+
+class FakeClient:
+    host = "127.0.0.1"
+
+
+class FakeWebSocket:
+    headers = {"user-agent": "bench"}
+    query_params = {}
+    client = FakeClient()
+
+    async def accept(self):
+        pass
+
+    async def send_text(self, text):
+        pass
+
+    async def close(self, code=1000, reason=None):
+        pass
+
+
+def build_manager(size):
+    """Must run inside the event loop: sessions start their outbound writer tasks"""
+    manager = ConnectionManager()
+    agent = None
+    sessions = []
+    for i in range(size):
+        if agent is None or not agent.has_capacity():
+            agent = AgentConnection(FakeWebSocket(), {"username": f"agent{len(manager.agents)}"}, CLIENTS_PER_AGENT, set())
+            agent.outbound = OutboundQueue(agent.websocket, agent.agent_id, 1000, "drop_oldest")
+            manager.agents[agent.agent_id] = agent
+        ws = FakeWebSocket()
+        session = ClientSession(f"client-{i}", ws, {"client_ip": "127.0.0.1", "user_agent": "bench", "conversation_id": str(i)})
+        session.state = ClientSession.ACTIVE
+        session.agent_id = agent.agent_id
+        manager.active_clients[session.client_id] = session
+        manager.sessions_by_socket[id(ws)] = session
+        agent.client_ids.add(session.client_id)
+        sessions.append(session)
+    return manager, sessions
+
+
+def legacy_is_client_active(active_clients, websocket):
+    """The pre-index lookup: walk every active client comparing sockets"""
+    for client_id, session in active_clients.items():
+        if session.websocket is websocket:
+            return client_id
+    return None
+
+
+async def time_messages(manager, sessions, samples):
+    picks = [random.choice(sessions) for _ in range(samples)]
+    start = time.perf_counter()
+    for session in picks:
+        client_id = manager.is_client_active(session.websocket)
+        await manager.forward_user_message_to_admin(client_id, "hello")
+    return (time.perf_counter() - start) / samples
+
+
+def time_legacy_lookup(manager, sessions, samples):
+    picks = [random.choice(sessions) for _ in range(samples)]
+    start = time.perf_counter()
+    for session in picks:
+        legacy_is_client_active(manager.active_clients, session.websocket)
+    return (time.perf_counter() - start) / samples
+
+
+async def time_disconnects(manager, sessions, samples):
+    picks = random.sample(sessions, min(samples, len(sessions)))
+    start = time.perf_counter()
+    for session in picks:
+        await manager.remove_session(session)
+    return (time.perf_counter() - start) / len(picks)
+
+
+async def main(sizes, samples, legacy_samples):
+    logger.setLevel(logging.WARNING)
+    print(f"{'connections':>12} {'per message (us)':>18} {'disconnect (us)':>16} {'legacy scan (us)':>17}")
+    for size in sizes:
+        manager, sessions = build_manager(size)
+        await asyncio.sleep(0)
+        per_message = await time_messages(manager, sessions, samples)
+        legacy = time_legacy_lookup(manager, sessions, legacy_samples)
+        per_disconnect = await time_disconnects(manager, sessions, min(samples, size // 2 or 1))
+        print(f"{size:>12} {per_message * 1e6:>18.2f} {per_disconnect * 1e6:>16.2f} {legacy * 1e6:>17.2f}")
+        for session in sessions:
+            await session.outbound.aclose()
+        for agent in manager.agents.values():
+            await agent.outbound.aclose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", default="10,100,1000,10000,50000")
+    parser.add_argument("--samples", type=int, default=20000)
+    parser.add_argument("--legacy-samples", type=int, default=200)
+    args = parser.parse_args()
+    asyncio.run(main([int(s) for s in args.sizes.split(",")], args.samples, args.legacy_samples))
@@ -0,0 +1,81 @@
+"""Time spent in logger.info() on the calling thread, direct file logging vs the queued pipeline.
+
+A stalled disk is modelled by a file handler that sleeps before each write.
+With the old basicConfig setup every log call on the event loop pays that
+stall; with log_pipeline only the listener thread does.
+
+    python benchmarks/bench_logging.py [--records 2000] [--stall-ms 2]
+"""
+import argparse
+import logging
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from log_pipeline import JsonFormatter, setup_logging  # noqa: E402
+
+
+class SlowFileHandler(logging.FileHandler):
+    def __init__(self, filename, stall):
+        super().__init__(filename)
+        self.stall = stall
+
+    def emit(self, record):
+        time.sleep(self.stall)
+        super().emit(record)
+
+
+def time_calls(logger, records):
+    latencies = []
+    for i in range(records):
+        start = time.perf_counter()
+        logger.info(f"Client {i} sent a message", extra={"category": "client_message", "client_id": str(i), "body": "hello"})
+        latencies.append(time.perf_counter() - start)
+    latencies.sort()
+    return sum(latencies) / len(latencies) * 1e6, latencies[int(len(latencies) * 0.99)] * 1e6
+
+
+def reset_root():
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+        handler.close()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--records", type=int, default=2000)
+    parser.add_argument("--stall-ms", type=float, default=2.0, help="simulated disk stall per write")
+    args = parser.parse_args()
+    stall = args.stall_ms / 1000
+    logger = logging.getLogger("bench")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        print(f"{args.records} records, {args.stall_ms} ms disk stall per write")
+        print(f"{'setup':>34} {'mean us':>10} {'p99 us':>10}")
+
+        reset_root()
+        handler = SlowFileHandler(os.path.join(tmp, "direct.log"), stall)
+        handler.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
+        logging.getLogger().addHandler(handler)
+        logging.getLogger().setLevel(logging.INFO)
+        mean, p99 = time_calls(logger, args.records)
+        print(f"{'direct FileHandler':>34} {mean:>10.1f} {p99:>10.1f}")
+
+        for label, sample_rates in (("queued, every record", {}), ("queued, client_message sampled 10%", {"client_message": 0.1})):
+            reset_root()
+            pipeline = setup_logging(os.path.join(tmp, "queued.log"), queue_size=args.records * 2, sample_rates=sample_rates)
+            slow = SlowFileHandler(os.path.join(tmp, "queued.log"), stall)
+            slow.setFormatter(JsonFormatter())
+            pipeline.listener.handlers = (slow,)
+            mean, p99 = time_calls(logger, args.records)
+            print(f"{label:>34} {mean:>10.1f} {p99:>10.1f}")
+            pipeline.stop()
+        reset_root()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,46 @@
+"""Per-update cost of the metrics primitives on the hot path, and of a full /metrics render.
+
+    python benchmarks/bench_metrics.py [--repeat 1000000]
+"""
+import argparse
+import os
+import random
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from metrics import Counter, Histogram, Registry  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeat", type=int, default=1000000)
+    args = parser.parse_args()
+
+    registry = Registry()
+    counter = Counter("bench_total", "Counter", registry=registry)
+    histogram = Histogram("bench_seconds", "Histogram", ["direction"], registry)
+    child = histogram.labels("client_to_admin")
+    samples = [random.expovariate(1000) for _ in range(1024)]
+
+    def observe():
+        for value in samples:
+            child.observe(value)
+
+    def observe_lookup():
+        for value in samples:
+            histogram.labels("client_to_admin").observe(value)
+
+    n = args.repeat
+    print(f"{'operation':>32} {'ns/op':>8}")
+    print(f"{'counter.inc()':>32} {timeit.timeit(counter.inc, number=n) / n * 1e9:>8.0f}")
+    rounds = max(1, n // len(samples))
+    print(f"{'cached child.observe()':>32} {timeit.timeit(observe, number=rounds) / (rounds * len(samples)) * 1e9:>8.0f}")
+    print(f"{'labels(...).observe()':>32} {timeit.timeit(observe_lookup, number=rounds) / (rounds * len(samples)) * 1e9:>8.0f}")
+    renders = 1000
+    print(f"{'registry.render() (us)':>32} {timeit.timeit(registry.render, number=renders) / renders * 1e6:>8.1f}")
+
+
+if __name__ == "__main__":
+    main()
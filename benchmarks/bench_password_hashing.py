@@ -0,0 +1,81 @@
+"""Login throughput and event-loop latency during a burst of password checks.
+
+Runs a burst of concurrent scrypt verifications, the same work /login does,
+while a ticker task measures how late the event loop wakes it up; that lag is
+added to every websocket frame the process handles during the burst. Compares
+hashing inline on the loop against the PasswordHasher thread pool.
+
+    python benchmarks/bench_password_hashing.py [--logins 64] [--workers 2,4] [--n 16384]
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from password_hashing import PasswordHasher  # noqa: E402
+
+TICK = 0.005
+
+
+async def ticker(lags, stop):
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(TICK)
+        lags.append(time.perf_counter() - start - TICK)
+
+
+async def burst(verify, logins):
+    lags = []
+    stop = asyncio.Event()
+    tick_task = asyncio.create_task(ticker(lags, stop))
+    await asyncio.sleep(TICK * 2)
+    start = time.perf_counter()
+    await asyncio.gather(*(verify() for _ in range(logins)))
+    elapsed = time.perf_counter() - start
+    stop.set()
+    await tick_task
+    lags = sorted(lags) or [0.0]
+    return {
+        "logins_per_s": logins / elapsed,
+        "lag_p50_ms": statistics.median(lags) * 1000,
+        "lag_p99_ms": lags[min(len(lags) - 1, int(len(lags) * 0.99))] * 1000,
+        "lag_max_ms": lags[-1] * 1000,
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--logins", type=int, default=64)
+    parser.add_argument("--workers", default="1,2,4")
+    parser.add_argument("--n", type=int, default=2 ** 14)
+    args = parser.parse_args()
+
+    reference = PasswordHasher(n=args.n, max_workers=1)
+    stored = reference.hash_sync("correct horse battery staple")
+    reference.shutdown()
+
+    async def inline_verify():
+        reference.verify_sync("correct horse battery staple", stored)
+
+    print(f"{args.logins} logins, scrypt n={args.n}")
+    print(f"{'mode':>18} {'logins/s':>10} {'lag p50 ms':>11} {'lag p99 ms':>11} {'lag max ms':>11}")
+    rows = [("inline on loop", await burst(inline_verify, args.logins))]
+    for workers in (int(w) for w in args.workers.split(",")):
+        hasher = PasswordHasher(n=args.n, max_workers=workers)
+
+        async def pooled_verify():
+            await hasher.verify("correct horse battery staple", stored)
+
+        rows.append((f"pool, {workers} workers", await burst(pooled_verify, args.logins)))
+        hasher.shutdown()
+    for mode, result in rows:
+        print(f"{mode:>18} {result['logins_per_s']:>10.1f} {result['lag_p50_ms']:>11.2f} "
+              f"{result['lag_p99_ms']:>11.2f} {result['lag_max_ms']:>11.2f}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,92 @@
+"""Encoding cost of the frames the server actually sends, per JSON backend.
+
+Times stdlib json against orjson (when installed) for each frame type: user
+and admin messages, list deltas, full list snapshots and decoding an admin
+frame. Also compares encoding a snapshot per send against the encode-once
+EncodedFrame path used for repeated sends of the same snapshot version.
+
+    python benchmarks/bench_serializer.py [--clients 50] [--repeat 20000]
+"""
+import argparse
+import json
+import os
+import sys
+import timeit
+import uuid
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import serializer  # noqa: E402
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def client_info(i):
+    return {
+        "user_agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/124.0",
+        "client_ip": f"10.0.{i // 256}.{i % 256}",
+        "conversation_id": str(uuid.uuid4()),
+    }
+
+
+def build_frames(clients):
+    infos = [client_info(i) for i in range(clients)]
+    ids = [str(uuid.uuid4()) for _ in range(clients)]
+    return {
+        "user_message": {"type": "user_message", "client_id": ids[0], "message": "Hello, I need help with my order #4521",
+                         "client_info": infos[0]},
+        "admin_message": {"type": "admin_message", "message": "Sure, let me look that up for you."},
+        "client_list_delta": {"type": "client_list_delta", "version": 42,
+                              "ops": [{"op": "add", "client": {"id": ids[1], "info": infos[1]}}]},
+        "pending_requests_delta": {"type": "pending_requests_delta", "version": 17,
+                                   "ops": [{"op": "add", "request": {"request_id": ids[2], "conversation_id": infos[2]["conversation_id"],
+                                                                     "client_info": infos[2]}}]},
+        "client_list_update": {"type": "client_list_update", "version": 42,
+                               "clients": [{"id": cid, "info": info} for cid, info in zip(ids, infos)]},
+        "pending_requests_list": {"type": "pending_requests_list", "version": 17,
+                                  "requests": [{"request_id": cid, "conversation_id": info["conversation_id"], "client_info": info}
+                                               for cid, info in zip(ids, infos)]},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--clients", type=int, default=50, help="entries in the list snapshots")
+    parser.add_argument("--repeat", type=int, default=20000)
+    args = parser.parse_args()
+
+    backends = {"json": lambda obj: json.dumps(obj)}
+    decoders = {"json": json.loads}
+    if orjson is not None:
+        backends["orjson"] = lambda obj: orjson.dumps(obj).decode()
+        decoders["orjson"] = orjson.loads
+    else:
+        print("orjson not installed; only timing stdlib json")
+
+    frames = build_frames(args.clients)
+    print(f"active serializer backend: {serializer.BACKEND}")
+    print(f"{'frame':>24} {'bytes':>7} " + " ".join(f"{name + ' us':>10}" for name in backends))
+    for name, frame in frames.items():
+        timings = [timeit.timeit(lambda: encode(frame), number=args.repeat) / args.repeat * 1e6 for encode in backends.values()]
+        print(f"{name:>24} {len(json.dumps(frame)):>7} " + " ".join(f"{t:>10.2f}" for t in timings))
+
+    admin_frame = json.dumps({"type": "admin_message_to_client", "target_client_id": str(uuid.uuid4()),
+                              "message": "Sure, let me look that up for you."})
+    timings = [timeit.timeit(lambda: decode(admin_frame), number=args.repeat) / args.repeat * 1e6 for decode in decoders.values()]
+    print(f"{'decode admin frame':>24} {len(admin_frame):>7} " + " ".join(f"{t:>10.2f}" for t in timings))
+
+    # A snapshot resent (resync, coalesced backlog) without its version changing
+    snapshot = frames["client_list_update"]
+    sends = 10
+    per_send = timeit.timeit(lambda: [serializer.frame_payload(snapshot) for _ in range(sends)], number=args.repeat // 10)
+    encoded = serializer.encode_frame(snapshot)
+    once = timeit.timeit(lambda: [serializer.frame_payload(encoded) for _ in range(sends)], number=args.repeat // 10)
+    print(f"\n{sends} sends of one snapshot: encode per send {per_send / (args.repeat // 10) * 1e6:.1f} us, "
+          f"encode once {once / (args.repeat // 10) * 1e6:.1f} us")
+
+
+if __name__ == "__main__":
+    main()
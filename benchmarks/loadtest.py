@@ -0,0 +1,447 @@
+"""Load test: N visitors and M admins against a server started locally for the run.
+
+Starts the app in a child process with the --storage engine: memory (the
+default, so the database is out of the picture), sqlite in a temporary file,
+or postgres against a throwaway database given with --database-url (migrated
+on startup). It then:
+
+1. connects M admins to /admin, each accepting every request routed to it
+2. opens N visitors on /ws and waits for each to be approved
+3. has every visitor send --messages chat messages; admins echo each one
+
+Reported, and written as JSON to --output:
+
+- approval latency: visitor connect -> connection_approved
+- forwarding latency: visitor send -> admin receive, admin send -> visitor receive
+- message throughput over the chat phase
+- server RSS per connection (from /proc/<pid>/status) and the server's /api/stats
+
+Pass --baseline with an earlier result file to exit 1 if a latency,
+throughput or memory figure regressed by more than --tolerance.
+
+    python benchmarks/loadtest.py --visitors 500 --admins 5 --messages 20 --output results.json
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import platform
+import secrets
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+
+import httpx  # noqa: E402
+import websockets  # noqa: E402
+
+MESSAGE_PREFIX = "lt:"
+
+
+# --- Server side -------------------------------------------------------------------------------
+
+def serve(port: int):
+    import uvicorn
+
+    import main as chatserver
+
+    uvicorn.run(chatserver.app, host="127.0.0.1", port=port, log_level="warning",
+                ws_per_message_deflate=chatserver.WS_PER_MESSAGE_DEFLATE,
+                ws_ping_interval=chatserver.WS_PING_INTERVAL_SECONDS, ws_ping_timeout=chatserver.WS_PING_TIMEOUT_SECONDS)
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def rss_kb(pid: int) -> Optional[int]:
+    try:
+        with open(f"/proc/{pid}/status") as status:
+            for line in status:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+def start_server(args, port: int, workdir: str) -> subprocess.Popen:
+    env = dict(os.environ)
+    env.update({
+        "LOG_FILE": os.path.join(workdir, "server.log"),
+        # Enough capacity that visitors are routed rather than queued, unless set explicitly
+        "AGENT_MAX_CLIENTS": str(args.agent_capacity or max(10, math.ceil(args.visitors / args.admins))),
+    })
+    env["STORAGE_ENGINE"] = args.storage
+    env.setdefault("SECRET_KEY", secrets.token_urlsafe(32))
+    # Every visitor comes from 127.0.0.1, so per-IP limits would shed the load being measured
+    for limit in ("CLIENT_CONNECT_RATE_PER_IP", "CLIENT_MESSAGE_RATE_PER_IP", "CLIENT_MESSAGE_RATE_PER_CONNECTION"):
+        env.setdefault(limit, "0")
+    env.setdefault("CLIENT_MAX_CONNECTIONS", "0")
+    if args.storage == "postgres":
+        env.update({"DATABASE_URL": args.database_url, "AUTO_MIGRATE": "true"})
+    elif args.storage == "sqlite":
+        env["SQLITE_PATH"] = os.path.join(workdir, "chatserver.db")
+    return subprocess.Popen([sys.executable, os.path.abspath(__file__), "--serve", "--port", str(port)],
+                            cwd=ROOT, env=env)
+
+
+async def wait_until_ready(base_url: str, server: subprocess.Popen, timeout: float = 30.0):
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient() as client:
+        while time.monotonic() < deadline:
+            if server.poll() is not None:
+                raise RuntimeError(f"Server exited with code {server.returncode}")
+            try:
+                if (await client.get(f"{base_url}/login")).status_code == 200:
+                    return
+            except httpx.TransportError:
+                pass
+            await asyncio.sleep(0.1)
+    raise RuntimeError("Server did not become ready")
+
+
+async def admin_tokens(args, base_url: str) -> List[str]:
+    tokens = []
+    async with httpx.AsyncClient() as client:
+        for _ in range(args.admins):
+            response = await client.post(f"{base_url}/login", data={"username": args.admin_username, "password": args.admin_password})
+            cookie = response.cookies.get("access_token")
+            if not cookie:
+                raise RuntimeError(f"Login as {args.admin_username} failed ({response.status_code})")
+            tokens.append(cookie.strip('"').split(" ", 1)[-1])
+    return tokens
+
+
+# --- Load generator ----------------------------------------------------------------------------
+
+class Results:
+    def __init__(self, visitors: int, messages: int, echo: bool):
+        self.expected_to_admin = visitors * messages
+        self.expected_to_client = self.expected_to_admin if echo else 0
+        self.approval: List[float] = []
+        self.client_to_admin: List[float] = []
+        self.admin_to_client: List[float] = []
+        self.errors: List[str] = []
+        self.all_approved = asyncio.Event()
+        self.chat_done = asyncio.Event()
+        self.chat_started_at: Optional[float] = None
+        self.chat_finished_at: Optional[float] = None
+        self.visitors = visitors
+
+    def approved(self, latency: float):
+        self.approval.append(latency)
+        if len(self.approval) + len(self.errors) >= self.visitors:
+            self.all_approved.set()
+
+    def failed(self, error: str):
+        self.errors.append(error)
+        if len(self.approval) + len(self.errors) >= self.visitors:
+            self.all_approved.set()
+
+    def delivered(self):
+        if (len(self.client_to_admin) >= self.expected_to_admin
+                and len(self.admin_to_client) >= self.expected_to_client):
+            self.chat_finished_at = time.perf_counter()
+            self.chat_done.set()
+
+
+def stamp() -> str:
+    return f"{MESSAGE_PREFIX}{time.perf_counter()!r}"
+
+
+def elapsed_since(message: str) -> Optional[float]:
+    if isinstance(message, str) and message.startswith(MESSAGE_PREFIX):
+        return time.perf_counter() - float(message[len(MESSAGE_PREFIX):])
+    return None
+
+
+async def run_admin(url: str, results: Results, echo: bool, connected: asyncio.Event):
+    async with websockets.connect(url, max_size=None) as ws:
+        connected.set()
+
+        async def accept(request_id: str):
+            await ws.send(json.dumps({"type": "connection_response", "request_id": request_id, "action": "accept"}))
+
+        async def received(client_id: str, message: str):
+            latency = elapsed_since(message)
+            if latency is None:
+                return
+            results.client_to_admin.append(latency)
+            results.delivered()
+            if echo:
+                await ws.send(json.dumps({"type": "admin_message_to_client", "target_client_id": client_id, "message": stamp()}))
+
+        async for raw in ws:
+            frame = json.loads(raw)
+            kind = frame.get("type")
+            if kind == "pending_requests_list":
+                for request in frame["requests"]:
+                    await accept(request["request_id"])
+            elif kind == "pending_requests_delta":
+                for op in frame["ops"]:
+                    if op["op"] == "add":
+                        await accept(op["request"]["request_id"])
+            elif kind == "user_message":
+                await received(frame["client_id"], frame["message"])
+            elif kind == "user_message_batch":
+                for message in frame["messages"]:
+                    await received(message["client_id"], message["message"])
+
+
+async def run_visitor(url: str, args, results: Results, connect_slots: asyncio.Semaphore, chat_start: asyncio.Event):
+    try:
+        async with connect_slots:
+            started = time.perf_counter()
+            ws = await websockets.connect(url, max_size=None)
+            while True:
+                frame = json.loads(await ws.recv())
+                if frame.get("type") == "connection_approved":
+                    break
+                if frame.get("type") in ("connection_rejected", "error"):
+                    raise RuntimeError(frame.get("message"))
+            results.approved(time.perf_counter() - started)
+    except Exception as e:
+        results.failed(f"connect: {e!r}")
+        return
+
+    async def read_replies():
+        async for raw in ws:
+            frame = json.loads(raw)
+            if frame.get("type") == "admin_message":
+                latency = elapsed_since(frame["message"])
+                if latency is not None:
+                    results.admin_to_client.append(latency)
+                    results.delivered()
+
+    reader = asyncio.create_task(read_replies())
+    try:
+        await chat_start.wait()
+        for _ in range(args.messages):
+            await ws.send(stamp())
+            if args.message_interval:
+                await asyncio.sleep(args.message_interval)
+        await results.chat_done.wait()
+    except Exception as e:
+        results.errors.append(f"chat: {e!r}")
+    finally:
+        reader.cancel()
+        await ws.close()
+
+
+def summarize(values: List[float]) -> Dict[str, float]:
+    """Count and millisecond percentiles"""
+    if not values:
+        return {"count": 0}
+    ordered = sorted(values)
+
+    def percentile(p):
+        return ordered[min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))] * 1000
+
+    return {
+        "count": len(ordered),
+        "mean_ms": sum(ordered) / len(ordered) * 1000,
+        "p50_ms": percentile(50),
+        "p90_ms": percentile(90),
+        "p99_ms": percentile(99),
+        "max_ms": ordered[-1] * 1000,
+    }
+
+
+async def run_load(args, base_url: str, ws_url: str, server: subprocess.Popen) -> Dict:
+    tokens = await admin_tokens(args, base_url)
+    results = Results(args.visitors, args.messages, not args.no_echo)
+    rss = {"baseline_kb": rss_kb(server.pid)}
+
+    admins = []
+    for token in tokens:
+        connected = asyncio.Event()
+        admins.append(asyncio.create_task(run_admin(f"{ws_url}/admin?token={token}", results, not args.no_echo, connected)))
+        await asyncio.wait_for(connected.wait(), args.timeout)
+
+    chat_start = asyncio.Event()
+    connect_slots = asyncio.Semaphore(args.connect_concurrency)
+    connect_started = time.perf_counter()
+    visitors = [
+        asyncio.create_task(run_visitor(f"{ws_url}/ws?conversation_id=loadtest-{i}", args, results, connect_slots, chat_start))
+        for i in range(args.visitors)
+    ]
+    try:
+        await asyncio.wait_for(results.all_approved.wait(), args.timeout)
+    except asyncio.TimeoutError:
+        results.errors.append(f"only {len(results.approval)} of {args.visitors} visitors approved within {args.timeout}s")
+    connect_seconds = time.perf_counter() - connect_started
+    rss["connected_kb"] = rss_kb(server.pid)
+
+    results.chat_started_at = time.perf_counter()
+    chat_start.set()
+    if results.expected_to_admin == 0:
+        results.chat_done.set()
+    try:
+        await asyncio.wait_for(results.chat_done.wait(), args.timeout)
+    except asyncio.TimeoutError:
+        results.errors.append(f"chat phase incomplete after {args.timeout}s")
+        results.chat_finished_at = time.perf_counter()
+        results.chat_done.set()
+    rss["after_chat_kb"] = rss_kb(server.pid)
+
+    async with httpx.AsyncClient() as client:
+        stats = (await client.get(f"{base_url}/api/stats", headers={"Authorization": f"Bearer {tokens[0]}"})).json()
+
+    await asyncio.gather(*visitors, return_exceptions=True)
+    for task in admins:
+        task.cancel()
+    await asyncio.gather(*admins, return_exceptions=True)
+
+    chat_seconds = (results.chat_finished_at or time.perf_counter()) - results.chat_started_at
+    delivered = len(results.client_to_admin) + len(results.admin_to_client)
+    connections = args.visitors + args.admins
+    if rss["baseline_kb"] is not None and rss["connected_kb"] is not None:
+        rss["per_connection_kb"] = (rss["connected_kb"] - rss["baseline_kb"]) / connections
+    return {
+        "approval": dict(summarize(results.approval), connect_phase_s=connect_seconds),
+        "forwarding": {
+            "client_to_admin": summarize(results.client_to_admin),
+            "admin_to_client": summarize(results.admin_to_client),
+        },
+        "throughput": {
+            "messages_delivered": delivered,
+            "chat_phase_s": chat_seconds,
+            "messages_per_s": delivered / chat_seconds if chat_seconds > 0 else 0.0,
+        },
+        "rss": rss,
+        "errors": results.errors[:50],
+        "error_count": len(results.errors),
+        "server_stats": stats,
+    }
+
+
+# --- Reporting ---------------------------------------------------------------------------------
+
+# (path into the results, True if higher is better)
+TRACKED = [
+    (("approval", "p99_ms"), False),
+    (("forwarding", "client_to_admin", "p99_ms"), False),
+    (("forwarding", "admin_to_client", "p99_ms"), False),
+    (("throughput", "messages_per_s"), True),
+    (("rss", "per_connection_kb"), False),
+]
+
+
+def lookup(results: Dict, path) -> Optional[float]:
+    for key in path:
+        if not isinstance(results, dict) or key not in results:
+            return None
+        results = results[key]
+    return results
+
+
+def regressions(current: Dict, baseline: Dict, tolerance: float) -> List[str]:
+    found = []
+    for path, higher_is_better in TRACKED:
+        now, before = lookup(current["results"], path), lookup(baseline["results"], path)
+        if now is None or not before:
+            continue
+        change = (now - before) / before
+        if (-change if higher_is_better else change) > tolerance:
+            found.append(f"{'.'.join(path)}: {before:.2f} -> {now:.2f} ({change:+.0%})")
+    return found
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=ROOT, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_summary(report: Dict):
+    results = report["results"]
+    print(f"approval        {results['approval']}")
+    for direction, summary in results["forwarding"].items():
+        print(f"{direction:<15} {summary}")
+    print(f"throughput      {results['throughput']}")
+    print(f"rss             {results['rss']}")
+    print(f"errors          {results['error_count']}")
+
+
+async def run(args) -> int:
+    port = args.port or free_port()
+    base_url, ws_url = f"http://127.0.0.1:{port}", f"ws://127.0.0.1:{port}"
+    with tempfile.TemporaryDirectory() as workdir:
+        server = start_server(args, port, workdir)
+        try:
+            await wait_until_ready(base_url, server)
+            results = await run_load(args, base_url, ws_url, server)
+        finally:
+            server.terminate()
+            try:
+                server.wait(10)
+            except subprocess.TimeoutExpired:
+                server.kill()
+
+    report = {
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "git_commit": git_commit(),
+        "python": platform.python_version(),
+        "database": args.storage,
+        "config": {key: getattr(args, key) for key in ("visitors", "admins", "messages", "message_interval",
+                                                       "connect_concurrency", "no_echo")},
+        "results": results,
+    }
+    print_summary(report)
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump(report, output, indent=2)
+        print(f"results written to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            found = regressions(report, json.load(baseline_file), args.tolerance)
+        for regression in found:
+            print(f"REGRESSION {regression}")
+        if found:
+            return 1
+    return 1 if results["error_count"] else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--visitors", type=int, default=200)
+    parser.add_argument("--admins", type=int, default=4)
+    parser.add_argument("--messages", type=int, default=10, help="chat messages per visitor")
+    parser.add_argument("--message-interval", type=float, default=0.0, help="seconds between a visitor's messages")
+    parser.add_argument("--connect-concurrency", type=int, default=50, help="visitor handshakes in flight at once")
+    parser.add_argument("--no-echo", action="store_true", help="admins don't reply, so only client->admin is measured")
+    parser.add_argument("--agent-capacity", type=int, default=0, help="AGENT_MAX_CLIENTS for the server (default: enough for every visitor)")
+    parser.add_argument("--timeout", type=float, default=120.0, help="seconds allowed per phase")
+    parser.add_argument("--storage", choices=("memory", "sqlite", "postgres"), default="memory", help="server storage engine")
+    parser.add_argument("--database-url", default="", help="throwaway Postgres to migrate and use with --storage postgres")
+    parser.add_argument("--admin-username", default="admin", help="admin login (the default is seeded by every engine)")
+    parser.add_argument("--admin-password", default="admin123")
+    parser.add_argument("--output", default="", help="write results as JSON to this file")
+    parser.add_argument("--baseline", default="", help="earlier results to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed relative regression against the baseline")
+    parser.add_argument("--port", type=int, default=0)
+    parser.add_argument("--serve", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args.port)
+        return
+    if args.storage == "postgres" and not args.database_url:
+        parser.error("--storage postgres needs --database-url")
+    sys.exit(asyncio.run(run(args)))
+
+
+if __name__ == "__main__":
+    main()
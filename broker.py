@@ -0,0 +1,222 @@
+import asyncio
+import logging
+import os
+import sys
+import uuid
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from serializer import dumps, loads
+
+logger = logging.getLogger(__name__)
+
+EventHandler = Callable[[Dict[str, Any]], Awaitable[None]]
+ConnectHandler = Callable[[], Awaitable[None]]
+
+# Hub wire format: one event per line, "<target node or *>\t<json>\n". The hub only
+# reads the target, so it never has to parse the event itself.
+BROADCAST = "*"
+STREAM_LIMIT = 16 * 1024 * 1024
+
+
+class Broker:
+    """Relays ConnectionManager events between processes.
+
+    Every event published is delivered to every *other* node, or only to the
+    node named in its ``to`` key. Events from one node arrive in the order
+    they were published. ``on_connect`` runs after every (re)connection so
+    the manager can re-announce its local state.
+    """
+
+    def __init__(self, node_id: Optional[str] = None):
+        self.node_id = node_id or uuid.uuid4().hex[:12]
+        self._handler: Optional[EventHandler] = None
+        self._on_connect: Optional[ConnectHandler] = None
+
+    async def start(self, handler: EventHandler, on_connect: ConnectHandler):
+        raise NotImplementedError
+
+    async def publish(self, event: Dict[str, Any]):
+        raise NotImplementedError
+
+    async def stop(self):
+        pass
+
+    async def _dispatch(self, event: Dict[str, Any]):
+        try:
+            await self._handler(event)
+        except Exception as e:
+            logger.error(f"Error handling broker event {event.get('op')}: {e}", exc_info=True)
+
+
+class InProcessHub:
+    """Connects InProcessBrokers living in the same process (tests, benchmarks)"""
+    def __init__(self):
+        self.brokers: Dict[str, "InProcessBroker"] = {}
+
+
+default_hub = InProcessHub()
+
+
+class InProcessBroker(Broker):
+    """Broker for managers sharing one event loop. With a single manager it does nothing."""
+
+    def __init__(self, hub: Optional[InProcessHub] = None, node_id: Optional[str] = None):
+        super().__init__(node_id)
+        self.hub = hub or default_hub
+        self._queue: "asyncio.Queue[Dict[str, Any]]" = asyncio.Queue()
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self, handler, on_connect):
+        self._handler = handler
+        self.hub.brokers[self.node_id] = self
+        self._task = asyncio.create_task(self._run())
+        await on_connect()
+
+    async def _run(self):
+        while True:
+            await self._dispatch(await self._queue.get())
+
+    async def publish(self, event):
+        target = event.get("to")
+        if target:
+            peers = [self.hub.brokers[target]] if target in self.hub.brokers else []
+        else:
+            peers = [broker for node, broker in self.hub.brokers.items() if node != self.node_id]
+        if not peers:
+            return
+        # Round-trip through JSON so peers never share mutable state with us
+        encoded = dumps(dict(event, node=self.node_id))
+        for peer in peers:
+            peer._queue.put_nowait(loads(encoded))
+
+    async def stop(self):
+        if self.hub.brokers.pop(self.node_id, None) is not None:
+            for peer in self.hub.brokers.values():
+                peer._queue.put_nowait({"op": "node_down", "node": self.node_id})
+        if self._task:
+            self._task.cancel()
+
+
+class UnixSocketBroker(Broker):
+    """Broker talking to a BrokerHub over a Unix domain socket.
+
+    Reconnects with backoff if the hub goes away; ``on_connect`` then lets the
+    manager publish its local state again.
+    """
+
+    def __init__(self, path: str, node_id: Optional[str] = None, reconnect_delay: float = 1.0):
+        super().__init__(node_id)
+        self.path = path
+        self.reconnect_delay = reconnect_delay
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self, handler, on_connect):
+        self._handler = handler
+        self._on_connect = on_connect
+        await self._connect()
+        self._task = asyncio.create_task(self._run())
+
+    async def _connect(self):
+        reader, writer = await asyncio.open_unix_connection(self.path, limit=STREAM_LIMIT)
+        writer.write(f"{BROADCAST}\t{dumps({'op': 'hello', 'node': self.node_id})}\n".encode())
+        self._reader, self._writer = reader, writer
+        logger.info(f"Broker node {self.node_id} connected to hub at {self.path}")
+        await self._on_connect()
+
+    async def _run(self):
+        while True:
+            try:
+                while True:
+                    line = await self._reader.readline()
+                    if not line:
+                        break
+                    await self._dispatch(loads(line))
+            except (ConnectionError, asyncio.IncompleteReadError) as e:
+                logger.warning(f"Lost broker hub connection: {e}")
+            self._writer = None
+            logger.warning(f"Broker hub at {self.path} went away. Reconnecting.")
+            while self._writer is None:
+                await asyncio.sleep(self.reconnect_delay)
+                try:
+                    await self._connect()
+                except OSError as e:
+                    logger.warning(f"Broker hub reconnect failed: {e}")
+
+    async def publish(self, event):
+        if self._writer is None:
+            logger.warning(f"Dropping broker event {event.get('op')}: hub not connected")
+            return
+        target = event.get("to") or BROADCAST
+        self._writer.write(f"{target}\t{dumps(dict(event, node=self.node_id))}\n".encode())
+        await self._writer.drain()
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+        if self._writer is not None:
+            self._writer.close()
+
+
+class BrokerHub:
+    """Fan-out hub for UnixSocketBrokers: run one per host with ``python broker.py hub PATH``"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.nodes: Dict[str, asyncio.StreamWriter] = {}
+
+    async def serve_forever(self):
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        server = await asyncio.start_unix_server(self._handle, self.path, limit=STREAM_LIMIT)
+        logger.info(f"Broker hub listening on {self.path}")
+        async with server:
+            await server.serve_forever()
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        hello = await reader.readline()
+        if not hello:
+            writer.close()
+            return
+        node = loads(hello.split(b"\t", 1)[1])["node"]
+        self.nodes[node] = writer
+        logger.info(f"Node {node} joined ({len(self.nodes)} connected)")
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                target, _, _ = line.partition(b"\t")
+                self._forward(node, target.decode(), line[len(target) + 1:])
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            self.nodes.pop(node, None)
+            writer.close()
+            logger.info(f"Node {node} left ({len(self.nodes)} connected)")
+            self._forward(node, BROADCAST, (dumps({"op": "node_down", "node": node}) + "\n").encode())
+
+    def _forward(self, source: str, target: str, payload: bytes):
+        if target == BROADCAST:
+            for node, writer in self.nodes.items():
+                if node != source:
+                    writer.write(payload)
+        elif target in self.nodes:
+            self.nodes[target].write(payload)
+
+
+def create_broker(url: str) -> Broker:
+    """Build a broker from a URL: ``memory://`` or ``unix:///path/to/hub.sock``"""
+    if not url or url.startswith("memory://"):
+        return InProcessBroker()
+    if url.startswith("unix://"):
+        return UnixSocketBroker(url[len("unix://"):])
+    raise ValueError(f"Unsupported BROKER_URL '{url}'. Use memory:// or unix:///path/to/hub.sock")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3 or sys.argv[1] != "hub":
+        print("usage: python broker.py hub /path/to/hub.sock")
+        sys.exit(1)
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    asyncio.run(BrokerHub(sys.argv[2]).serve_forever())
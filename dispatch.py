@@ -0,0 +1,72 @@
+from typing import Dict, List, Optional, Type
+
+
+class DispatchPolicy:
+    """Chooses which connected agent a pending connection request is routed to.
+
+    ``select`` only ever receives agents that still have spare capacity, and
+    returns ``None`` when none of them should take the request.
+    """
+    name = "base"
+
+    def select(self, agents: List["AgentConnection"], client_info: Dict[str, str]) -> Optional["AgentConnection"]:
+        raise NotImplementedError
+
+
+class LeastActiveDispatchPolicy(DispatchPolicy):
+    """Route to the agent currently handling the fewest clients"""
+    name = "least_active"
+
+    def select(self, agents, client_info):
+        if not agents:
+            return None
+        return min(agents, key=lambda agent: agent.load)
+
+
+class RoundRobinDispatchPolicy(DispatchPolicy):
+    """Route to agents in turn, skipping the ones that are full"""
+    name = "round_robin"
+
+    def __init__(self):
+        self._counter = 0
+
+    def select(self, agents, client_info):
+        if not agents:
+            return None
+        agent = agents[self._counter % len(agents)]
+        self._counter += 1
+        return agent
+
+
+class SkillTagDispatchPolicy(DispatchPolicy):
+    """Route to an agent advertising the client's requested skill.
+
+    Clients without a skill tag, or whose skill no available agent has, fall
+    back to ``fallback`` (least active by default).
+    """
+    name = "skill"
+
+    def __init__(self, fallback: Optional[DispatchPolicy] = None):
+        self.fallback = fallback or LeastActiveDispatchPolicy()
+
+    def select(self, agents, client_info):
+        skill = client_info.get("skill")
+        if skill:
+            skilled = [agent for agent in agents if skill in agent.skills]
+            if skilled:
+                return self.fallback.select(skilled, client_info)
+        return self.fallback.select(agents, client_info)
+
+
+DISPATCH_POLICIES: Dict[str, Type[DispatchPolicy]] = {
+    policy.name: policy
+    for policy in (LeastActiveDispatchPolicy, RoundRobinDispatchPolicy, SkillTagDispatchPolicy)
+}
+
+
+def get_dispatch_policy(name: str) -> DispatchPolicy:
+    """Instantiate a dispatch policy by its configured name"""
+    try:
+        return DISPATCH_POLICIES[name]()
+    except KeyError:
+        raise ValueError(f"Unknown dispatch policy '{name}'. Choose one of: {', '.join(DISPATCH_POLICIES)}")
@@ -0,0 +1,184 @@
+import atexit
+import copy
+import logging
+import logging.handlers
+import queue
+import random
+import re
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, Optional, Union
+
+from serializer import dumps
+
+# Attributes every LogRecord has; anything else on a record came from ``extra=`` and is a structured field
+_RECORD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime", "category"}
+
+# Bearer tokens, JWTs and token=... query parameters, wherever they appear in a message or field
+_TOKEN_PATTERN = re.compile(
+    r"(?i)(bearer\s+)[\w.~+/=-]+"
+    r"|eyJ[\w-]+\.[\w-]+\.[\w-]+"
+    r"|((?:access_)?token=)[^&\s'\"]+"
+)
+
+# Structured fields holding chat text or secrets; logged by length only unless bodies are enabled
+BODY_FIELDS = frozenset({"body", "frame"})
+SECRET_FIELDS = frozenset({"token", "password", "password_hash", "authorization"})
+
+
+def redact_tokens(text: str) -> str:
+    return _TOKEN_PATTERN.sub(lambda m: f"{m.group(1) or m.group(2) or ''}[redacted]", text)
+
+
+def parse_category_map(value: str, cast: Callable[[str], Any] = float) -> Dict[str, Any]:
+    """Parse ``"client_message=0.1,admin_frame=0.5"`` into ``{"client_message": 0.1, ...}``"""
+    result = {}
+    for part in value.split(","):
+        name, _, setting = part.partition("=")
+        if name.strip() and setting.strip():
+            result[name.strip()] = cast(setting.strip())
+    return result
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line: time, level, logger, message and any ``extra=`` fields, redacted"""
+
+    def __init__(self, log_message_bodies: bool = False):
+        super().__init__()
+        self.log_message_bodies = log_message_bodies
+
+    def _field(self, key: str, value: Any) -> Any:
+        if key in SECRET_FIELDS:
+            return "[redacted]"
+        if key in BODY_FIELDS and not self.log_message_bodies:
+            return f"[redacted {len(str(value))} chars]"
+        if isinstance(value, str):
+            return redact_tokens(value)
+        return value
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": redact_tokens(record.getMessage()),
+        }
+        category = getattr(record, "category", None)
+        if category:
+            entry["category"] = category
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRS and not key.startswith("_"):
+                entry[key] = self._field(key, value)
+        if record.exc_info:
+            entry["exc"] = redact_tokens(self.formatException(record.exc_info))
+        return dumps(entry)
+
+
+class SamplingFilter(logging.Filter):
+    """Sample and rate-limit records by their ``category`` (set via ``extra={"category": ...}``).
+
+    Each category keeps ``sample_rates[category]`` of its records and then at
+    most ``rate_limits[category]`` per second. The first record let through
+    after some were dropped carries a ``suppressed`` count. Records without a
+    category always pass.
+    """
+
+    def __init__(self, sample_rates: Optional[Dict[str, float]] = None, rate_limits: Optional[Dict[str, float]] = None):
+        super().__init__()
+        self.sample_rates = sample_rates or {}
+        self.rate_limits = rate_limits or {}
+        self._buckets: Dict[str, list] = {}  # category -> [tokens, last refill]
+        self._suppressed: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        category = getattr(record, "category", None)
+        if category is None:
+            return True
+        rate = self.sample_rates.get(category, 1.0)
+        allowed = rate >= 1.0 or random.random() < rate
+        limit = self.rate_limits.get(category)
+        with self._lock:
+            if allowed and limit is not None:
+                now = time.monotonic()
+                bucket = self._buckets.setdefault(category, [limit, now])
+                bucket[0] = min(limit, bucket[0] + (now - bucket[1]) * limit)
+                bucket[1] = now
+                if bucket[0] >= 1:
+                    bucket[0] -= 1
+                else:
+                    allowed = False
+            if not allowed:
+                self._suppressed[category] = self._suppressed.get(category, 0) + 1
+                return False
+            suppressed = self._suppressed.pop(category, 0)
+        if suppressed:
+            record.suppressed = suppressed
+        return True
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that drops (and counts) records instead of blocking or raising when the queue is full"""
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Only merge the args here; formatting (including tracebacks) is left to the listener thread
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class LogPipeline:
+    """Root logging through a bounded queue; a QueueListener thread formats and writes the records"""
+
+    def __init__(self, handler: DroppingQueueHandler, listener: logging.handlers.QueueListener):
+        self.handler = handler
+        self.listener = listener
+        self._stopped = False
+
+    def stop(self):
+        """Write out everything queued so far and stop the writer thread"""
+        if not self._stopped:
+            self._stopped = True
+            self.listener.stop()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "queued": self.handler.queue.qsize(),
+            "dropped": self.handler.dropped,
+        }
+
+
+def setup_logging(filename: Optional[str], level: Union[int, str] = logging.INFO, queue_size: int = 10000,
+                  sample_rates: Optional[Dict[str, float]] = None, rate_limits: Optional[Dict[str, float]] = None,
+                  log_message_bodies: bool = False) -> LogPipeline:
+    """Route root logging through a queue so the event loop never waits on disk.
+
+    Sampling and rate limits run on the logging thread before anything is
+    queued; formatting, redaction and the write happen on the listener thread.
+    Logs go to ``filename``, or stderr if it is empty.
+    """
+    target = logging.FileHandler(filename) if filename else logging.StreamHandler()
+    target.setFormatter(JsonFormatter(log_message_bodies))
+    handler = DroppingQueueHandler(queue.Queue(maxsize=queue_size))
+    handler.addFilter(SamplingFilter(sample_rates, rate_limits))
+    listener = logging.handlers.QueueListener(handler.queue, target, respect_handler_level=True)
+
+    root = logging.getLogger()
+    root.setLevel(level)
+    root.addHandler(handler)
+    listener.start()
+    pipeline = LogPipeline(handler, listener)
+    atexit.register(pipeline.stop)
+    return pipeline
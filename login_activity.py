@@ -0,0 +1,74 @@
+import asyncio
+import logging
+from datetime import datetime
+from typing import Any, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class LastLoginWriter:
+    """Write-behind for chatserver_users.last_login.
+
+    Logins only note the time in memory; repeated logins by the same user
+    between flushes collapse into one entry. Every ``flush_interval`` seconds
+    (and on ``stop``) the pending entries are written in one storage call
+    (a single UPDATE joined against unnest()ed arrays on Postgres).
+    """
+
+    def __init__(self, flush_interval: float = 5.0):
+        self.flush_interval = flush_interval
+        self._pending: Dict[int, datetime] = {}
+        self._storage = None
+        self._task: Optional[asyncio.Task] = None
+        self.recorded = 0
+        self.written = 0
+        self.batches = 0
+        self.failed_batches = 0
+
+    def record(self, user_id: int, when: Optional[datetime] = None):
+        self._pending[user_id] = when or datetime.now()
+        self.recorded += 1
+
+    async def start(self, storage):
+        self._storage = storage
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    async def flush(self):
+        if not self._pending or self._storage is None:
+            return
+        batch, self._pending = self._pending, {}
+        try:
+            await self._storage.update_last_login(batch)
+        except Exception as e:
+            self.failed_batches += 1
+            logger.error(f"Failed to write last_login for {len(batch)} users: {e}")
+            # Retry next time unless a newer login replaced the entry meanwhile
+            for user_id, when in batch.items():
+                self._pending.setdefault(user_id, when)
+            return
+        self.written += len(batch)
+        self.batches += 1
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "pending": len(self._pending),
+            "recorded": self.recorded,
+            "written": self.written,
+            "batches": self.batches,
+            "failed_batches": self.failed_batches,
+        }
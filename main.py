@@ -1,33 +1,166 @@
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect, Depends, HTTPException, status, Request, Form
-from fastapi.responses import HTMLResponse, RedirectResponse
+from fastapi import FastAPI, WebSocket, WebSocketDisconnect, Depends, HTTPException, status, Request, Form, Query
+from fastapi.responses import HTMLResponse, RedirectResponse, Response
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from fastapi.templating import Jinja2Templates
-from typing import Set, Dict, Optional, List, Any
-import uuid, json, logging, hashlib, secrets, os
+from typing import Set, Dict, Optional, List, Any, Deque, Callable, Tuple, Union
+import asyncio, uuid, logging, hashlib, secrets, os, html, time
+from functools import lru_cache
+from collections import deque
 from datetime import datetime, timedelta
 from contextlib import asynccontextmanager
-import asyncpg
 import jwt
-from admin_interface import HTML_ADMIN_INTERFACE
+from admin_interface import HTML_ADMIN_INTERFACE, ADMIN_CSS, ADMIN_JS
+from serializer import (JSON_CODEC, Codec, EncodedFrame, accepted_subprotocol, decode_frame, encode_frame,
+                        negotiate_codec)
+from static_assets import StaticAsset, StaticBundle
+from dispatch import DispatchPolicy, get_dispatch_policy
+from outbound import OutboundQueue, totals as outbound_totals
+from broker import Broker, create_broker
+from auth_cache import SessionCache
+from session_reaper import SessionReaper
+from storage import create_storage
+from password_hashing import PasswordHasher
+from login_activity import LastLoginWriter
+from message_store import MessageWriter, SENDER_USER, SENDER_AGENT, fetch_messages_page
+from log_pipeline import parse_category_map, setup_logging
+from rate_limit import AdmissionControl
+from auto_approval import ACCEPT, REJECT, RuleSet, load_rules
+from metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, WAIT_BUCKETS, Counter, Gauge, Histogram, Registry
 from dotenv import load_dotenv
 
 load_dotenv()
 
-# Database configuration
+# Database configuration. STORAGE_ENGINE is postgres (DATABASE_URL), sqlite (a single-node file at
+# SQLITE_PATH) or memory (nothing persisted; for benchmarks and local experiments).
+STORAGE_ENGINE = os.getenv("STORAGE_ENGINE", "postgres")
 DATABASE_URL = os.getenv("DATABASE_URL", None)
+SQLITE_PATH = os.getenv("SQLITE_PATH", "chatserver.db")
 SECRET_KEY = os.getenv("SECRET_KEY", "this-is-temp-key")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 500
+# Apply pending Postgres schema migrations at startup instead of failing
+AUTO_MIGRATE = os.getenv("AUTO_MIGRATE", "false").lower() in ("1", "true", "yes")
+
+# Password hashing (scrypt) runs in a thread pool; at most PASSWORD_HASH_MAX_CONCURRENT hashes queued or running
+PASSWORD_SCRYPT_N = int(os.getenv("PASSWORD_SCRYPT_N", str(2 ** 14)))
+PASSWORD_SCRYPT_R = int(os.getenv("PASSWORD_SCRYPT_R", "8"))
+PASSWORD_SCRYPT_P = int(os.getenv("PASSWORD_SCRYPT_P", "1"))
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", "0")) or None
+PASSWORD_HASH_MAX_CONCURRENT = int(os.getenv("PASSWORD_HASH_MAX_CONCURRENT", "0")) or None
+
+# Validated sessions are cached in-process for at most this long (and never past their expiry)
+SESSION_CACHE_TTL_SECONDS = float(os.getenv("SESSION_CACHE_TTL_SECONDS", "60"))
+SESSION_CACHE_MAX_SIZE = int(os.getenv("SESSION_CACHE_MAX_SIZE", "10000"))
+
+# last_login is written behind, coalesced per user and flushed in one UPDATE per interval
+LAST_LOGIN_FLUSH_INTERVAL_SECONDS = float(os.getenv("LAST_LOGIN_FLUSH_INTERVAL_SECONDS", "5"))
+
+# Expired sessions are deleted in the background, at most SESSION_REAP_BATCH_SIZE rows per statement
+SESSION_REAP_INTERVAL_SECONDS = float(os.getenv("SESSION_REAP_INTERVAL_SECONDS", "300"))
+SESSION_REAP_BATCH_SIZE = int(os.getenv("SESSION_REAP_BATCH_SIZE", "1000"))
+
+# Logging: JSON lines written by a background thread. Per-message logs (categories client_message,
+# admin_frame, admin_message) are sampled (fraction kept) and rate limited (records per second);
+# message bodies are logged by length only unless LOG_MESSAGE_BODIES is set.
+LOG_FILE = os.getenv("LOG_FILE", "app.log")
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+LOG_SAMPLE_RATES = parse_category_map(os.getenv("LOG_SAMPLE_RATES", "client_message=0.1,admin_frame=0.1,admin_message=0.1"))
+LOG_RATE_LIMITS = parse_category_map(os.getenv("LOG_RATE_LIMITS", "client_message=20,admin_frame=20,admin_message=20"))
+LOG_MESSAGE_BODIES = os.getenv("LOG_MESSAGE_BODIES", "false").lower() in ("1", "true", "yes")
+
+# /metrics requires "Authorization: Bearer <METRICS_TOKEN>" when set. Each worker reports its own metrics.
+METRICS_TOKEN = os.getenv("METRICS_TOKEN", "")
+
+# Agent pool configuration
+AGENT_DISPATCH_POLICY = os.getenv("AGENT_DISPATCH_POLICY", "least_active")
+AGENT_MAX_CLIENTS = int(os.getenv("AGENT_MAX_CLIENTS", "10"))
+
+# Outbound queue configuration (overflow policy: drop_oldest, coalesce or disconnect)
+ADMIN_OUTBOUND_QUEUE_SIZE = int(os.getenv("ADMIN_OUTBOUND_QUEUE_SIZE", "1000"))
+ADMIN_OUTBOUND_OVERFLOW_POLICY = os.getenv("ADMIN_OUTBOUND_OVERFLOW_POLICY", "coalesce")
+CLIENT_OUTBOUND_QUEUE_SIZE = int(os.getenv("CLIENT_OUTBOUND_QUEUE_SIZE", "100"))
+CLIENT_OUTBOUND_OVERFLOW_POLICY = os.getenv("CLIENT_OUTBOUND_OVERFLOW_POLICY", "disconnect")
+
+# Cross-process broker: memory:// for a single worker, unix:///path/to/hub.sock to share
+# routing state between workers (start the hub with `python broker.py hub /path/to/hub.sock`)
+BROKER_URL = os.getenv("BROKER_URL", "memory://")
+
+# Wire protocol: clients pick JSON (default) or MessagePack with the chatserver.json.v1 /
+# chatserver.msgpack.v1 subprotocols or ?encoding=msgpack. permessage-deflate is negotiated by the
+# websocket handshake itself when enabled here.
+WS_PER_MESSAGE_DEFLATE = os.getenv("WS_PER_MESSAGE_DEFLATE", "true").lower() in ("1", "true", "yes")
+
+# Batch user messages to an agent into one user_message_batch frame: held for up to the window,
+# or sent as soon as USER_MESSAGE_BATCH_MAX are waiting. 0 disables batching.
+USER_MESSAGE_BATCH_WINDOW_MS = float(os.getenv("USER_MESSAGE_BATCH_WINDOW_MS", "0"))
+USER_MESSAGE_BATCH_MAX = int(os.getenv("USER_MESSAGE_BATCH_MAX", "50"))
+
+# Load shedding on /ws, per worker: at most CLIENT_MAX_CONNECTIONS visitor sockets, and token buckets
+# (rate per second, burst) for connects per IP and messages per IP and per connection. Refused sockets
+# are closed with 1013 (try again later) before any session, routing or decoding work. 0 disables a limit.
+CLIENT_MAX_CONNECTIONS = int(os.getenv("CLIENT_MAX_CONNECTIONS", "10000"))
+CLIENT_CONNECT_RATE_PER_IP = float(os.getenv("CLIENT_CONNECT_RATE_PER_IP", "2"))
+CLIENT_CONNECT_BURST_PER_IP = float(os.getenv("CLIENT_CONNECT_BURST_PER_IP", "10"))
+CLIENT_MESSAGE_RATE_PER_IP = float(os.getenv("CLIENT_MESSAGE_RATE_PER_IP", "20"))
+CLIENT_MESSAGE_BURST_PER_IP = float(os.getenv("CLIENT_MESSAGE_BURST_PER_IP", "100"))
+CLIENT_MESSAGE_RATE_PER_CONNECTION = float(os.getenv("CLIENT_MESSAGE_RATE_PER_CONNECTION", "5"))
+CLIENT_MESSAGE_BURST_PER_CONNECTION = float(os.getenv("CLIENT_MESSAGE_BURST_PER_CONNECTION", "20"))
+RATE_LIMIT_MAX_IPS = int(os.getenv("RATE_LIMIT_MAX_IPS", "100000"))
+
+# Visitors arriving while no agent is online or every agent is at capacity wait in a FIFO of at most
+# WAITING_ROOM_SIZE per worker, drained as agents connect or free up. Past that, new visitors are
+# closed with 1013 (try again later). Queue positions are re-sent at most once per update interval.
+WAITING_ROOM_SIZE = int(os.getenv("WAITING_ROOM_SIZE", "500"))
+WAITING_ROOM_UPDATE_INTERVAL_SECONDS = float(os.getenv("WAITING_ROOM_UPDATE_INTERVAL_SECONDS", "1"))
+
+# Auto-approval rules (a JSON file, format in auto_approval.py) matched against each connection request's
+# conversation ID, IP and user agent to accept or reject it without an agent. Admins can reload the file,
+# or replace the rules, over the admin socket without a restart.
+AUTO_APPROVAL_RULES_FILE = os.getenv("AUTO_APPROVAL_RULES_FILE", "")
+
+# Liveness. Protocol-level pings, answered by every browser, catch dropped networks: uvicorn closes a
+# socket whose pong is late by WS_PING_TIMEOUT_SECONDS (websockets implementation only). On top of that
+# sockets that connected with ?heartbeat=1 (the admin page does; older visitor widgets don't know the
+# frame) get a {"type": "ping"} frame when quiet for HEARTBEAT_INTERVAL_SECONDS, and any frame back (such
+# as {"type": "pong"}) counts as activity. Every heartbeat a reaper evicts sockets silent past their idle
+# timeout (for agents, only those answering pings) and requests left unanswered by their agent for PENDING_REQUEST_TTL_SECONDS (the clock starts
+# when a request reaches an agent; the waiting room has no TTL), REAP_BATCH_SIZE at a time with one
+# list delta per agent per batch. 0 disables a timeout; the pending visitor timeout is off by default
+# because not every widget answers pings.
+WS_PING_INTERVAL_SECONDS = float(os.getenv("WS_PING_INTERVAL_SECONDS", "20"))
+WS_PING_TIMEOUT_SECONDS = float(os.getenv("WS_PING_TIMEOUT_SECONDS", "20"))
+HEARTBEAT_INTERVAL_SECONDS = float(os.getenv("HEARTBEAT_INTERVAL_SECONDS", "25"))
+ADMIN_IDLE_TIMEOUT_SECONDS = float(os.getenv("ADMIN_IDLE_TIMEOUT_SECONDS", "90"))
+CLIENT_PENDING_IDLE_TIMEOUT_SECONDS = float(os.getenv("CLIENT_PENDING_IDLE_TIMEOUT_SECONDS", "0"))
+CLIENT_ACTIVE_IDLE_TIMEOUT_SECONDS = float(os.getenv("CLIENT_ACTIVE_IDLE_TIMEOUT_SECONDS", "1800"))
+PENDING_REQUEST_TTL_SECONDS = float(os.getenv("PENDING_REQUEST_TTL_SECONDS", "600"))
+REAP_BATCH_SIZE = int(os.getenv("REAP_BATCH_SIZE", "500"))
+
+# Chat message persistence: buffered in memory and written with COPY in batches
+MESSAGE_FLUSH_BATCH_SIZE = int(os.getenv("MESSAGE_FLUSH_BATCH_SIZE", "500"))
+MESSAGE_FLUSH_INTERVAL_SECONDS = float(os.getenv("MESSAGE_FLUSH_INTERVAL_SECONDS", "1.0"))
+MESSAGE_BUFFER_MAX = int(os.getenv("MESSAGE_BUFFER_MAX", "100000"))
+HISTORY_PAGE_SIZE = int(os.getenv("HISTORY_PAGE_SIZE", "50"))
+HISTORY_PAGE_MAX = int(os.getenv("HISTORY_PAGE_MAX", "200"))
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # Startup logic
-    await init_db()
+    await storage.start(auto_migrate=AUTO_MIGRATE)
+    await message_writer.start(storage)
+    await session_reaper.start(storage)
+    await last_login_writer.start(storage)
+    await manager.start()
     yield
     # Shutdown logic
-    if db_pool:
-        await db_pool.close()
+    await manager.stop()
+    await message_writer.stop()
+    await session_reaper.stop()
+    await last_login_writer.stop()
+    password_hasher.shutdown()
+    await storage.close()
 
 app = FastAPI(lifespan=lifespan)
 app.add_middleware(
@@ -42,64 +175,27 @@ app.add_middleware(
 security = HTTPBearer()
 templates = Jinja2Templates(directory="templates")
 
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    filename='app.log',
-    filemode='a'
+log_pipeline = setup_logging(
+    LOG_FILE,
+    level=LOG_LEVEL,
+    queue_size=LOG_QUEUE_SIZE,
+    sample_rates=LOG_SAMPLE_RATES,
+    rate_limits=LOG_RATE_LIMITS,
+    log_message_bodies=LOG_MESSAGE_BODIES,
 )
 logger = logging.getLogger(__name__)
 
-# Database connection pool
-db_pool = None
-
-async def init_db():
-    """Initialize database connection and create tables"""
-    global db_pool
-    db_pool = await asyncpg.create_pool(DATABASE_URL)
-    
-    async with db_pool.acquire() as conn:
-        # Create users table
-        await conn.execute('''
-            CREATE TABLE IF NOT EXISTS chatserver_users (
-                id SERIAL PRIMARY KEY,
-                username VARCHAR(50) UNIQUE NOT NULL,
-                email VARCHAR(100) UNIQUE NOT NULL,
-                password_hash VARCHAR(255) NOT NULL,
-                is_admin BOOLEAN DEFAULT FALSE,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                last_login TIMESTAMP
-            )
-        ''')
-        
-        # Create sessions table for token management
-        await conn.execute('''
-            CREATE TABLE IF NOT EXISTS chatserver_user_sessions (
-                id SERIAL PRIMARY KEY,
-                user_id INTEGER REFERENCES chatserver_users(id) ON DELETE CASCADE,
-                token_hash VARCHAR(255) NOT NULL,
-                expires_at TIMESTAMP NOT NULL,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-        
-        # Create default admin user if not exists
-        admin_exists = await conn.fetchval("SELECT COUNT(*) FROM chatserver_users WHERE username = 'admin'")
-        if admin_exists == 0:
-            admin_password = hash_password("admin123")  # Change this in production!
-            await conn.execute('''
-                INSERT INTO chatserver_users (username, email, password_hash, is_admin)
-                VALUES ($1, $2, $3, $4)
-            ''', "admin", "admin@example.com", admin_password, True)
-            logger.info("Default admin user created (username: admin, password: admin123)")
-
-def hash_password(password: str) -> str:
-    """Hash password using SHA-256"""
-    return hashlib.sha256(password.encode()).hexdigest()
-
-def verify_password(password: str, hashed: str) -> bool:
-    """Verify password against hash"""
-    return hash_password(password) == hashed
+# Admin UI assets, compressed once at startup. The shell page is revalidated by ETag on each
+# visit (it sits behind the login check); the hashed CSS/JS URLs are cached for good.
+static_bundle = StaticBundle()
+admin_shell = StaticAsset(
+    HTML_ADMIN_INTERFACE
+    .replace("__ADMIN_CSS_URL__", static_bundle.add("admin.css", ADMIN_CSS, "text/css"))
+    .replace("__ADMIN_JS_URL__", static_bundle.add("admin.js", ADMIN_JS, "application/javascript"))
+    .encode(),
+    "text/html; charset=utf-8",
+    "private, no-cache",
+)
 
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     """Create JWT access token"""
@@ -112,31 +208,41 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
-async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
-    """Get current user from JWT token"""
+def hash_token(token: str) -> str:
+    return hashlib.sha256(token.encode()).hexdigest()
+
+async def validate_token(token: str) -> Optional[dict]:
+    """Return the user owning a valid, unexpired session token, or None.
+
+    Validated sessions are served from ``session_cache``; a miss costs one
+    query joining the session to its user.
+    """
+    token_hash = hash_token(token)
+    user = session_cache.get(token_hash)
+    if user is not None:
+        return user
+
     try:
-        payload = jwt.decode(credentials.credentials, SECRET_KEY, algorithms=[ALGORITHM])
-        username: str = payload.get("sub")
-        if username is None:
-            raise HTTPException(status_code=401, detail="Invalid authentication credentials")
+        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
     except jwt.PyJWTError:
-        raise HTTPException(status_code=401, detail="Invalid authentication credentials")
-    
-    async with db_pool.acquire() as conn:
-        user = await conn.fetchrow("SELECT * FROM chatserver_users WHERE username = $1", username)
-        if user is None:
-            raise HTTPException(status_code=401, detail="User not found")
-        
-        # Check if token is still valid in sessions table
-        token_hash = hashlib.sha256(credentials.credentials.encode()).hexdigest()
-        session = await conn.fetchrow(
-            "SELECT * FROM chatserver_user_sessions WHERE user_id = $1 AND token_hash = $2 AND expires_at > NOW()",
-            user['id'], token_hash
-        )
-        if session is None:
-            raise HTTPException(status_code=401, detail="Token expired or invalid")
-    
-    return dict(user)
+        return None
+    username = payload.get("sub")
+    if username is None:
+        return None
+
+    user = await storage.get_session_user(token_hash, username)
+    if user is None:
+        return None
+    expires_at = user.pop("session_expires_at")
+    session_cache.put(token_hash, user, expires_at)
+    return user
+
+async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
+    """Get current user from JWT token"""
+    user = await validate_token(credentials.credentials)
+    if user is None:
+        raise HTTPException(status_code=401, detail="Token expired or invalid")
+    return user
 
 async def get_current_admin_user(current_user: dict = Depends(get_current_user)):
     """Ensure current user is admin"""
@@ -273,6 +379,15 @@ LOGIN_HTML = '''
 </html>
 '''
 
+_LOGIN_HEAD, _, _login_rest = LOGIN_HTML.partition("{% if error %}")
+_LOGIN_ERROR_BLOCK, _, _LOGIN_TAIL = _login_rest.partition("{% endif %}")
+
+@lru_cache(maxsize=64)
+def render_login_html(error: Optional[str] = None) -> str:
+    """LOGIN_HTML with its error block filled in. Errors come from a small set, so renders are cached."""
+    error_block = _LOGIN_ERROR_BLOCK.replace("{{ error }}", html.escape(error)) if error else ""
+    return _LOGIN_HEAD + error_block + _LOGIN_TAIL
+
 # @app.on_event("startup")
 # async def startup():
 #     await init_db()
@@ -285,96 +400,96 @@ LOGIN_HTML = '''
 @app.get("/login")
 async def login_page(request: Request, error: str = None):
     """Serve login page"""
-    return HTMLResponse(LOGIN_HTML.replace("{% if error %}", "")
-                                 .replace("{{ error }}", error or "")
-                                 .replace("{% endif %}", ""))
+    return HTMLResponse(render_login_html(error))
 
 @app.post("/login")
 async def login(username: str = Form(...), password: str = Form(...)):
     """Handle login"""
-    async with db_pool.acquire() as conn:
-        user = await conn.fetchrow(
-            "SELECT * FROM chatserver_users WHERE username = $1", username
-        )
-        
-        if not user or not verify_password(password, user['password_hash']):
-            return HTMLResponse(
-                LOGIN_HTML.replace("{% if error %}", "").replace("{{ error }}", "Invalid username or password").replace("{% endif %}", ""),
-                status_code=400
-            )
-        
-        if not user['is_admin']:
-            return HTMLResponse(
-                LOGIN_HTML.replace("{% if error %}", "").replace("{{ error }}", "Admin access required").replace("{% endif %}", ""),
-                status_code=403
-            )
-        
-        # Create access token
-        access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
-        access_token = create_access_token(
-            data={"sub": user['username']}, expires_delta=access_token_expires
-        )
-        
-        # Store session in database
-        token_hash = hashlib.sha256(access_token.encode()).hexdigest()
-        expires_at = datetime.now() + access_token_expires
-        await conn.execute(
-            "INSERT INTO chatserver_user_sessions (user_id, token_hash, expires_at) VALUES ($1, $2, $3)",
-            user['id'], token_hash, expires_at
-        )
-        
-        # Update last login
-        await conn.execute(
-            "UPDATE chatserver_users SET last_login = CURRENT_TIMESTAMP WHERE id = $1",
-            user['id']
+    user = await storage.get_user_by_username(username)
+
+    # Verify without holding a pool connection: the KDF takes tens of milliseconds. An unknown user
+    # pays for it too, so the response time doesn't reveal which usernames exist.
+    if user:
+        verified, new_hash = await password_hasher.verify_and_update(password, user['password_hash'])
+    else:
+        await password_hasher.verify_and_update(password, await password_hasher.dummy_hash())
+        verified, new_hash = False, None
+    if not verified:
+        return HTMLResponse(
+            render_login_html("Invalid username or password"),
+            status_code=400
         )
-        print('------------------')
-        print(f"Bearer {access_token}")
-        print('------------------')
-        # Redirect to admin interface with token in cookie
-        response = RedirectResponse(url="/", status_code=302)
-        print(f"access_token: {access_token}, type: {type(access_token)}")
-        response.set_cookie(
-            key="access_token", 
-            value=f"Bearer {access_token}",
-            max_age=ACCESS_TOKEN_EXPIRE_MINUTES * 60,
-            httponly=False
+    
+    if not user['is_admin']:
+        return HTMLResponse(
+            render_login_html("Admin access required"),
+            status_code=403
         )
-        return response
+    
+    # Create access token
+    access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
+    access_token = create_access_token(
+        data={"sub": user['username']}, expires_delta=access_token_expires
+    )
+    
+    # Store the session, upgrading a legacy or outdated password hash now that we know the password
+    token_hash = hash_token(access_token)
+    expires_at = datetime.now() + access_token_expires
+    await storage.create_session(user['id'], token_hash, expires_at, new_hash)
+    last_login_writer.record(user['id'])
+
+    # The redirect to / will validate this token right away
+    cached_user = dict(user)
+    del cached_user['password_hash']
+    session_cache.put(token_hash, cached_user, expires_at)
+
+    # Redirect to admin interface with token in cookie
+    response = RedirectResponse(url="/", status_code=302)
+    response.set_cookie(
+        key="access_token", 
+        value=f"Bearer {access_token}",
+        max_age=ACCESS_TOKEN_EXPIRE_MINUTES * 60,
+        httponly=False
+    )
+    return response
 
 @app.post("/register")
 async def register(username: str = Form(...), email: str = Form(...), password: str = Form(...)):
     """Handle registration"""
-    async with db_pool.acquire() as conn:
-        # Check if user already exists
-        existing_user = await conn.fetchrow(
-            "SELECT id FROM chatserver_users WHERE username = $1 OR email = $2", username, email
+    # Check if user already exists, before paying for the KDF. Storage calls hold a pool connection
+    # only for their own query, so hashing in between doesn't tie one up.
+    if await storage.user_exists(username, email):
+        return HTMLResponse(
+            render_login_html("Username or email already exists"),
+            status_code=400
         )
-        
-        if existing_user:
-            return HTMLResponse(
-                LOGIN_HTML.replace("{% if error %}", "").replace("{{ error }}", "Username or email already exists").replace("{% endif %}", ""),
-                status_code=400
-            )
-        
-        # Create new user
-        password_hash = hash_password(password)
-        await conn.execute(
-            "INSERT INTO chatserver_users (username, email, password_hash, is_admin) VALUES ($1, $2, $3, $4)",
-            username, email, password_hash, True  # Making all registered users admin for this example
-        )
-        
-        logger.info(f"New admin user registered: {username}")
-        
-        # Redirect to login
-        return RedirectResponse(url="/login", status_code=302)
+
+    # Create new user
+    password_hash = await password_hasher.hash(password)
+    await storage.create_user(username, email, password_hash, True)  # Making all registered users admin for this example
+
+    logger.info(f"New admin user registered: {username}")
+
+    # Redirect to login
+    return RedirectResponse(url="/login", status_code=302)
 
 @app.get("/logout")
-async def logout():
+async def logout(request: Request):
     """Handle logout"""
     response = RedirectResponse(url="/login", status_code=302)
     response.delete_cookie(key="access_token")
-    await manager.disconnect_admin()
+    token = request.cookies.get("access_token")
+    if token:
+        if token.startswith("Bearer "):
+            token = token[7:]
+        try:
+            payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        except jwt.PyJWTError:
+            return response
+        token_hash = hash_token(token)
+        await storage.delete_session(token_hash)
+        if payload.get("sub"):
+            await manager.disconnect_user_agents(payload["sub"], token_hash=token_hash)
     return response
 
 @app.get("/", response_class=HTMLResponse)
@@ -385,54 +500,220 @@ async def get_admin_interface(request: Request):
     if not token:
         return RedirectResponse(url="/login", status_code=302)
     
-    try:
-        # Remove "Bearer " prefix if present
-        if token.startswith("Bearer "):
-            token = token[7:]
-        
-        # Verify token
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        username = payload.get("sub")
-        
-        if not username:
-            return RedirectResponse(url="/login", status_code=302)
-        
-        # Verify user exists and is admin
-        async with db_pool.acquire() as conn:
-            user = await conn.fetchrow(
-                "SELECT * FROM chatserver_users WHERE username = $1 AND is_admin = TRUE", username
-            )
-            if not user:
-                return RedirectResponse(url="/login", status_code=302)
-            
-            # Check session validity
-            token_hash = hashlib.sha256(token.encode()).hexdigest()
-            session = await conn.fetchrow(
-                "SELECT * FROM chatserver_user_sessions WHERE user_id = $1 AND token_hash = $2 AND expires_at > NOW()",
-                user['id'], token_hash
-            )
-            if not session:
-                return RedirectResponse(url="/login", status_code=302)
-        
-        # Add logout button to admin interface
-        admin_html = HTML_ADMIN_INTERFACE.replace(
-            "Welcome, ' +username+ '",
-            "Welcome, " + username
-        )
-        
-        return HTMLResponse(admin_html)
-        
-    except jwt.PyJWTError:
+    # Remove "Bearer " prefix if present
+    if token.startswith("Bearer "):
+        token = token[7:]
+
+    user = await validate_token(token)
+    if not user or not user["is_admin"]:
         return RedirectResponse(url="/login", status_code=302)
 
+    # The shell is the same for every admin; per-user details come from /api/me
+    return admin_shell.response(request)
+
+@app.get("/api/me")
+async def get_me(current_user: dict = Depends(get_current_admin_user)):
+    """Bootstrap payload for the admin UI"""
+    return {"username": current_user["username"], "email": current_user["email"]}
+
+@app.get("/static/{filename}")
+async def get_static_asset(filename: str, request: Request):
+    asset = static_bundle.get(filename)
+    if asset is None:
+        raise HTTPException(status_code=404, detail="Not found")
+    return asset.response(request)
+
+async def accept_websocket(websocket: WebSocket) -> Codec:
+    """Accept a socket with the wire encoding its client asked for"""
+    offered = websocket.scope.get("subprotocols", [])
+    codec = negotiate_codec(offered, websocket.query_params.get("encoding"))
+    await websocket.accept(subprotocol=accepted_subprotocol(codec, offered))
+    return codec
+
+async def receive_frame(websocket: WebSocket) -> Union[str, bytes]:
+    """Next text or binary frame from a socket"""
+    message = await websocket.receive()
+    if message["type"] == "websocket.disconnect":
+        raise WebSocketDisconnect(message.get("code", 1000))
+    return message["text"] if message.get("text") is not None else message["bytes"]
+
+PONG_FRAME = {"type": "pong"}
+
+def is_pong(frame: Any) -> bool:
+    """A heartbeat reply: {"type": "pong"} as JSON text or an already decoded frame"""
+    if isinstance(frame, str):
+        return len(frame) < 24 and frame.startswith("{") and frame.replace(" ", "") == '{"type":"pong"}'
+    return frame == PONG_FRAME
+
+def chat_text(payload: Any) -> Optional[str]:
+    """The text of a chat message: a string, or the "message" string of a decoded map; None for anything else"""
+    if isinstance(payload, dict):
+        payload = payload.get("message")
+    return payload if isinstance(payload, str) else None
+
+def wants_app_pings(websocket: WebSocket) -> bool:
+    """Whether the client asked for {"type": "ping"} frames (?heartbeat=1) and will answer them"""
+    return websocket.query_params.get("heartbeat") == "1"
+
+class AgentConnection:
+    """A connected human agent and the clients routed to them.
+
+    Agents connected to another node are mirrored with no websocket or
+    outbound queue; frames for them travel through the broker.
+    """
+    def __init__(self, websocket: Optional[WebSocket], user: dict, max_clients: int, skills: Set[str],
+                 agent_id: Optional[str] = None, node_id: Optional[str] = None):
+        self.agent_id = agent_id or str(uuid.uuid4())
+        self.node_id = node_id
+        self.websocket = websocket
+        self.user = user
+        self.max_clients = max_clients
+        self.skills = skills
+        self.outbound: Optional[OutboundQueue] = None
+        # Active clients and pending requests routed to this agent
+        self.client_ids: Set[str] = set()
+        # Bumped once per list delta sent, so the UI can detect a missed frame
+        self.client_list_version = 0
+        self.pending_list_version = 0
+        # Last encoded snapshot per list: {"client_list" | "pending_list": (version, EncodedFrame)}
+        self.encoded_snapshots: Dict[str, Tuple[int, EncodedFrame]] = {}
+        # user_message frames held back while batching, and the timer that flushes them
+        self.user_message_batch: List[Dict[str, Any]] = []
+        self.batch_timer: Optional[asyncio.TimerHandle] = None
+        # Monotonic time of the last frame received from the agent's socket
+        self.last_seen = time.monotonic()
+        # Connected with ?heartbeat=1: gets ping frames, and can be reaped when it stops answering
+        self.app_pings = False
+
+    @property
+    def username(self) -> str:
+        return self.user['username']
+
+    @property
+    def is_local(self) -> bool:
+        return self.websocket is not None
+
+    @property
+    def load(self) -> int:
+        return len(self.client_ids)
+
+    def has_capacity(self) -> bool:
+        return self.load < self.max_clients
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"agent_id": self.agent_id, "username": self.username, "max_clients": self.max_clients, "skills": sorted(self.skills)}
+
+class ClientSession:
+    """Per-connection state for a visitor socket.
+
+    The client endpoint holds on to its session, so checking or changing a
+    connection's state never requires searching the manager's registries.
+    Visitors connected to another node are mirrored without a websocket.
+    """
+    PENDING = "pending"
+    ACTIVE = "active"
+    CLOSED = "closed"
+
+    __slots__ = ("client_id", "websocket", "info", "state", "agent_id", "node_id", "outbound", "requested_at", "routed_at", "last_seen",
+                 "auto_accept", "app_pings")
+
+    def __init__(self, client_id: str, websocket: Optional[WebSocket], info: Dict[str, str], node_id: Optional[str] = None,
+                 codec: Codec = JSON_CODEC):
+        self.client_id = client_id
+        self.websocket = websocket
+        self.info = info
+        self.state = ClientSession.PENDING
+        self.agent_id: Optional[str] = None
+        self.node_id = node_id
+        # When the visitor asked to connect, and when the request was last routed to an agent
+        self.requested_at = self.routed_at = self.last_seen = time.monotonic()
+        # Accepted by an auto-approval rule: connected as soon as an agent has capacity
+        self.auto_accept = False
+        # Connected with ?heartbeat=1, so the widget understands ping frames
+        self.app_pings = False
+        self.outbound = None
+        if websocket is not None:
+            self.outbound = OutboundQueue(websocket, f"client {client_id}", CLIENT_OUTBOUND_QUEUE_SIZE, CLIENT_OUTBOUND_OVERFLOW_POLICY,
+                                          codec=codec, wait_seconds=client_outbound_wait_seconds)
+
+    @property
+    def client_ip(self) -> str:
+        return self.info['client_ip']
+
+    @property
+    def is_local(self) -> bool:
+        return self.websocket is not None
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"client_id": self.client_id, "info": self.info, "state": self.state, "agent_id": self.agent_id}
+
 class ConnectionManager:
-    def __init__(self):
-        # Active client WebSockets: {client_id: {"ws": WebSocket, "info": client_info}}
-        self.active_clients: Dict[str, Dict[str, Any]] = {}
-        # Pending connection requests: {request_id: {"ws": WebSocket, "info": client_info}}
-        self.pending_connections: Dict[str, Dict[str, Any]] = {}
-        self.admin_websocket: Optional[WebSocket] = None
-        self.authenticated_admin: Optional[dict] = None
+    """Routes visitors to agents.
+
+    The registries below hold every agent and session in the cluster: the
+    ones connected to this node plus mirrors of other nodes' kept current
+    through the broker. Only the node owning a visitor's socket changes its
+    session; every node turns session transitions into list deltas for its
+    own agents.
+    """
+    # Sent to a visitor just before the reaper closes their socket
+    EVICTION_MESSAGES = {
+        "idle_timeout": "Connection closed after a period of inactivity.",
+        "request_expired": "Connection request expired before an agent responded.",
+    }
+
+    def __init__(self, dispatch_policy: Optional[DispatchPolicy] = None, broker: Optional[Broker] = None,
+                 message_writer: Optional[MessageWriter] = None, session_cache: Optional[SessionCache] = None,
+                 auto_approval: Optional[RuleSet] = None):
+        # Active client sessions: {client_id: ClientSession}
+        self.active_clients: Dict[str, ClientSession] = {}
+        # Pending connection requests: {request_id: ClientSession}
+        self.pending_connections: Dict[str, ClientSession] = {}
+        # Reverse index from a local socket to its session, keyed by id() since WebSocket is unhashable
+        self.sessions_by_socket: Dict[int, ClientSession] = {}
+        # Connected agents: {agent_id: AgentConnection}
+        self.agents: Dict[str, AgentConnection] = {}
+        # Local pending requests no agent had capacity for, oldest first: the waiting room
+        self.unassigned_requests: Deque[str] = deque()
+        # Pending re-announcement of waiting room positions after the queue moved
+        self._queue_timer: Optional[asyncio.TimerHandle] = None
+        self.waiting_room_rejections = 0
+        self.auto_approval = auto_approval or RuleSet([])
+        # Requests decided by an auto-approval rule: {action: count}
+        self.auto_approval_decisions: Dict[str, int] = {}
+        # Local active clients whose agent went away, waiting for a new one
+        self.orphaned_clients: Dict[str, None] = {}
+        self.dispatch_policy = dispatch_policy or get_dispatch_policy(AGENT_DISPATCH_POLICY)
+        self.broker = broker or create_broker(BROKER_URL)
+        self.node_id = self.broker.node_id
+        # Chat messages are persisted by the node owning the visitor's socket
+        self.message_writer = message_writer
+        # Logouts on any node evict the token from every node's cache
+        self.session_cache = session_cache
+        # Inside batched_list_deltas: list delta ops per (agent_id, list) and local sessions closed, sent on exit
+        self._held_deltas: Optional[Dict[Tuple[str, str], List[Dict[str, Any]]]] = None
+        self._held_removals: List[str] = []
+        # Evictions by the reaper: {(state or "agent", reason): count}
+        self.reaped: Dict[Tuple[str, str], int] = {}
+        self._reaper_task: Optional[asyncio.Task] = None
+
+    async def start(self):
+        await self.broker.start(self._handle_broker_event, self._announce)
+        if HEARTBEAT_INTERVAL_SECONDS > 0:
+            self._reaper_task = asyncio.create_task(self._run_reaper())
+
+    async def stop(self):
+        if self._queue_timer is not None:
+            self._queue_timer.cancel()
+            self._queue_timer = None
+        if self._reaper_task:
+            self._reaper_task.cancel()
+            try:
+                await self._reaper_task
+            except asyncio.CancelledError:
+                pass
+            self._reaper_task = None
+        await self.broker.stop()
 
     def _get_client_info(self, websocket: WebSocket) -> Dict[str, str]:
         return {
@@ -440,188 +721,885 @@ class ConnectionManager:
             "client_ip": websocket.client.host if websocket.client else "Unknown"
         }
 
-    async def connect_admin(self, websocket: WebSocket, admin_user: dict):
-        await websocket.accept()
-        self.admin_websocket = websocket
-        self.authenticated_admin = admin_user
-        logger.info(f"Admin {admin_user['username']} connected.")
-        await self.send_client_list_to_admin()
-        await self.send_pending_requests_to_admin()
-
-    async def disconnect_admin(self):
-        if self.authenticated_admin:
-            logger.info(f"Admin {self.authenticated_admin['username']} disconnected.")
-        self.admin_websocket = None
-        self.authenticated_admin = None
-
-    async def request_connection(self, websocket: WebSocket) -> str:
-        """A client requests to connect. They are put in pending."""
-        if self.admin_websocket is not None:
-            await websocket.accept()
-            request_id = str(uuid.uuid4())
-            conversation_id = websocket.query_params.get('conversation_id', 'No conversation ID provided')
-            client_info = self._get_client_info(websocket)
-            client_info['conversation_id'] = conversation_id
-            self.pending_connections[request_id] = {"ws": websocket, "info": client_info}
-
-            await self.send_to_admin_socket(self.admin_websocket, {
-                "type": "connection_request",
-                "request_id": request_id,
-                "conversation_id": conversation_id,
-                "client_info": client_info
-            })
-            logger.info(f"Connection request {request_id} from {client_info['client_ip']}. Pending admin approval.")
-        logger.info(f"Connection request {request_id} from {client_info['client_ip']}. Admin not conencted.")
-        return request_id
-
-    async def handle_admin_response(self, request_id: str, action: str):
-        if request_id not in self.pending_connections:
-            logger.warning(f"Request ID {request_id} not found in pending connections for action: {action}")
-            if self.admin_websocket:
-                await self.send_to_admin_socket(self.admin_websocket, {"type": "error", "message": f"Request {request_id} not found."})
-            return
+    def _select_agent(self, client_info: Dict[str, str]) -> Optional[AgentConnection]:
+        available = [agent for agent in self.agents.values() if agent.has_capacity()]
+        return self.dispatch_policy.select(available, client_info)
 
-        pending_client_data = self.pending_connections.pop(request_id)
-        client_websocket = pending_client_data["ws"]
-        client_info = pending_client_data["info"]
+    def _find_session(self, client_id: str) -> Optional[ClientSession]:
+        return self.active_clients.get(client_id) or self.pending_connections.get(client_id)
 
-        try:
-            if action == "accept":
-                self.active_clients[request_id] = {"ws": client_websocket, "info": client_info, "id": request_id}
-                await client_websocket.send_text(json.dumps({
-                    "type": "connection_approved",
-                    "client_id": request_id,
-                    "message": "Connection approved by admin."
-                }))
-                logger.info(f"Connection {request_id} approved for {client_info['client_ip']}.")
-                await self.send_client_list_to_admin()
-                if self.admin_websocket:
-                    await self.send_to_admin_socket(self.admin_websocket, {
-                        "type": "client_connected_notification",
-                        "client_id": request_id,
-                        "client_info": client_info
-                    })
+    def get_session(self, websocket: WebSocket) -> Optional[ClientSession]:
+        return self.sessions_by_socket.get(id(websocket))
+
+    def get_client_agent(self, client_id: str) -> Optional[AgentConnection]:
+        """Agent currently handling an active or pending client, if any"""
+        session = self._find_session(client_id)
+        if session and session.agent_id:
+            return self.agents.get(session.agent_id)
+        return None
+
+    async def _transition(self, session: ClientSession, state: str, agent_id: Optional[str]):
+        """Move a session to a new state and/or agent.
+
+        Keeps the registries and agent loads in step, sends the matching list
+        deltas to local agents, and publishes the change if we own the session.
+        """
+        client_id = session.client_id
+        prev_state, prev_agent_id = session.state, session.agent_id
+        session.state, session.agent_id = state, agent_id
+
+        if state == ClientSession.ACTIVE:
+            self.pending_connections.pop(client_id, None)
+            self.active_clients[client_id] = session
+        elif state == ClientSession.PENDING:
+            self.active_clients.pop(client_id, None)
+            self.pending_connections[client_id] = session
+        else:
+            self.pending_connections.pop(client_id, None)
+            self.active_clients.pop(client_id, None)
+            self.orphaned_clients.pop(client_id, None)
+            if session.is_local:
+                self.sessions_by_socket.pop(id(session.websocket), None)
+                if prev_state == ClientSession.PENDING and prev_agent_id is None:
+                    try:
+                        self.unassigned_requests.remove(client_id)
+                        self._schedule_queue_announcement()
+                    except ValueError:
+                        pass
 
-            elif action == "reject":
-                await client_websocket.send_text(json.dumps({
-                    "type": "connection_rejected",
-                    "message": "Connection rejected by admin."
-                }))
-                await client_websocket.close(code=4001)
-                logger.info(f"Connection {request_id} rejected for {client_info['client_ip']}.")
+        moved = prev_agent_id != agent_id
+        prev_agent = self.agents.get(prev_agent_id) if prev_agent_id else None
+        new_agent = self.agents.get(agent_id) if agent_id and state != ClientSession.CLOSED else None
+        if prev_agent and (moved or state == ClientSession.CLOSED):
+            prev_agent.client_ids.discard(client_id)
+        if new_agent:
+            new_agent.client_ids.add(client_id)
+
+        if prev_agent and prev_agent.is_local:
+            if prev_state == ClientSession.PENDING and (state != ClientSession.PENDING or moved):
+                await self.send_pending_requests_delta(prev_agent, [{"op": "remove", "request_id": client_id}])
+            if prev_state == ClientSession.ACTIVE and (state != ClientSession.ACTIVE or moved):
+                await self.send_client_list_delta(prev_agent, [{"op": "remove", "id": client_id}])
+                await self.send_to_agent(prev_agent, {
+                    "type": "client_disconnected_notification",
+                    "client_id": client_id,
+                }, coalesce_key="notification")
+        if new_agent and new_agent.is_local:
+            if state == ClientSession.PENDING and (prev_state != ClientSession.PENDING or moved):
+                await self.send_pending_requests_delta(new_agent, [{"op": "add", "request": self._pending_entry(session)}])
+            if state == ClientSession.ACTIVE and (prev_state != ClientSession.ACTIVE or moved):
+                await self.send_client_list_delta(new_agent, [{"op": "add", "client": self._client_entry(session)}])
+                await self.send_to_agent(new_agent, {
+                    "type": "client_connected_notification",
+                    "client_id": client_id,
+                    "client_info": session.info
+                }, coalesce_key="notification")
+
+        if session.is_local:
+            if state == ClientSession.CLOSED and self._held_deltas is not None:
+                self._held_removals.append(client_id)
+            elif state == ClientSession.CLOSED:
+                await self.broker.publish({"op": "session_removed", "client_id": client_id})
             else:
-                logger.warning(f"Unknown action '{action}' for request {request_id}")
+                await self.broker.publish({"op": "session", "session": session.to_dict()})
 
-        except Exception as e:
-            logger.error(f"Error handling admin response for {request_id}: {e}")
-            if action == "accept" and request_id in self.active_clients:
-                del self.active_clients[request_id]
-            await self.send_client_list_to_admin()
+    async def connect_admin(self, websocket: WebSocket, admin_user: dict,
+                            max_clients: int = AGENT_MAX_CLIENTS, skills: Set[str] = frozenset()) -> AgentConnection:
+        codec = await accept_websocket(websocket)
+        agent = AgentConnection(websocket, admin_user, max_clients, set(skills), node_id=self.node_id)
+        agent.app_pings = wants_app_pings(websocket)
+        agent.outbound = OutboundQueue(
+            websocket, f"agent {agent.agent_id}", ADMIN_OUTBOUND_QUEUE_SIZE, ADMIN_OUTBOUND_OVERFLOW_POLICY,
+            coalesce_factories={
+                "client_list": lambda: self._client_list_snapshot(agent),
+                "pending_list": lambda: self._pending_list_snapshot(agent),
+            },
+            codec=codec, wait_seconds=agent_outbound_wait_seconds)
+        agent.outbound.on_failure = lambda: self.disconnect_admin(agent)
+        self.agents[agent.agent_id] = agent
+        logger.info(f"Admin {agent.username} connected as agent {agent.agent_id} (capacity {max_clients}, skills {sorted(agent.skills)}).")
+        # Snapshots first, so the deltas produced by routing waiting clients apply on top
+        await self.send_client_list_to_admin(agent)
+        await self.send_pending_requests_to_admin(agent)
+        await self.broker.publish({"op": "agent_up", "agent": agent.to_dict()})
+        await self._assign_orphaned_clients()
+        await self._dispatch_unassigned_requests()
+        return agent
 
-    async def disconnect_client(self, websocket: WebSocket, client_id: Optional[str] = None):
-        """Handles client disconnection, whether from pending or active."""
-        disconnected_client_id = None
-        client_ip_for_log = websocket.client.host if websocket.client else "Unknown"
-
-        if client_id and client_id in self.pending_connections:
-            if self.pending_connections[client_id]["ws"] == websocket:
-                del self.pending_connections[client_id]
-                logger.info(f"Pending client {client_id} ({client_ip_for_log}) disconnected.")
-                await self.send_pending_requests_to_admin()
-                return
-
-        if not client_id:
-            for cid, data in list(self.active_clients.items()):
-                if data["ws"] == websocket:
-                    client_id = cid
+    async def disconnect_admin(self, agent: AgentConnection):
+        if self.agents.pop(agent.agent_id, None) is None:
+            return
+        logger.info(f"Admin {agent.username} (agent {agent.agent_id}) disconnected.")
+        await self.broker.publish({"op": "agent_down", "agent_id": agent.agent_id})
+        await self._release_agent_clients(agent)
+        self._flush_user_message_batch(agent)
+        await agent.outbound.aclose()
+
+    async def _release_agent_clients(self, agent: AgentConnection):
+        """Hand a departed agent's local clients back to the pool.
+
+        Sessions owned by other nodes are left to their owners.
+        """
+        requeued = []
+        for client_id in list(agent.client_ids):
+            session = self._find_session(client_id)
+            if session is None or not session.is_local:
+                continue
+            if session.state == ClientSession.ACTIVE:
+                self.orphaned_clients[client_id] = None
+            else:
+                requeued.append(client_id)
+            await self._transition(session, session.state, None)
+        agent.client_ids.clear()
+        self.unassigned_requests.extendleft(reversed(requeued))
+        if requeued:
+            self._schedule_queue_announcement()
+
+        await self._assign_orphaned_clients()
+        await self._dispatch_unassigned_requests()
+
+    async def disconnect_user_agents(self, username: str, broadcast: bool = True, token_hash: Optional[str] = None):
+        """Close every agent connection belonging to a user, e.g. on logout"""
+        if token_hash and self.session_cache is not None:
+            self.session_cache.invalidate(token_hash)
+        for agent in [agent for agent in self.agents.values() if agent.is_local and agent.username == username]:
+            await agent.outbound.aclose(code=4001, reason="Logged out")
+            await self.disconnect_admin(agent)
+        if broadcast:
+            await self.broker.publish({"op": "logout", "username": username, "token_hash": token_hash})
+
+    async def _assign_orphaned_clients(self):
+        """Give active clients that lost their agent to agents with spare capacity"""
+        for client_id in list(self.orphaned_clients):
+            session = self.active_clients.get(client_id)
+            if session is None:
+                del self.orphaned_clients[client_id]
+                continue
+            agent = self._select_agent(session.info)
+            if agent is None:
+                break
+            del self.orphaned_clients[client_id]
+            await self._transition(session, ClientSession.ACTIVE, agent.agent_id)
+            logger.info(f"Active client {client_id} reassigned to agent {agent.agent_id}.")
+
+    async def _dispatch_unassigned_requests(self):
+        """Route queued pending requests, oldest first, while agents have capacity.
+
+        An agent taking several at once gets them in one pending list delta;
+        whoever is still waiting is told their new place in the queue shortly.
+        """
+        async with self.batched_list_deltas():
+            while self.unassigned_requests:
+                session = self.pending_connections.get(self.unassigned_requests[0])
+                if session is None or session.agent_id is not None:
+                    self.unassigned_requests.popleft()
+                    continue
+                agent = self._select_agent(session.info)
+                if agent is None:
                     break
-            if not client_id:
-                for cid, data in list(self.pending_connections.items()):
-                    if data["ws"] == websocket:
-                        del self.pending_connections[cid]
-                        logger.info(f"Orphaned pending client ({client_ip_for_log}) disconnected before ID assignment.")
-                        await self.send_pending_requests_to_admin()
-                        return
-
-        if client_id and client_id in self.active_clients:
-            if self.active_clients[client_id]["ws"] == websocket:
-                del self.active_clients[client_id]
-                disconnected_client_id = client_id
-                logger.info(f"Active client {client_id} ({client_ip_for_log}) disconnected.")
-                await self.send_client_list_to_admin()
-                if self.admin_websocket:
-                    await self.send_to_admin_socket(self.admin_websocket, {
-                        "type": "client_disconnected_notification",
-                        "client_id": disconnected_client_id,
+                self.unassigned_requests.popleft()
+                self._schedule_queue_announcement()
+                await self._route_request(session, agent)
+                if session.state == ClientSession.PENDING:
+                    await self.send_to_client(session, {
+                        "type": "status_update",
+                        "message": "Connection request pending admin approval. Please wait."
                     })
-        elif client_id:
-            logger.info(f"Client {client_id} ({client_ip_for_log}) disconnected, was not in active list. May have been pending or already removed.")
 
-    async def send_to_admin_socket(self, admin_ws: WebSocket, data: dict):
+    def _queue_status(self, position: int) -> Dict[str, Any]:
+        message = ("All agents are busy." if self.agents else "No agent is online right now.")
+        return {
+            "type": "status_update",
+            "message": f"{message} You are number {position} in the queue. Please wait.",
+            "queue_position": position,
+            "queue_size": len(self.unassigned_requests),
+        }
+
+    def _schedule_queue_announcement(self):
+        if self._queue_timer is None:
+            self._queue_timer = asyncio.get_running_loop().call_later(
+                WAITING_ROOM_UPDATE_INTERVAL_SECONDS, self._announce_queue_positions)
+
+    def _announce_queue_positions(self):
+        self._queue_timer = None
+        for position, client_id in enumerate(self.unassigned_requests, 1):
+            session = self.pending_connections.get(client_id)
+            if session is not None and session.is_local:
+                session.outbound.send(self._queue_status(position))
+
+    async def send_queue_position(self, session: ClientSession):
+        """Tell a waiting visitor where they are in the queue"""
         try:
-            await admin_ws.send_text(json.dumps(data))
-        except Exception as e:
-            logger.warning(f"Failed to send message to admin: {e}. Admin might have disconnected.")
-
-    async def send_client_list_to_admin(self):
-        if self.admin_websocket:
-            clients_data = [
-                {"id": cid, "info": cdata["info"]}
-                for cid, cdata in self.active_clients.items()
+            position = self.unassigned_requests.index(session.client_id) + 1
+        except ValueError:
+            return
+        await self.send_to_client(session, self._queue_status(position))
+
+    async def _route_request(self, session: ClientSession, agent: AgentConnection):
+        if session.auto_accept:
+            await self._approve(session, agent.agent_id, "Connection approved.")
+            logger.info(f"Connection {session.client_id} from {session.client_ip} auto-approved for agent {agent.agent_id}.")
+            return
+        session.routed_at = time.monotonic()
+        await self._transition(session, ClientSession.PENDING, agent.agent_id)
+        logger.info(f"Connection request {session.client_id} from {session.client_ip} routed to agent {agent.agent_id}. Pending admin approval.")
+
+    async def _approve(self, session: ClientSession, agent_id: str, message: str):
+        await self.send_to_client(session, {
+            "type": "connection_approved",
+            "client_id": session.client_id,
+            "message": message
+        })
+        await self._transition(session, ClientSession.ACTIVE, agent_id)
+
+    async def request_connection(self, websocket: WebSocket) -> Optional[ClientSession]:
+        """A client requests to connect.
+
+        An auto-approval rule may reject them outright, or accept them so they
+        skip the agent's approval. Otherwise they are put in pending and routed
+        to an agent, or wait in the waiting room until one is online with
+        capacity. Returns None if the socket has been closed instead.
+        """
+        conversation_id = websocket.query_params.get('conversation_id', 'No conversation ID provided')
+        client_info = self._get_client_info(websocket)
+        client_info['conversation_id'] = conversation_id
+        skill = websocket.query_params.get('skill')
+        if skill:
+            client_info['skill'] = skill
+        rule = self.auto_approval.match(client_info)
+        if rule is not None:
+            self.auto_approval_decisions[rule.action] = self.auto_approval_decisions.get(rule.action, 0) + 1
+        if rule is not None and rule.action == REJECT:
+            session = ClientSession(str(uuid.uuid4()), websocket, client_info, node_id=self.node_id,
+                                    codec=await accept_websocket(websocket))
+            logger.info(f"Connection request from {session.client_ip} rejected by auto-approval rule '{rule.name}'.")
+            await self.send_to_client(session, {"type": "connection_rejected", "message": "Connection rejected."})
+            await session.outbound.aclose(code=4001)
+            return None
+        agent = self._select_agent(client_info)
+
+        codec = await accept_websocket(websocket)
+        if agent is None and len(self.unassigned_requests) >= WAITING_ROOM_SIZE:
+            self.waiting_room_rejections += 1
+            logger.warning(f"Connection request from {client_info['client_ip']} refused. Waiting room full ({len(self.unassigned_requests)}).")
+            await websocket.close(code=1013, reason="Waiting room full")
+            return None
+
+        request_id = str(uuid.uuid4())
+        session = ClientSession(request_id, websocket, client_info, node_id=self.node_id, codec=codec)
+        session.auto_accept = rule is not None and rule.action == ACCEPT
+        session.app_pings = wants_app_pings(websocket)
+        session.outbound.on_failure = lambda: self.remove_session(session)
+        self.sessions_by_socket[id(websocket)] = session
+
+        if agent is None:
+            await self._transition(session, ClientSession.PENDING, None)
+            self.unassigned_requests.append(request_id)
+            reason = "All agents at capacity" if self.agents else "No agent online"
+            logger.info(f"Connection request {request_id} from {session.client_ip} queued at {len(self.unassigned_requests)}. {reason}.")
+            await self.send_to_client(session, self._queue_status(len(self.unassigned_requests)))
+        else:
+            await self._route_request(session, agent)
+        return session
+
+    async def handle_admin_response(self, agent: AgentConnection, request_id: str, action: str):
+        session = self.pending_connections.get(request_id)
+        if session is None or session.agent_id != agent.agent_id:
+            logger.warning(f"Request ID {request_id} not found in pending connections of agent {agent.agent_id} for action: {action}")
+            await self.send_to_agent(agent, {"type": "error", "message": f"Request {request_id} not found."})
+            return
+        if not session.is_local:
+            await self.broker.publish({
+                "op": "admin_response", "to": session.node_id,
+                "agent_id": agent.agent_id, "request_id": request_id, "action": action
+            })
+            return
+        await self._apply_admin_response(session, agent.agent_id, action)
+
+    async def _apply_admin_response(self, session: ClientSession, agent_id: str, action: str):
+        """Accept or reject a local pending session on behalf of an agent on any node"""
+        request_id = session.client_id
+        if session.state != ClientSession.PENDING or session.agent_id != agent_id:
+            agent = self.agents.get(agent_id)
+            if agent:
+                await self.send_to_agent(agent, {"type": "error", "message": f"Request {request_id} not found."})
+            return
+
+        if action in ("accept", "reject"):
+            approval_wait_seconds.labels(action).observe(time.monotonic() - session.requested_at)
+
+        if action == "accept":
+            await self._approve(session, agent_id, "Connection approved by admin.")
+            logger.info(f"Connection {request_id} approved for {session.client_ip} by agent {agent_id}.")
+
+        elif action == "reject":
+            await self.send_to_client(session, {
+                "type": "connection_rejected",
+                "message": "Connection rejected by admin."
+            })
+            await self._transition(session, ClientSession.CLOSED, agent_id)
+            logger.info(f"Connection {request_id} rejected for {session.client_ip}.")
+            await self._dispatch_unassigned_requests()
+            await session.outbound.aclose(code=4001)
+        else:
+            # Leave the request pending for a valid answer
+            logger.warning(f"Unknown action '{action}' for request {request_id}")
+            agent = self.agents.get(agent_id)
+            if agent:
+                await self.send_to_agent(agent, {"type": "error", "message": f"Unknown action '{action}' for request {request_id}."})
+
+    async def set_auto_approval_rules(self, rules: RuleSet, broadcast: bool = True):
+        """Swap in new auto-approval rules here and, unless they came from a peer, on every node"""
+        self.auto_approval = rules
+        logger.info(f"Auto-approval rules replaced: {len(rules)} rules.")
+        frame = {"type": "auto_approval_rules", "rules": rules.specs()}
+        for agent in self.agents.values():
+            if agent.is_local:
+                await self.send_to_agent(agent, frame)
+        if broadcast:
+            await self.broker.publish({"op": "auto_approval_rules", "rules": frame["rules"]})
+
+    async def disconnect_client(self, websocket: WebSocket, client_id: Optional[str] = None):
+        """Handles client disconnection, whether from pending or active."""
+        session = self.get_session(websocket)
+        if session is None:
+            if client_id:
+                logger.info(f"Client {client_id} disconnected, was not in active list. May have been pending or already removed.")
+            return
+        await self.remove_session(session)
+
+    async def remove_session(self, session: ClientSession):
+        """Drop a local session from every index and tell its agent"""
+        if session.state != ClientSession.CLOSED:
+            logger.info(f"{session.state.capitalize()} client {session.client_id} ({session.client_ip}) disconnected.")
+            await self._transition(session, ClientSession.CLOSED, session.agent_id)
+            await self._dispatch_unassigned_requests()
+        await session.outbound.aclose()
+
+    async def send_to_agent(self, agent: AgentConnection, data, coalesce_key: Optional[str] = None):
+        """Queue a frame for an agent, relaying it through the broker if they are on another node"""
+        if agent.is_local:
+            self._send_local(agent, data, coalesce_key)
+        else:
+            await self.broker.publish({
+                "op": "to_agent", "to": agent.node_id,
+                "agent_id": agent.agent_id, "frame": data, "coalesce_key": coalesce_key
+            })
+
+    def _send_local(self, agent: AgentConnection, data, coalesce_key: Optional[str] = None):
+        # Flush batched messages first so the agent sees frames in the order they were produced
+        if agent.user_message_batch:
+            self._flush_user_message_batch(agent)
+        agent.outbound.send(data, coalesce_key)
+
+    async def _deliver_user_message(self, agent: AgentConnection, frame: Dict[str, Any]):
+        if agent.is_local and USER_MESSAGE_BATCH_WINDOW_MS > 0:
+            self._batch_user_message(agent, frame)
+        else:
+            await self.send_to_agent(agent, frame)
+
+    def _batch_user_message(self, agent: AgentConnection, frame: Dict[str, Any]):
+        agent.user_message_batch.append(frame)
+        if len(agent.user_message_batch) >= USER_MESSAGE_BATCH_MAX:
+            self._flush_user_message_batch(agent)
+        elif agent.batch_timer is None:
+            agent.batch_timer = asyncio.get_running_loop().call_later(
+                USER_MESSAGE_BATCH_WINDOW_MS / 1000, self._flush_user_message_batch, agent)
+
+    def _flush_user_message_batch(self, agent: AgentConnection):
+        """Send held user messages as one frame, with each client's info included once"""
+        if agent.batch_timer is not None:
+            agent.batch_timer.cancel()
+            agent.batch_timer = None
+        messages, agent.user_message_batch = agent.user_message_batch, []
+        if len(messages) == 1:
+            agent.outbound.send(messages[0])
+        elif messages:
+            clients: Dict[str, Dict[str, str]] = {}
+            for frame in messages:
+                clients.setdefault(frame["client_id"], frame["client_info"])
+            agent.outbound.send({
+                "type": "user_message_batch",
+                "clients": clients,
+                "messages": [{"client_id": frame["client_id"], "message": frame["message"],
+                              "created_at": frame.get("created_at")} for frame in messages]
+            })
+
+    async def send_to_client(self, session: ClientSession, data):
+        """Queue a frame for a local visitor; never waits on the visitor's socket"""
+        session.outbound.send(data)
+
+    def _client_entry(self, session: ClientSession) -> Dict[str, Any]:
+        return {"id": session.client_id, "info": session.info}
+
+    def _pending_entry(self, session: ClientSession) -> Dict[str, Any]:
+        return {"request_id": session.client_id, "conversation_id": session.info["conversation_id"], "client_info": session.info}
+
+    def _encoded_snapshot(self, agent: AgentConnection, key: str, version: int,
+                          build: Callable[[], Dict[str, Any]]) -> EncodedFrame:
+        """A list only changes together with its version, so each version is encoded once however often it is sent"""
+        cached = agent.encoded_snapshots.get(key)
+        if cached is None or cached[0] != version:
+            cached = (version, encode_frame(build()))
+            agent.encoded_snapshots[key] = cached
+        return cached[1]
+
+    def _client_list_snapshot(self, agent: AgentConnection) -> EncodedFrame:
+        return self._encoded_snapshot(agent, "client_list", agent.client_list_version, lambda: {
+            "type": "client_list_update",
+            "version": agent.client_list_version,
+            "clients": [
+                self._client_entry(self.active_clients[cid])
+                for cid in agent.client_ids if cid in self.active_clients
             ]
-            await self.send_to_admin_socket(self.admin_websocket, {"type": "client_list_update", "clients": clients_data})
+        })
 
-    async def send_pending_requests_to_admin(self):
-        if self.admin_websocket:
-            pending_data = [
-                {"request_id": rid, "info": rdata["info"]}
-                for rid, rdata in self.pending_connections.items()
+    def _pending_list_snapshot(self, agent: AgentConnection) -> EncodedFrame:
+        return self._encoded_snapshot(agent, "pending_list", agent.pending_list_version, lambda: {
+            "type": "pending_requests_list",
+            "version": agent.pending_list_version,
+            "requests": [
+                self._pending_entry(self.pending_connections[rid])
+                for rid in agent.client_ids if rid in self.pending_connections
             ]
-            await self.send_to_admin_socket(self.admin_websocket, {"type": "pending_requests_list", "requests": pending_data})
+        })
+
+    async def send_client_list_to_admin(self, agent: AgentConnection, known_version: Optional[int] = None):
+        """Send the agent's full client list, unless the UI already holds the current version.
+
+        The snapshot is built when the writer gets to it, so it reflects every
+        delta queued before it was sent.
+        """
+        if known_version is not None and known_version == agent.client_list_version:
+            return
+        await self.send_to_agent(agent, lambda: self._client_list_snapshot(agent), coalesce_key="client_list")
+
+    async def send_pending_requests_to_admin(self, agent: AgentConnection, known_version: Optional[int] = None):
+        """Send the agent's full pending list, unless the UI already holds the current version"""
+        if known_version is not None and known_version == agent.pending_list_version:
+            return
+        await self.send_to_agent(agent, lambda: self._pending_list_snapshot(agent), coalesce_key="pending_list")
+
+    async def send_client_list_delta(self, agent: AgentConnection, ops: List[Dict[str, Any]]):
+        """Send add/remove/update ops for the agent's client list as one versioned frame"""
+        if self._held_deltas is not None:
+            self._held_deltas.setdefault((agent.agent_id, "client_list"), []).extend(ops)
+            return
+        agent.client_list_version += 1
+        await self.send_to_agent(agent, {
+            "type": "client_list_delta",
+            "version": agent.client_list_version,
+            "ops": ops
+        }, coalesce_key="client_list")
+
+    async def send_pending_requests_delta(self, agent: AgentConnection, ops: List[Dict[str, Any]]):
+        """Send add/remove ops for the agent's pending list as one versioned frame"""
+        if self._held_deltas is not None:
+            self._held_deltas.setdefault((agent.agent_id, "pending_list"), []).extend(ops)
+            return
+        agent.pending_list_version += 1
+        await self.send_to_agent(agent, {
+            "type": "pending_requests_delta",
+            "version": agent.pending_list_version,
+            "ops": ops
+        }, coalesce_key="pending_list")
+
+    @asynccontextmanager
+    async def batched_list_deltas(self):
+        """Hold the list deltas and session removals made inside the block and send them once at the end.
+
+        Each local agent gets at most one client_list_delta and one
+        pending_requests_delta for the whole block, and peers get a single
+        sessions_removed event.
+        """
+        if self._held_deltas is not None:
+            yield
+            return
+        self._held_deltas, self._held_removals = {}, []
+        try:
+            yield
+        finally:
+            held, removals = self._held_deltas, self._held_removals
+            self._held_deltas, self._held_removals = None, []
+            for (agent_id, key), ops in held.items():
+                agent = self.agents.get(agent_id)
+                if agent is None:
+                    continue
+                if key == "client_list":
+                    await self.send_client_list_delta(agent, ops)
+                else:
+                    await self.send_pending_requests_delta(agent, ops)
+            if removals:
+                await self.broker.publish({"op": "sessions_removed", "client_ids": removals})
+
+    def _eviction_reason(self, session: ClientSession, now: float) -> Optional[str]:
+        if session.state == ClientSession.PENDING:
+            # Visitors in the waiting room (no agent yet) wait as long as it takes
+            if (PENDING_REQUEST_TTL_SECONDS and session.agent_id is not None
+                    and now - session.routed_at > PENDING_REQUEST_TTL_SECONDS):
+                return "request_expired"
+            if CLIENT_PENDING_IDLE_TIMEOUT_SECONDS and now - session.last_seen > CLIENT_PENDING_IDLE_TIMEOUT_SECONDS:
+                return "idle_timeout"
+        elif session.state == ClientSession.ACTIVE:
+            if CLIENT_ACTIVE_IDLE_TIMEOUT_SECONDS and now - session.last_seen > CLIENT_ACTIVE_IDLE_TIMEOUT_SECONDS:
+                return "idle_timeout"
+        return None
+
+    async def _run_reaper(self):
+        while True:
+            await asyncio.sleep(HEARTBEAT_INTERVAL_SECONDS)
+            try:
+                await self.heartbeat()
+            except Exception as e:
+                logger.error(f"Connection reaper run failed: {e}", exc_info=True)
+
+    async def heartbeat(self) -> int:
+        """Ping quiet local sockets and evict those past their idle timeout or request TTL.
+
+        Returns the number of visitors and agents evicted.
+        """
+        now = time.monotonic()
+        ping = {"type": "ping"}
+        evicted: List[Tuple[ClientSession, str]] = []
+        for session in list(self.sessions_by_socket.values()):
+            reason = self._eviction_reason(session, now)
+            if reason:
+                evicted.append((session, reason))
+            elif session.app_pings and now - session.last_seen >= HEARTBEAT_INTERVAL_SECONDS:
+                session.outbound.send(ping)
+        idle_agents = []
+        # A quiet agent that never gets ping frames may just be watching; protocol pings catch dead ones
+        for agent in [agent for agent in self.agents.values() if agent.is_local and agent.app_pings]:
+            if ADMIN_IDLE_TIMEOUT_SECONDS and now - agent.last_seen > ADMIN_IDLE_TIMEOUT_SECONDS:
+                idle_agents.append(agent)
+            elif now - agent.last_seen >= HEARTBEAT_INTERVAL_SECONDS:
+                self._send_local(agent, ping, coalesce_key="ping")
+
+        for start in range(0, len(evicted), REAP_BATCH_SIZE):
+            batch = evicted[start:start + REAP_BATCH_SIZE]
+            async with self.batched_list_deltas():
+                for session, reason in batch:
+                    if session.state == ClientSession.CLOSED:
+                        continue
+                    key = (session.state, reason)
+                    self.reaped[key] = self.reaped.get(key, 0) + 1
+                    logger.info(f"{session.state.capitalize()} client {session.client_id} ({session.client_ip}) evicted: {reason}.")
+                    await self.send_to_client(session, {
+                        "type": "connection_closed",
+                        "reason": reason,
+                        "message": self.EVICTION_MESSAGES[reason]
+                    })
+                    await self._transition(session, ClientSession.CLOSED, session.agent_id)
+                await self._dispatch_unassigned_requests()
+            # Close after the batch's deltas are out; a dead socket may take the whole drain timeout
+            await asyncio.gather(*(session.outbound.aclose(code=4008, reason=reason) for session, reason in batch))
+
+        if idle_agents:
+            async with self.batched_list_deltas():
+                for agent in idle_agents:
+                    key = ("agent", "idle_timeout")
+                    self.reaped[key] = self.reaped.get(key, 0) + 1
+                    logger.info(f"Admin {agent.username} (agent {agent.agent_id}) evicted: idle_timeout.")
+                    await agent.outbound.aclose(code=4008, reason="idle_timeout")
+                    await self.disconnect_admin(agent)
+        return len(evicted) + len(idle_agents)
+
+    def _record_message(self, session: ClientSession, sender: str, message: str,
+                        agent_username: Optional[str] = None) -> Optional[str]:
+        """Persist a chat message; returns its stored created_at, which the admin page uses to match history"""
+        if self.message_writer is None:
+            return None
+        created_at = self.message_writer.record(session.info["conversation_id"], session.client_id, sender, message,
+                                                agent_username)
+        return created_at.isoformat() if created_at is not None else None
 
     async def forward_user_message_to_admin(self, client_id: str, message: str):
-        if self.admin_websocket and client_id in self.active_clients:
-            client_info = self.active_clients[client_id]["info"]
-            await self.send_to_admin_socket(self.admin_websocket, {
+        session = self.active_clients.get(client_id)
+        agent = self.agents.get(session.agent_id) if session and session.agent_id else None
+        if agent:
+            created_at = self._record_message(session, SENDER_USER, message, agent.username)
+            await self._deliver_user_message(agent, {
                 "type": "user_message",
                 "client_id": client_id,
                 "message": message,
-                "client_info": client_info
+                "client_info": session.info,
+                "created_at": created_at
             })
 
-    async def forward_admin_message_to_client(self, target_client_id: str, message: str):
-        if target_client_id in self.active_clients:
-            client_data = self.active_clients[target_client_id]
-            try:
-                await client_data["ws"].send_text(json.dumps({
-                    "type": "admin_message",
-                    "message": message
-                }))
-                logger.info(f"Admin message sent to client {target_client_id}")
-            except Exception as e:
-                logger.error(f"Failed to send admin message to client {target_client_id}: {e}")
-                await self.disconnect_client(client_data["ws"], target_client_id)
-        else:
-            logger.warning(f"Admin tried to send message to non-existent/inactive client ID: {target_client_id}")
-            if self.admin_websocket:
-                await self.send_to_admin_socket(self.admin_websocket, {
-                    "type": "error",
-                    "message": f"Client {target_client_id} not found or is not active."
+    async def forward_admin_message_to_client(self, agent: AgentConnection, target_client_id: str, message: str):
+        session = self.active_clients.get(target_client_id)
+        if session and session.agent_id == agent.agent_id:
+            frame = {"type": "admin_message", "message": message}
+            if session.is_local:
+                await self._send_agent_message(session, agent, frame)
+            else:
+                await self.broker.publish({
+                    "op": "to_client", "to": session.node_id,
+                    "client_id": target_client_id, "agent_id": agent.agent_id, "frame": frame
                 })
+            logger.info(f"Admin message queued for client {target_client_id}",
+                        extra={"category": "admin_message", "client_id": target_client_id, "agent_id": agent.agent_id})
+        else:
+            logger.warning(f"Agent {agent.agent_id} tried to send message to non-existent/inactive client ID: {target_client_id}")
+            await self.send_to_agent(agent, {
+                "type": "error",
+                "message": f"Client {target_client_id} not found or is not active."
+            })
+
+    async def _send_agent_message(self, session: ClientSession, agent: AgentConnection, frame: Dict[str, Any]):
+        """Persist and deliver an agent's message to a local visitor, then tell the agent when it was stored"""
+        created_at = self._record_message(session, SENDER_AGENT, frame["message"], agent.username)
+        await self.send_to_client(session, frame)
+        if created_at is not None:
+            await self.send_to_agent(agent, {"type": "admin_message_sent", "client_id": session.client_id,
+                                             "created_at": created_at})
 
     def is_client_pending(self, websocket: WebSocket) -> bool:
-        for data in self.pending_connections.values():
-            if data["ws"] == websocket:
-                return True
-        return False
+        session = self.get_session(websocket)
+        return session is not None and session.state == ClientSession.PENDING
 
     def is_client_active(self, websocket: WebSocket) -> Optional[str]:
-        for client_id, data in self.active_clients.items():
-            if data["ws"] == websocket:
-                return client_id
+        session = self.get_session(websocket)
+        if session is not None and session.state == ClientSession.ACTIVE:
+            return session.client_id
         return None
 
-manager = ConnectionManager()
+    def local_connection_counts(self) -> Dict[Tuple[str], int]:
+        """Visitors connected to this node, by state"""
+        counts = {(ClientSession.ACTIVE,): 0, (ClientSession.PENDING,): 0}
+        for session in self.sessions_by_socket.values():
+            if session.state != ClientSession.CLOSED:
+                counts[(session.state,)] += 1
+        return counts
+
+    def reaper_stats(self) -> Dict[str, int]:
+        """Evictions so far, keyed <state or agent>_<reason>"""
+        return {f"{kind}_{reason}": count for (kind, reason), count in self.reaped.items()}
+
+    def outbound_stats(self) -> Dict[str, Any]:
+        """Backpressure counters: process totals plus per-agent queue detail"""
+        return {
+            "totals": outbound_totals.as_dict(),
+            "agents": {
+                agent.agent_id: dict(agent.outbound.stats(), username=agent.username)
+                for agent in self.agents.values() if agent.is_local
+            },
+        }
+
+    async def _announce(self):
+        """Run on every broker (re)connection: publish our state and ask peers for theirs"""
+        await self._publish_local_state()
+        await self.broker.publish({"op": "sync_request"})
+
+    async def _publish_local_state(self, to: Optional[str] = None):
+        for agent in [agent for agent in self.agents.values() if agent.is_local]:
+            await self.broker.publish({"op": "agent_up", "to": to, "agent": agent.to_dict()})
+        for session in list(self.sessions_by_socket.values()):
+            await self.broker.publish({"op": "session", "to": to, "session": session.to_dict()})
+
+    async def _remove_remote_agents(self, agents: List[AgentConnection]):
+        for agent in agents:
+            self.agents.pop(agent.agent_id, None)
+            logger.info(f"Remote agent {agent.agent_id} ({agent.username}) on node {agent.node_id} went away.")
+        for agent in agents:
+            await self._release_agent_clients(agent)
+
+    async def _handle_broker_event(self, event: Dict[str, Any]):
+        """Apply an event published by another node"""
+        op, node = event["op"], event.get("node")
+
+        if op == "sync_request":
+            await self._publish_local_state(to=node)
+
+        elif op == "agent_up":
+            data = event["agent"]
+            if data["agent_id"] not in self.agents:
+                agent = AgentConnection(None, {"username": data["username"]}, data["max_clients"], set(data["skills"]),
+                                        agent_id=data["agent_id"], node_id=node)
+                # Sessions routed to this agent may have been mirrored before the agent itself
+                agent.client_ids = {
+                    cid for registry in (self.active_clients, self.pending_connections)
+                    for cid, session in registry.items() if session.agent_id == agent.agent_id
+                }
+                self.agents[agent.agent_id] = agent
+                await self._assign_orphaned_clients()
+                await self._dispatch_unassigned_requests()
+
+        elif op == "agent_down":
+            agent = self.agents.get(event["agent_id"])
+            if agent and not agent.is_local:
+                await self._remove_remote_agents([agent])
+
+        elif op == "session":
+            data = event["session"]
+            session = self._find_session(data["client_id"])
+            if session is None:
+                session = ClientSession(data["client_id"], None, data["info"], node_id=node)
+            if not session.is_local:
+                await self._transition(session, data["state"], data["agent_id"])
+                await self._assign_orphaned_clients()
+                await self._dispatch_unassigned_requests()
+
+        elif op == "session_removed":
+            session = self._find_session(event["client_id"])
+            if session and not session.is_local:
+                await self._transition(session, ClientSession.CLOSED, session.agent_id)
+                await self._assign_orphaned_clients()
+                await self._dispatch_unassigned_requests()
+
+        elif op == "sessions_removed":
+            async with self.batched_list_deltas():
+                for client_id in event["client_ids"]:
+                    session = self._find_session(client_id)
+                    if session and not session.is_local:
+                        await self._transition(session, ClientSession.CLOSED, session.agent_id)
+                await self._assign_orphaned_clients()
+                await self._dispatch_unassigned_requests()
+
+        elif op == "to_agent":
+            agent = self.agents.get(event["agent_id"])
+            if agent and agent.is_local:
+                if event["frame"].get("type") == "user_message":
+                    await self._deliver_user_message(agent, event["frame"])
+                else:
+                    self._send_local(agent, event["frame"], event.get("coalesce_key"))
+
+        elif op == "to_client":
+            session = self.active_clients.get(event["client_id"])
+            if session and session.is_local and session.agent_id == event["agent_id"]:
+                agent = self.agents.get(event["agent_id"])
+                if agent:
+                    await self._send_agent_message(session, agent, event["frame"])
+                else:
+                    self._record_message(session, SENDER_AGENT, event["frame"]["message"])
+                    await self.send_to_client(session, event["frame"])
+
+        elif op == "admin_response":
+            session = self.pending_connections.get(event["request_id"])
+            if session and session.is_local:
+                await self._apply_admin_response(session, event["agent_id"], event["action"])
+
+        elif op == "auto_approval_rules":
+            try:
+                rules = RuleSet(event["rules"])
+            except ValueError as e:
+                logger.error(f"Auto-approval rules from node {node} not applied: {e}")
+            else:
+                await self.set_auto_approval_rules(rules, broadcast=False)
+
+        elif op == "logout":
+            await self.disconnect_user_agents(event["username"], broadcast=False, token_hash=event.get("token_hash"))
+
+        elif op == "node_down":
+            logger.warning(f"Node {node} left the cluster. Dropping its agents and clients.")
+            for registry in (self.active_clients, self.pending_connections):
+                for session in [s for s in registry.values() if s.node_id == node]:
+                    await self._transition(session, ClientSession.CLOSED, session.agent_id)
+            await self._remove_remote_agents([agent for agent in self.agents.values() if agent.node_id == node])
+
+message_writer = MessageWriter(MESSAGE_FLUSH_BATCH_SIZE, MESSAGE_FLUSH_INTERVAL_SECONDS, MESSAGE_BUFFER_MAX)
+password_hasher = PasswordHasher(PASSWORD_SCRYPT_N, PASSWORD_SCRYPT_R, PASSWORD_SCRYPT_P,
+                                 PASSWORD_HASH_WORKERS, PASSWORD_HASH_MAX_CONCURRENT)
+session_cache = SessionCache(SESSION_CACHE_MAX_SIZE, SESSION_CACHE_TTL_SECONDS)
+last_login_writer = LastLoginWriter(LAST_LOGIN_FLUSH_INTERVAL_SECONDS)
+session_reaper = SessionReaper(SESSION_REAP_INTERVAL_SECONDS, SESSION_REAP_BATCH_SIZE)
+manager = ConnectionManager(message_writer=message_writer, session_cache=session_cache,
+                            auto_approval=load_rules(AUTO_APPROVAL_RULES_FILE))
+admission = AdmissionControl(CLIENT_MAX_CONNECTIONS, CLIENT_CONNECT_RATE_PER_IP, CLIENT_CONNECT_BURST_PER_IP,
+                             CLIENT_MESSAGE_RATE_PER_IP, CLIENT_MESSAGE_BURST_PER_IP,
+                             CLIENT_MESSAGE_RATE_PER_CONNECTION, CLIENT_MESSAGE_BURST_PER_CONNECTION, RATE_LIMIT_MAX_IPS)
+
+# Prometheus metrics for this worker, served at /metrics. Values read from existing counters are collected at scrape time.
+metrics_registry = Registry()
+Gauge("chatserver_connections", "Visitor connections on this worker", ["state"], metrics_registry,
+      fn=manager.local_connection_counts)
+Gauge("chatserver_agents", "Agents connected to this worker", registry=metrics_registry,
+      fn=lambda: sum(1 for agent in manager.agents.values() if agent.is_local))
+Gauge("chatserver_unassigned_requests", "Pending requests waiting for an agent with capacity", registry=metrics_registry,
+      fn=lambda: len(manager.unassigned_requests))
+Counter("chatserver_load_shed_total", "Visitor sockets closed by admission control or rate limits", ["reason"],
+        metrics_registry, fn=lambda: {(reason,): count for reason, count in admission.shed.items()})
+Counter("chatserver_waiting_room_rejections_total", "Visitors closed with 1013 because the waiting room was full",
+        registry=metrics_registry, fn=lambda: manager.waiting_room_rejections)
+Counter("chatserver_auto_approval_total", "Connection requests decided by an auto-approval rule", ["action"],
+        metrics_registry, fn=lambda: {(action,): count for action, count in manager.auto_approval_decisions.items()})
+approval_wait_seconds = Histogram("chatserver_approval_wait_seconds", "Time from a connection request to the agent's response",
+                                  ["action"], metrics_registry, buckets=WAIT_BUCKETS)
+forward_seconds = Histogram("chatserver_forward_seconds", "Time from receiving a chat message to queueing it for the recipient",
+                            ["direction"], metrics_registry)
+client_to_admin_seconds = forward_seconds.labels("client_to_admin")
+admin_to_client_seconds = forward_seconds.labels("admin_to_client")
+outbound_wait_seconds = Histogram("chatserver_outbound_wait_seconds", "Time from queueing a frame to its socket write completing",
+                                  ["recipient"], metrics_registry)
+agent_outbound_wait_seconds = outbound_wait_seconds.labels("agent")
+client_outbound_wait_seconds = outbound_wait_seconds.labels("client")
+Gauge("chatserver_outbound_queue_depth", "Frames queued across all outbound queues", registry=metrics_registry,
+      fn=lambda: outbound_totals.depth)
+Counter("chatserver_send_failures_total", "Socket writes that failed", registry=metrics_registry,
+        fn=lambda: outbound_totals.send_failures)
+Counter("chatserver_outbound_dropped_total", "Frames dropped by full outbound queues", registry=metrics_registry,
+        fn=lambda: outbound_totals.dropped)
+Counter("chatserver_outbound_coalesced_total", "Frames coalesced by full outbound queues", registry=metrics_registry,
+        fn=lambda: outbound_totals.coalesced)
+Counter("chatserver_reaped_total", "Visitors and agents evicted for idling or an expired request", ["kind", "reason"],
+        metrics_registry, fn=lambda: manager.reaped)
+Counter("chatserver_slow_consumer_disconnects_total", "Sockets closed for falling too far behind", registry=metrics_registry,
+        fn=lambda: outbound_totals.slow_consumer_disconnects)
+Gauge("chatserver_db_pool_size", "Open database connections", registry=metrics_registry,
+      fn=lambda: storage.pool_stats()["size"])
+Gauge("chatserver_db_pool_in_use", "Database connections checked out", registry=metrics_registry,
+      fn=lambda: storage.pool_stats()["size"] - storage.pool_stats()["idle"])
+Gauge("chatserver_db_pool_max_size", "Database pool capacity", registry=metrics_registry,
+      fn=lambda: storage.pool_stats()["max_size"])
+Gauge("chatserver_db_pool_waiting", "Callers waiting for a database connection", registry=metrics_registry,
+      fn=lambda: storage.pool_stats()["waiting"])
+db_pool_acquire_seconds = Histogram("chatserver_db_pool_acquire_seconds", "Time to get a connection from the pool",
+                                    registry=metrics_registry)
+Gauge("chatserver_auth_cache_size", "Cached sessions", registry=metrics_registry, fn=lambda: len(session_cache))
+Counter("chatserver_auth_cache_hits_total", "Token validations answered from the cache", registry=metrics_registry,
+        fn=lambda: session_cache.hits)
+Counter("chatserver_auth_cache_misses_total", "Token validations that went to the database", registry=metrics_registry,
+        fn=lambda: session_cache.misses)
+Counter("chatserver_auth_cache_evictions_total", "Sessions evicted from the cache to stay within its size", registry=metrics_registry,
+        fn=lambda: session_cache.evictions)
+
+storage = create_storage(STORAGE_ENGINE, DATABASE_URL, SQLITE_PATH, db_pool_acquire_seconds)
+
+@app.get("/metrics")
+async def get_metrics(request: Request):
+    """Prometheus scrape endpoint"""
+    if METRICS_TOKEN and not secrets.compare_digest(request.headers.get("authorization", ""), f"Bearer {METRICS_TOKEN}"):
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid metrics token")
+    return Response(metrics_registry.render(), media_type=METRICS_CONTENT_TYPE)
+
+@app.get("/api/stats")
+async def get_stats(current_user: dict = Depends(get_current_admin_user)):
+    """Runtime counters for operators"""
+    return {
+        "outbound": manager.outbound_stats(),
+        "messages": message_writer.stats(),
+        "auth_cache": session_cache.stats(),
+        "session_reaper": session_reaper.stats(),
+        "password_hashing": password_hasher.stats(),
+        "last_login": last_login_writer.stats(),
+        "logging": log_pipeline.stats(),
+        "reaped": manager.reaper_stats(),
+        "admission": admission.stats(),
+        "waiting_room": {"waiting": len(manager.unassigned_requests), "max": WAITING_ROOM_SIZE,
+                         "rejected": manager.waiting_room_rejections},
+        "auto_approval": {"rules": len(manager.auto_approval), "decisions": dict(manager.auto_approval_decisions)},
+        "storage": {"engine": storage.name, **storage.pool_stats()},
+    }
+
+@app.get("/api/conversations/{conversation_id}/messages")
+async def get_conversation_messages(conversation_id: str, before: Optional[str] = None,
+                                    limit: int = Query(HISTORY_PAGE_SIZE, ge=1, le=HISTORY_PAGE_MAX),
+                                    current_user: dict = Depends(get_current_admin_user)):
+    """Stored messages of a conversation, newest first. Pass ``next_before`` back as ``before`` for older pages."""
+    try:
+        return await fetch_messages_page(storage, conversation_id, before, limit)
+    except ValueError:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid pagination cursor")
 
 @app.websocket("/admin")
 async def admin_websocket_endpoint(websocket: WebSocket):
@@ -642,108 +1620,130 @@ async def admin_websocket_endpoint(websocket: WebSocket):
         await websocket.close(code=4001, reason="Authentication required")
         return
     
+    user = await validate_token(token)
+    if not user:
+        await websocket.close(code=4001, reason="Invalid or expired token")
+        return
+    if not user["is_admin"]:
+        await websocket.close(code=4001, reason="Admin access required")
+        return
+
+    # Optional per-agent routing settings, capped by the server-wide capacity
+    skills = {s.strip() for s in websocket.query_params.get("skills", "").split(",") if s.strip()}
     try:
-        # Verify token
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        username = payload.get("sub")
-        
-        if not username:
-            await websocket.close(code=4001, reason="Invalid token")
-            return
-        
-        # Get user from database
-        async with db_pool.acquire() as conn:
-            user = await conn.fetchrow(
-                "SELECT * FROM chatserver_users WHERE username = $1 AND is_admin = TRUE", username
-            )
-            if not user:
-                await websocket.close(code=4001, reason="Admin access required")
-                return
-            
-            # Verify session
-            token_hash = hashlib.sha256(token.encode()).hexdigest()
-            session = await conn.fetchrow(
-                "SELECT * FROM chatserver_user_sessions WHERE user_id = $1 AND token_hash = $2 AND expires_at > NOW()",
-                user['id'], token_hash
-            )
-            if not session:
-                await websocket.close(code=4001, reason="Session expired")
-                return
-        
-        await manager.connect_admin(websocket, dict(user))
-        
-        try:
-            while True:
-                message_text = await websocket.receive_text()
-                data = json.loads(message_text)
-                logger.info(f"Admin {user['username']} received: {data}")
-
-                if data["type"] == "connection_response":
-                    await manager.handle_admin_response(data["request_id"], data["action"])
-                elif data["type"] == "admin_message_to_client":
-                    await manager.forward_admin_message_to_client(data["target_client_id"], data["message"])
-                elif data["type"] == "get_client_list":
-                    await manager.send_client_list_to_admin()
-                elif data["type"] == "get_pending_requests":
-                    await manager.send_pending_requests_to_admin()
-
-        except WebSocketDisconnect:
-            logger.info(f"Admin {user['username']} WebSocket disconnected.")
-        except Exception as e:
-            logger.error(f"Error in admin WebSocket: {e}", exc_info=True)
-        finally:
-            await manager.disconnect_admin()
-            
-    except jwt.PyJWTError:
-        await websocket.close(code=4001, reason="Invalid token")
+        max_clients = min(int(websocket.query_params.get("max_clients", AGENT_MAX_CLIENTS)), AGENT_MAX_CLIENTS)
+    except ValueError:
+        max_clients = AGENT_MAX_CLIENTS
+
+    agent = await manager.connect_admin(websocket, dict(user), max_clients=max_clients, skills=skills)
+    
+    try:
+        while True:
+            frame = await receive_frame(websocket)
+            received_at = agent.last_seen = time.monotonic()
+            data = decode_frame(frame)
+            if is_pong(data):
+                continue
+            logger.info(f"Admin {user['username']} sent a {data.get('type')} frame",
+                        extra={"category": "admin_frame", "username": user["username"], "frame": data})
+
+            if data["type"] == "connection_response":
+                await manager.handle_admin_response(agent, data["request_id"], data["action"])
+            elif data["type"] == "admin_message_to_client":
+                if not isinstance(data.get("message"), str):
+                    await manager.send_to_agent(agent, {"type": "error", "message": "Messages must be text."})
+                    continue
+                await manager.forward_admin_message_to_client(agent, data["target_client_id"], data["message"])
+                admin_to_client_seconds.observe(time.monotonic() - received_at)
+            elif data["type"] == "get_client_list":
+                await manager.send_client_list_to_admin(agent, data.get("version"))
+            elif data["type"] == "get_pending_requests":
+                await manager.send_pending_requests_to_admin(agent, data.get("version"))
+            elif data["type"] == "get_auto_approval_rules":
+                await manager.send_to_agent(agent, {"type": "auto_approval_rules", "rules": manager.auto_approval.specs()})
+            elif data["type"] == "reload_auto_approval_rules":
+                # Inline rules replace the current ones; without them the rules file is read again
+                try:
+                    rules = RuleSet(data["rules"]) if "rules" in data else load_rules(AUTO_APPROVAL_RULES_FILE)
+                except (OSError, ValueError) as e:
+                    await manager.send_to_agent(agent, {"type": "error", "message": f"Auto-approval rules not loaded: {e}"})
+                else:
+                    logger.info(f"Admin {user['username']} reloaded the auto-approval rules.")
+                    await manager.set_auto_approval_rules(rules)
+
+    except WebSocketDisconnect:
+        logger.info(f"Admin {user['username']} WebSocket disconnected.")
+    except Exception as e:
+        logger.error(f"Error in admin WebSocket: {e}", exc_info=True)
+    finally:
+        await manager.disconnect_admin(agent)
 
 @app.websocket("/ws")
 async def client_websocket_endpoint(websocket: WebSocket):
-    client_id_pending = await manager.request_connection(websocket)
-    is_approved = False
-    current_client_id = client_id_pending
+    # Shed load before building a session for the socket
+    client_ip = websocket.client.host if websocket.client else "Unknown"
+    refused = admission.admit(client_ip, len(manager.sessions_by_socket))
+    if refused:
+        await accept_websocket(websocket)
+        await websocket.close(code=1013, reason=refused)
+        return
+
+    session = await manager.request_connection(websocket)
+    if session is None:
+        return
+    message_bucket = admission.connection_bucket()
 
     try:
         while True:
-            message_text = await websocket.receive_text()
+            message_text = await receive_frame(websocket)
+            received_at = session.last_seen = time.monotonic()
+            refused = admission.allow_message(client_ip, message_bucket, received_at)
+            if refused:
+                logger.warning(f"Client {session.client_id} (IP: {client_ip}) closed: {refused}.")
+                await session.outbound.aclose(code=1013, reason=refused)
+                break
+            if isinstance(message_text, bytes):
+                message_text = decode_frame(message_text)
+            if is_pong(message_text):
+                continue
 
-            if not manager.is_client_active(websocket):
-                if manager.is_client_pending(websocket) and manager.admin_websocket:
-                    await websocket.send_text(json.dumps({
-                        "type": "status_update",
-                        "message": "Connection request pending admin approval. Please wait."
-                    }))
-                    logger.info(f"Client {current_client_id} sent message while pending.")
+            if session.state != ClientSession.ACTIVE:
+                if session.state == ClientSession.PENDING:
+                    if session.agent_id is None:
+                        await manager.send_queue_position(session)
+                    else:
+                        await manager.send_to_client(session, {
+                            "type": "status_update",
+                            "message": "Connection request pending admin approval. Please wait."
+                        })
+                    logger.info(f"Client {session.client_id} sent message while pending.")
                 else:
-                    logger.info(f"Client {current_client_id} sent message but is not active or pending. Connection might be stale.")
-                    await websocket.send_text(json.dumps({"type": "error", "message": "Connection not active."}))
+                    logger.info(f"Client {session.client_id} sent message but is not active or pending. Connection might be stale.")
+                    await manager.send_to_client(session, {"type": "error", "message": "Connection not active."})
                     break
                 continue
 
-            active_id = manager.is_client_active(websocket)
-            if active_id:
-                current_client_id = active_id
-                is_approved = True
-            else:
-                logger.error(f"Client {current_client_id} passed active check but no ID found. Forcing disconnect.")
-                await websocket.send_text(json.dumps({"type": "error", "message": "Internal server error. Please reconnect."}))
-                break
-                
-            if not manager.admin_websocket:
-                logger.info(f"Client {current_client_id} sent message but admin is not connected.")
-                await websocket.send_text(json.dumps({"type": "error", "message": "Connection not active."}))
+            message_text = chat_text(message_text)
+            if message_text is None:
+                logger.info(f"Client {session.client_id} sent a frame that is not a text message.")
+                await manager.send_to_client(session, {"type": "error", "message": "Messages must be text."})
+            elif session.agent_id is None:
+                logger.info(f"Client {session.client_id} sent message but admin is not connected.")
+                await manager.send_to_client(session, {"type": "error", "message": "Connection not active."})
             else:
-                logger.info(f"Client {current_client_id} sent: {message_text}")
-                actual_message = message_text
-                await manager.forward_user_message_to_admin(current_client_id, actual_message)
+                logger.info(f"Client {session.client_id} sent a message",
+                            extra={"category": "client_message", "client_id": session.client_id, "body": message_text})
+                await manager.forward_user_message_to_admin(session.client_id, message_text)
+                client_to_admin_seconds.observe(time.monotonic() - received_at)
 
     except WebSocketDisconnect:
-        logger.info(f"Client {current_client_id} (IP: {websocket.client.host if websocket.client else 'N/A'}) disconnected.")
+        logger.info(f"Client {session.client_id} (IP: {client_ip}) disconnected.")
     except Exception as e:
-        logger.error(f"Error in client WebSocket {current_client_id} (IP: {websocket.client.host if websocket.client else 'N/A'}): {e}", exc_info=True)
+        logger.error(f"Error in client WebSocket {session.client_id} (IP: {client_ip}): {e}", exc_info=True)
     finally:
-        await manager.disconnect_client(websocket, current_client_id)
+        await manager.remove_session(session)
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=9000)
\ No newline at end of file
+    uvicorn.run(app, host="0.0.0.0", port=9000, ws_per_message_deflate=WS_PER_MESSAGE_DEFLATE,
+                ws_ping_interval=WS_PING_INTERVAL_SECONDS, ws_ping_timeout=WS_PING_TIMEOUT_SECONDS)
\ No newline at end of file
@@ -0,0 +1,184 @@
+import asyncio
+import logging
+from collections import deque
+from datetime import datetime
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+MESSAGES_TABLE = "chatserver_messages"
+MESSAGE_COLUMNS = ("conversation_id", "client_id", "sender", "agent_username", "message", "created_at")
+
+# Message senders
+SENDER_USER = "user"
+SENDER_AGENT = "agent"
+
+MessageRecord = Tuple[str, str, str, Optional[str], str, datetime]
+
+
+class MessageWriter:
+    """Write-behind persistence for chat messages.
+
+    ``record`` only appends to an in-memory buffer, so the forwarding path
+    never waits on the database. A background task writes the buffer to
+    storage (COPY on Postgres) whenever ``batch_size`` messages are
+    waiting or ``flush_interval`` seconds have passed, and once more on
+    ``stop``. If the database is unavailable the batch is kept for the next
+    attempt; past ``max_buffer`` the oldest messages are dropped and counted.
+    If the database rejects the batch instead, it is written row by row and
+    the rows still rejected are logged and dropped, so one bad record never
+    holds up the rest.
+    """
+
+    def __init__(self, batch_size: int = 500, flush_interval: float = 1.0, max_buffer: int = 100000):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_buffer = max_buffer
+        self._buffer: Deque[MessageRecord] = deque()
+        self._storage = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._flush_lock: Optional[asyncio.Lock] = None
+        self.written = 0
+        self.dropped = 0
+        self.dead_lettered = 0
+        self.batches = 0
+        self.failed_batches = 0
+
+    def record(self, conversation_id: str, client_id: str, sender: str, message: str,
+               agent_username: Optional[str] = None) -> Optional[datetime]:
+        """Buffer a message; returns the created_at it will be stored with, or None if it was refused"""
+        if not isinstance(message, str):
+            self.dropped += 1
+            logger.error(f"Not persisting a {type(message).__name__} chat message for conversation {conversation_id}: "
+                         f"messages must be text")
+            return None
+        if len(self._buffer) >= self.max_buffer:
+            self._buffer.popleft()
+            self.dropped += 1
+        created_at = datetime.now()
+        self._buffer.append((conversation_id, client_id, sender, agent_username, message, created_at))
+        if len(self._buffer) >= self.batch_size and self._wakeup is not None:
+            self._wakeup.set()
+        return created_at
+
+    async def start(self, storage):
+        self._storage = storage
+        self._wakeup = asyncio.Event()
+        self._flush_lock = asyncio.Lock()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        while self._buffer and await self.flush():
+            pass
+        if self._buffer:
+            logger.error(f"Shutting down with {len(self._buffer)} chat messages not persisted")
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            while self._buffer:
+                if not await self.flush():
+                    break
+                if len(self._buffer) < self.batch_size:
+                    break
+
+    async def flush(self) -> bool:
+        """Write up to one batch. Returns False if the database was unavailable and the batch was kept."""
+        if not self._buffer or self._storage is None:
+            return True
+        async with self._flush_lock:
+            batch = [self._buffer.popleft() for _ in range(min(self.batch_size, len(self._buffer)))]
+            try:
+                await self._storage.insert_messages(batch)
+            except Exception as e:
+                if self._storage.is_transient_error(e):
+                    self._requeue(batch, e)
+                    return False
+                logger.warning(f"Database rejected a batch of {len(batch)} chat messages ({e}). Writing them one by one.")
+                return await self._insert_one_by_one(batch)
+            self.written += len(batch)
+            self.batches += 1
+            return True
+
+    async def _insert_one_by_one(self, batch: List[MessageRecord]) -> bool:
+        for index, record in enumerate(batch):
+            try:
+                await self._storage.insert_messages([record])
+            except Exception as e:
+                if self._storage.is_transient_error(e):
+                    self._requeue(batch[index:], e)
+                    return False
+                # Dead letter: the log line is all that is left of it
+                self.dead_lettered += 1
+                self.dropped += 1
+                logger.error(f"Dropping a chat message the database rejected ({e}): {record!r}")
+            else:
+                self.written += 1
+        self.batches += 1
+        return True
+
+    def _requeue(self, batch: List[MessageRecord], error: Exception):
+        """Put a batch back in front for the next attempt, keeping within the buffer bound"""
+        self.failed_batches += 1
+        logger.error(f"Failed to persist {len(batch)} chat messages: {error}")
+        room = self.max_buffer - len(self._buffer)
+        if room < len(batch):
+            self.dropped += len(batch) - room
+            batch = batch[len(batch) - room:] if room > 0 else []
+        self._buffer.extendleft(reversed(batch))
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "buffered": len(self._buffer),
+            "written": self.written,
+            "batches": self.batches,
+            "failed_batches": self.failed_batches,
+            "dropped": self.dropped,
+            "dead_lettered": self.dead_lettered,
+        }
+
+
+def encode_cursor(created_at: datetime, message_id: int) -> str:
+    return f"{created_at.isoformat()}_{message_id}"
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, int]:
+    """Raises ValueError for a malformed cursor"""
+    created_at, _, message_id = cursor.rpartition("_")
+    return datetime.fromisoformat(created_at), int(message_id)
+
+
+async def fetch_messages_page(storage, conversation_id: str, before: Optional[str], limit: int) -> Dict[str, Any]:
+    """One page of a conversation, newest first, using keyset pagination on (created_at, id).
+
+    ``before`` is the ``next_before`` cursor of the previous page; the result's
+    ``next_before`` is None once the oldest message has been returned.
+    """
+    rows = await storage.fetch_messages(conversation_id, decode_cursor(before) if before else None, limit + 1)
+    page = rows[:limit]
+    return {
+        "messages": [
+            {
+                "id": row["id"],
+                "client_id": row["client_id"],
+                "sender": row["sender"],
+                "agent_username": row["agent_username"],
+                "message": row["message"],
+                "created_at": row["created_at"].isoformat(),
+            }
+            for row in page
+        ],
+        "next_before": encode_cursor(page[-1]["created_at"], page[-1]["id"]) if len(rows) > limit else None,
+    }
@@ -0,0 +1,211 @@
+import time
+from bisect import bisect_left
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+# Prometheus text exposition format
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Seconds; spans sub-millisecond forwarding up to slow database waits
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Seconds a visitor waits for a human to accept or reject them
+WAIT_BUCKETS = (1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0, 600.0, 1800.0)
+
+LabelValues = Tuple[str, ...]
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Value:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount: float = 1):
+        self.value += amount
+
+    def dec(self, amount: float = 1):
+        self.value -= amount
+
+    def set(self, value: float):
+        self.value = value
+
+
+class _HistogramValue:
+    __slots__ = ("upper_bounds", "counts", "sum")
+
+    def __init__(self, upper_bounds: Tuple[float, ...]):
+        self.upper_bounds = upper_bounds
+        self.counts = [0] * (len(upper_bounds) + 1)  # Last slot is +Inf
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.upper_bounds, value)] += 1
+        self.sum += value
+
+
+class Metric:
+    """A named metric with optional labels.
+
+    Updates are plain attribute arithmetic with no locking: every update
+    happens on the event loop thread, and a scrape (also on the loop) never
+    interleaves with one. Children for label values are created on first use;
+    hot paths should keep the child returned by ``labels`` rather than look
+    it up per update.
+
+    ``fn``, if given, is called at scrape time instead of keeping a value:
+    it returns a number, or for a labelled metric a dict of label-value
+    tuples to numbers.
+    """
+    kind = "untyped"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (), registry: Optional["Registry"] = None,
+                 fn: Optional[Callable[[], Any]] = None):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.fn = fn
+        self._children: Dict[LabelValues, Any] = {}
+        if not self.labelnames and fn is None:
+            self._default = self.labels()
+        if registry is not None:
+            registry.register(self)
+
+    def _new_child(self):
+        return _Value()
+
+    def labels(self, *values: str):
+        if len(values) != len(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {values}")
+        child = self._children.get(values)
+        if child is None:
+            child = self._children[values] = self._new_child()
+        return child
+
+    def _values(self) -> Iterable[Tuple[LabelValues, float]]:
+        if self.fn is None:
+            return ((labels, child.value) for labels, child in self._children.items())
+        result = self.fn()
+        return result.items() if isinstance(result, dict) else [((), result)]
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for labels, value in self._values():
+            lines.append(f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}")
+        return lines
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1):
+        self._default.value += amount
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def inc(self, amount: float = 1):
+        self._default.value += amount
+
+    def dec(self, amount: float = 1):
+        self._default.value -= amount
+
+    def set(self, value: float):
+        self._default.value = value
+
+
+class Histogram(Metric):
+    """Bucket counts are kept per bucket and made cumulative at scrape time, so ``observe`` is one increment"""
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (), registry: Optional["Registry"] = None,
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.upper_bounds = tuple(sorted(buckets))
+        super().__init__(name, help, labelnames, registry)
+
+    def _new_child(self):
+        return _HistogramValue(self.upper_bounds)
+
+    def observe(self, value: float):
+        self._default.observe(value)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for labels, child in self._children.items():
+            cumulative = 0
+            for bound, count in zip(self.upper_bounds + (float("inf"),), child.counts):
+                cumulative += count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, labels, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, labels)} {_format_value(child.sum)}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, labels)} {cumulative}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: Dict[str, Metric] = {}
+
+    def register(self, metric: Metric):
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric {metric.name} is already registered")
+        self._metrics[metric.name] = metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+class _TimedAcquire:
+    __slots__ = ("_pool", "_context")
+
+    def __init__(self, pool: "TimedPool"):
+        self._pool = pool
+        self._context = None
+
+    async def __aenter__(self):
+        pool = self._pool
+        start = time.monotonic()
+        pool.waiting += 1
+        try:
+            self._context = pool.pool.acquire()
+            return await self._context.__aenter__()
+        finally:
+            pool.waiting -= 1
+            pool.acquire_seconds.observe(time.monotonic() - start)
+
+    async def __aexit__(self, *exc_info):
+        return await self._context.__aexit__(*exc_info)
+
+
+class TimedPool:
+    """Wraps an asyncpg pool so ``async with pool.acquire()`` records how long getting a connection took"""
+
+    def __init__(self, pool, acquire_seconds: Histogram):
+        self.pool = pool
+        self.acquire_seconds = acquire_seconds
+        self.waiting = 0
+
+    def acquire(self) -> _TimedAcquire:
+        return _TimedAcquire(self)
+
+    def __getattr__(self, name):
+        return getattr(self.pool, name)
@@ -0,0 +1,197 @@
+"""Versioned schema migrations.
+
+Run out-of-band before deploying (``python migrations.py upgrade``); app
+startup only checks the recorded version. Each step runs once, in order, and
+records itself in chatserver_schema_version. Transactional steps run inside a
+transaction together with their version row; index builds use CREATE INDEX
+CONCURRENTLY, which must run outside one.
+"""
+import asyncio
+import hashlib
+import logging
+import os
+import sys
+from typing import Awaitable, Callable, List, NamedTuple
+
+import asyncpg
+
+logger = logging.getLogger(__name__)
+
+SCHEMA_TABLE = "chatserver_schema_version"
+# Serializes concurrent migrators (e.g. several workers with AUTO_MIGRATE). Waiters poll for it
+# rather than block in pg_advisory_lock: a blocked statement holds a snapshot, which CREATE INDEX
+# CONCURRENTLY in the lock holder would wait on forever.
+MIGRATION_LOCK_ID = 726153001
+MIGRATION_LOCK_POLL_SECONDS = 0.5
+
+# Seeded admin account, stored with a legacy SHA-256 hash that is rehashed on first login.
+# Change this in production!
+DEFAULT_ADMIN_USERNAME = "admin"
+DEFAULT_ADMIN_EMAIL = "admin@example.com"
+DEFAULT_ADMIN_PASSWORD_HASH = hashlib.sha256("admin123".encode()).hexdigest()
+
+
+class Migration(NamedTuple):
+    version: int
+    description: str
+    apply: Callable[[asyncpg.Connection], Awaitable[None]]
+    transactional: bool = True
+
+
+async def _create_users_and_sessions(conn):
+    await conn.execute('''
+        CREATE TABLE IF NOT EXISTS chatserver_users (
+            id SERIAL PRIMARY KEY,
+            username VARCHAR(50) UNIQUE NOT NULL,
+            email VARCHAR(100) UNIQUE NOT NULL,
+            password_hash VARCHAR(255) NOT NULL,
+            is_admin BOOLEAN DEFAULT FALSE,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            last_login TIMESTAMP
+        )
+    ''')
+    await conn.execute('''
+        CREATE TABLE IF NOT EXISTS chatserver_user_sessions (
+            id SERIAL PRIMARY KEY,
+            user_id INTEGER REFERENCES chatserver_users(id) ON DELETE CASCADE,
+            token_hash VARCHAR(255) NOT NULL,
+            expires_at TIMESTAMP NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+
+async def _seed_admin(conn):
+    inserted = await conn.fetchval('''
+        INSERT INTO chatserver_users (username, email, password_hash, is_admin)
+        VALUES ($1, $2, $3, $4) ON CONFLICT DO NOTHING RETURNING id
+    ''', DEFAULT_ADMIN_USERNAME, DEFAULT_ADMIN_EMAIL, DEFAULT_ADMIN_PASSWORD_HASH, True)
+    if inserted:
+        logger.info("Default admin user created (username: admin, password: admin123)")
+
+
+async def _create_messages(conn):
+    # sender is 'user' or 'agent'
+    await conn.execute('''
+        CREATE TABLE IF NOT EXISTS chatserver_messages (
+            id BIGSERIAL PRIMARY KEY,
+            conversation_id VARCHAR(255) NOT NULL,
+            client_id VARCHAR(64) NOT NULL,
+            sender VARCHAR(10) NOT NULL,
+            agent_username VARCHAR(50),
+            message TEXT NOT NULL,
+            created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+
+async def _create_index_concurrently(conn, name: str, definition: str):
+    # A failed concurrent build leaves an INVALID index behind that IF NOT EXISTS would keep
+    invalid = await conn.fetchval('''
+        SELECT NOT i.indisvalid FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid WHERE c.relname = $1
+    ''', name)
+    if invalid:
+        await conn.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {name}")
+    await conn.execute(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} ON {definition}")
+
+
+async def _index_messages(conn):
+    # Serves keyset pagination of a conversation's history
+    await _create_index_concurrently(conn, "idx_chatserver_messages_conversation",
+                                     "chatserver_messages (conversation_id, created_at, id)")
+
+
+async def _index_sessions(conn):
+    # Token validation looks sessions up by hash; the reaper scans by expiry
+    await _create_index_concurrently(conn, "idx_chatserver_user_sessions_token_hash",
+                                     "chatserver_user_sessions (token_hash)")
+    await _create_index_concurrently(conn, "idx_chatserver_user_sessions_expires_at",
+                                     "chatserver_user_sessions (expires_at)")
+
+
+MIGRATIONS: List[Migration] = [
+    Migration(1, "users and sessions tables", _create_users_and_sessions),
+    Migration(2, "default admin user", _seed_admin),
+    Migration(3, "messages table", _create_messages),
+    Migration(4, "messages conversation index", _index_messages, transactional=False),
+    Migration(5, "sessions token and expiry indexes", _index_sessions, transactional=False),
+]
+
+LATEST_VERSION = MIGRATIONS[-1].version
+
+
+async def current_version(conn) -> int:
+    """The applied schema version, 0 for a database that was never migrated"""
+    try:
+        return await conn.fetchval(f"SELECT COALESCE(MAX(version), 0) FROM {SCHEMA_TABLE}")
+    except asyncpg.exceptions.UndefinedTableError:
+        return 0
+
+
+async def migrate(conn) -> int:
+    """Apply every pending migration in order. Returns the resulting version."""
+    await _acquire_migration_lock(conn)
+    try:
+        await conn.execute(f'''
+            CREATE TABLE IF NOT EXISTS {SCHEMA_TABLE} (
+                version INTEGER PRIMARY KEY,
+                description TEXT NOT NULL,
+                applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        version = await current_version(conn)
+        for migration in MIGRATIONS:
+            if migration.version <= version:
+                continue
+            logger.info(f"Applying migration {migration.version}: {migration.description}")
+            if migration.transactional:
+                async with conn.transaction():
+                    await migration.apply(conn)
+                    await _record(conn, migration)
+            else:
+                await migration.apply(conn)
+                await _record(conn, migration)
+            version = migration.version
+        return version
+    finally:
+        await conn.execute("SELECT pg_advisory_unlock($1)", MIGRATION_LOCK_ID)
+
+
+async def _acquire_migration_lock(conn):
+    waiting = False
+    while not await conn.fetchval("SELECT pg_try_advisory_lock($1)", MIGRATION_LOCK_ID):
+        if not waiting:
+            logger.info("Waiting for another migrator to finish")
+            waiting = True
+        await asyncio.sleep(MIGRATION_LOCK_POLL_SECONDS)
+
+
+async def _record(conn, migration: Migration):
+    await conn.execute(f"INSERT INTO {SCHEMA_TABLE} (version, description) VALUES ($1, $2)",
+                       migration.version, migration.description)
+
+
+async def _main(command: str):
+    from dotenv import load_dotenv
+    load_dotenv()
+    conn = await asyncpg.connect(os.getenv("DATABASE_URL"))
+    try:
+        if command == "upgrade":
+            before = await current_version(conn)
+            after = await migrate(conn)
+            print(f"Schema upgraded from version {before} to {after}" if after != before else f"Schema already at version {after}")
+        else:
+            version = await current_version(conn)
+            print(f"Schema at version {version} (latest {LATEST_VERSION})")
+            for migration in MIGRATIONS:
+                print(f"  [{'x' if migration.version <= version else ' '}] {migration.version}: {migration.description}")
+    finally:
+        await conn.close()
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2 or sys.argv[1] not in ("upgrade", "status"):
+        print("usage: python migrations.py upgrade|status")
+        sys.exit(1)
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    asyncio.run(_main(sys.argv[1]))
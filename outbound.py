@@ -0,0 +1,235 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, Optional, Tuple, Union
+
+from serializer import JSON_CODEC, Codec, EncodedFrame, frame_payload
+
+logger = logging.getLogger(__name__)
+
+# Overflow policies
+DROP_OLDEST = "drop_oldest"
+COALESCE = "coalesce"
+DISCONNECT = "disconnect"
+OVERFLOW_POLICIES = (DROP_OLDEST, COALESCE, DISCONNECT)
+
+# Close code used when a consumer is disconnected for falling too far behind
+SLOW_CONSUMER_CLOSE_CODE = 1008
+
+Frame = Union[Dict[str, Any], EncodedFrame, Callable[[], Union[Dict[str, Any], EncodedFrame]]]
+
+_CLOSE = object()
+
+
+class OutboundTotals:
+    """Process-wide counters across every outbound queue"""
+    def __init__(self):
+        self.queues = 0
+        self.depth = 0
+        self.sent = 0
+        self.dropped = 0
+        self.coalesced = 0
+        self.slow_consumer_disconnects = 0
+        self.send_failures = 0
+
+    def as_dict(self) -> Dict[str, int]:
+        return dict(vars(self))
+
+
+totals = OutboundTotals()
+
+
+class OutboundQueue:
+    """Bounded send queue for one websocket, drained by its own writer task.
+
+    ``send`` never blocks: a slow socket only ever backs up its own queue.
+    When the queue is full the overflow policy decides what gives:
+
+    - ``drop_oldest`` discards the oldest queued frame.
+    - ``coalesce`` collapses every queued frame that has a coalesce key.
+      Keys with a factory in ``coalesce_factories`` are replaced by a single
+      frame built from the factory at write time (e.g. a fresh list
+      snapshot); other keyed frames are simply dropped. Falls back to
+      ``drop_oldest`` when nothing can be coalesced.
+    - ``disconnect`` closes the socket as a slow consumer.
+
+    If a write fails the queue closes and runs ``on_failure``, so the owner
+    can unregister the connection as it would on a disconnect.
+    """
+
+    def __init__(self, websocket, name: str, max_size: int, overflow_policy: str,
+                 coalesce_factories: Optional[Dict[str, Callable[[], Dict[str, Any]]]] = None,
+                 codec: Codec = JSON_CODEC, wait_seconds=None):
+        if overflow_policy not in OVERFLOW_POLICIES:
+            raise ValueError(f"Unknown overflow policy '{overflow_policy}'. Choose one of: {', '.join(OVERFLOW_POLICIES)}")
+        self.websocket = websocket
+        self.name = name
+        self.max_size = max_size
+        self.overflow_policy = overflow_policy
+        self.coalesce_factories = coalesce_factories or {}
+        self.codec = codec
+        # Anything with observe(seconds): gets the time from queueing each frame to its write completing
+        self.wait_seconds = wait_seconds
+        self._items: Deque[Tuple[Optional[str], Any, float]] = deque()
+        self._ready = asyncio.Event()
+        self.closed = False
+        self._released = False
+        self.sent = 0
+        self.dropped = 0
+        self.coalesced = 0
+        self.high_watermark = 0
+        self.on_failure: Optional[Callable[[], Awaitable[None]]] = None
+        self._failure_task: Optional[asyncio.Task] = None
+        totals.queues += 1
+        self._writer = asyncio.create_task(self._run())
+
+    @property
+    def depth(self) -> int:
+        return len(self._items)
+
+    def send(self, frame: Frame, coalesce_key: Optional[str] = None) -> bool:
+        """Queue a frame, an EncodedFrame, or a callable producing either at write time.
+
+        Returns False if it was not queued.
+        """
+        if self.closed:
+            return False
+        if len(self._items) >= self.max_size and not self._make_room():
+            return False
+        self._push(coalesce_key, frame)
+        return True
+
+    def _push(self, coalesce_key: Optional[str], frame: Any, queued_at: Optional[float] = None):
+        self._items.append((coalesce_key, frame, queued_at or time.monotonic()))
+        totals.depth += 1
+        if len(self._items) > self.high_watermark:
+            self.high_watermark = len(self._items)
+        self._ready.set()
+
+    def _pop(self) -> Tuple[Optional[str], Any, float]:
+        totals.depth -= 1
+        return self._items.popleft()
+
+    def _make_room(self) -> bool:
+        if self.overflow_policy == DISCONNECT:
+            logger.warning(f"Outbound queue for {self.name} full ({self.max_size}). Disconnecting slow consumer.")
+            totals.slow_consumer_disconnects += 1
+            self._abort(SLOW_CONSUMER_CLOSE_CODE, "Slow consumer")
+            return False
+        if self.overflow_policy == COALESCE and self._coalesce():
+            return True
+        self._pop()
+        self.dropped += 1
+        totals.dropped += 1
+        return True
+
+    def _coalesce(self) -> bool:
+        kept: Deque[Tuple[Optional[str], Any, float]] = deque()
+        collapsed = {}
+        removed = 0
+        for key, frame, queued_at in self._items:
+            if key is None or frame is _CLOSE:
+                kept.append((key, frame, queued_at))
+            else:
+                collapsed.setdefault(key, queued_at)
+                removed += 1
+        if not removed:
+            return False
+        totals.depth -= len(self._items) - len(kept)
+        self._items = kept
+        for key, queued_at in collapsed.items():
+            if key in self.coalesce_factories:
+                self._push(key, self.coalesce_factories[key], queued_at)
+                removed -= 1
+        self.coalesced += removed
+        totals.coalesced += removed
+        # Coalescing only helps if it actually freed a slot
+        return len(self._items) < self.max_size
+
+    def _release(self):
+        if not self._released:
+            self._released = True
+            totals.queues -= 1
+            totals.depth -= len(self._items)
+            self._items.clear()
+
+    def _abort(self, code: int, reason: str):
+        self.closed = True
+        self._release()
+        self._writer.cancel()
+        asyncio.create_task(self._close_socket(code, reason))
+
+    async def _close_socket(self, code: Optional[int], reason: Optional[str]):
+        try:
+            await self.websocket.close(code=code or 1000, reason=reason)
+        except Exception:
+            pass
+
+    async def _run(self):
+        try:
+            while True:
+                await self._ready.wait()
+                while self._items:
+                    _, frame, queued_at = self._pop()
+                    if frame is _CLOSE:
+                        return
+                    if callable(frame):
+                        frame = frame()
+                    payload = frame_payload(frame, self.codec)
+                    if self.codec.binary:
+                        await self.websocket.send_bytes(payload)
+                    else:
+                        await self.websocket.send_text(payload)
+                    self.sent += 1
+                    totals.sent += 1
+                    if self.wait_seconds is not None:
+                        self.wait_seconds.observe(time.monotonic() - queued_at)
+                self._ready.clear()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.warning(f"Failed to send to {self.name}: {e}. Socket might have disconnected.")
+            totals.send_failures += 1
+            self.closed = True
+            self._release()
+            # In a task of its own: the owner's cleanup closes this queue, which cancels the writer
+            self._failure_task = asyncio.create_task(self._handle_failure())
+
+    async def _handle_failure(self):
+        if self.on_failure is not None:
+            try:
+                await self.on_failure()
+            except Exception as e:
+                logger.error(f"Cleaning up {self.name} after a failed send failed: {e}", exc_info=True)
+        await self._close_socket(1011, "Send failed")
+
+    async def aclose(self, code: Optional[int] = None, reason: Optional[str] = None, drain_timeout: float = 1.0):
+        """Flush what is queued (bounded by ``drain_timeout``), stop the writer and optionally close the socket"""
+        if not self.closed:
+            self.closed = True
+            self._push(None, _CLOSE)
+            try:
+                await asyncio.wait_for(asyncio.shield(self._writer), drain_timeout)
+            except (asyncio.TimeoutError, Exception):
+                self._writer.cancel()
+            self._release()
+            if code is not None:
+                await self._close_socket(code, reason)
+        else:
+            self._release()
+            if not self._writer.done():
+                self._writer.cancel()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "depth": self.depth,
+            "high_watermark": self.high_watermark,
+            "max_size": self.max_size,
+            "overflow_policy": self.overflow_policy,
+            "codec": self.codec.name,
+            "sent": self.sent,
+            "dropped": self.dropped,
+            "coalesced": self.coalesced,
+            "closed": self.closed,
+        }
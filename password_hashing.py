@@ -0,0 +1,141 @@
+import asyncio
+import base64
+import hashlib
+import hmac
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Optional, Tuple
+
+SCHEME = "scrypt"
+SALT_BYTES = 16
+KEY_BYTES = 32
+
+
+def _b64encode(data: bytes) -> str:
+    return base64.b64encode(data).decode().rstrip("=")
+
+
+def _b64decode(data: str) -> bytes:
+    return base64.b64decode(data + "=" * (-len(data) % 4))
+
+
+def _is_legacy(stored: str) -> bool:
+    """Hashes written before scrypt: bare unsalted SHA-256 hex digests"""
+    return not stored.startswith(SCHEME + "$")
+
+
+class PasswordHasher:
+    """scrypt password hashing kept off the event loop.
+
+    Hashes are stored as ``scrypt$n$r$p$salt$key`` so the cost parameters can
+    be raised later; ``needs_rehash`` reports hashes made with older
+    parameters or the legacy unsalted SHA-256. The KDF runs in a thread pool
+    of ``max_workers`` (hashlib.scrypt releases the GIL) and at most
+    ``max_concurrent`` hashes may be queued or running at once; further
+    callers wait on a semaphore instead of piling work onto the pool.
+    """
+
+    def __init__(self, n: int = 2 ** 14, r: int = 8, p: int = 1,
+                 max_workers: Optional[int] = None, max_concurrent: Optional[int] = None):
+        self.n = n
+        self.r = r
+        self.p = p
+        self.max_workers = max_workers or min(4, os.cpu_count() or 1)
+        self.max_concurrent = max_concurrent or self.max_workers * 2
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="password-hash")
+        self._semaphore = asyncio.Semaphore(self.max_concurrent)
+        self.in_flight = 0
+        self.waiting = 0
+        self.hashed = 0
+        self.verified = 0
+        self.rehashed = 0
+        self._dummy_hash: Optional[str] = None
+
+    def _derive(self, password: str, salt: bytes, n: int, r: int, p: int) -> bytes:
+        return hashlib.scrypt(password.encode(), salt=salt, n=n, r=r, p=p,
+                              maxmem=256 * n * r * p, dklen=KEY_BYTES)
+
+    async def _run(self, func, *args):
+        self.waiting += 1
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self.waiting -= 1
+        self.in_flight += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+        finally:
+            self.in_flight -= 1
+            self._semaphore.release()
+
+    def hash_sync(self, password: str) -> str:
+        salt = os.urandom(SALT_BYTES)
+        key = self._derive(password, salt, self.n, self.r, self.p)
+        return f"{SCHEME}${self.n}${self.r}${self.p}${_b64encode(salt)}${_b64encode(key)}"
+
+    def verify_sync(self, password: str, stored: str) -> bool:
+        if _is_legacy(stored):
+            return hmac.compare_digest(hashlib.sha256(password.encode()).hexdigest(), stored)
+        try:
+            _, n, r, p, salt, key = stored.split("$")
+            derived = self._derive(password, _b64decode(salt), int(n), int(r), int(p))
+        except ValueError:
+            return False
+        return hmac.compare_digest(derived, _b64decode(key))
+
+    async def hash(self, password: str) -> str:
+        result = await self._run(self.hash_sync, password)
+        self.hashed += 1
+        return result
+
+    async def verify(self, password: str, stored: str) -> bool:
+        if _is_legacy(stored):
+            # A single SHA-256 is cheap enough to run on the loop
+            result = self.verify_sync(password, stored)
+        else:
+            result = await self._run(self.verify_sync, password, stored)
+        self.verified += 1
+        return result
+
+    async def verify_and_update(self, password: str, stored: str) -> Tuple[bool, Optional[str]]:
+        """Verify a password; on success also return a fresh hash if ``stored`` is outdated"""
+        if not await self.verify(password, stored):
+            return False, None
+        if not self.needs_rehash(stored):
+            return True, None
+        new_hash = await self.hash(password)
+        self.rehashed += 1
+        return True, new_hash
+
+    async def dummy_hash(self) -> str:
+        """A hash with the current parameters that no password matches, to verify against for unknown users.
+
+        Checking a login for a missing user against it costs as much as a wrong
+        password, so response times don't tell which usernames exist.
+        """
+        if self._dummy_hash is None:
+            self._dummy_hash = await self._run(self.hash_sync, _b64encode(os.urandom(KEY_BYTES)))
+        return self._dummy_hash
+
+    def needs_rehash(self, stored: str) -> bool:
+        if _is_legacy(stored):
+            return True
+        try:
+            _, n, r, p, _, _ = stored.split("$")
+        except ValueError:
+            return True
+        return (int(n), int(r), int(p)) != (self.n, self.r, self.p)
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "max_workers": self.max_workers,
+            "max_concurrent": self.max_concurrent,
+            "in_flight": self.in_flight,
+            "waiting": self.waiting,
+            "hashed": self.hashed,
+            "verified": self.verified,
+            "rehashed": self.rehashed,
+        }
@@ -0,0 +1,109 @@
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+# A token bucket is a two-item list: [tokens, monotonic time of the last update]
+Bucket = List[float]
+
+
+def take(bucket: Bucket, rate: float, burst: float, now: float, cost: float = 1.0) -> bool:
+    """Refill ``bucket`` for the time since its last update and take ``cost`` tokens if there are enough"""
+    bucket[0] = min(burst, bucket[0] + (now - bucket[1]) * rate)
+    bucket[1] = now
+    if bucket[0] >= cost:
+        bucket[0] -= cost
+        return True
+    return False
+
+
+class RateLimiter:
+    """A token bucket per key (e.g. client IP): ``rate`` tokens per second, up to ``burst``.
+
+    Buckets are kept in least recently used order. A bucket left alone for
+    ``burst / rate`` seconds has refilled completely and is no different from
+    a new one, so it is dropped on a later call; past ``max_keys`` the least
+    recently used bucket goes too. Memory follows the keys seen recently,
+    with no background sweep.
+    """
+
+    def __init__(self, rate: float, burst: float, max_keys: int = 100000):
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys
+        self.refill_seconds = burst / rate
+        self._buckets: "OrderedDict[str, Bucket]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+    def allow(self, key: str, now: Optional[float] = None) -> bool:
+        now = time.monotonic() if now is None else now
+        buckets = self._buckets
+        bucket = buckets.get(key)
+        if bucket is None:
+            bucket = buckets[key] = [self.burst, now]
+        else:
+            buckets.move_to_end(key)
+        allowed = take(bucket, self.rate, self.burst, now)
+        self._expire(now)
+        return allowed
+
+    def _expire(self, now: float):
+        buckets = self._buckets
+        while buckets:
+            oldest = next(iter(buckets.values()))
+            if len(buckets) <= self.max_keys and now - oldest[1] < self.refill_seconds:
+                break
+            buckets.popitem(last=False)
+
+
+class AdmissionControl:
+    """Load shedding for visitor sockets.
+
+    ``admit`` runs before anything is set up for a new socket; ``allow_message``
+    runs on each frame before it is decoded. Both return None to let it
+    through, or the reason to close with. A rate of 0 disables that limit.
+    """
+
+    def __init__(self, max_connections: int = 0, connect_rate: float = 0, connect_burst: float = 0,
+                 ip_message_rate: float = 0, ip_message_burst: float = 0,
+                 connection_message_rate: float = 0, connection_message_burst: float = 0,
+                 max_keys: int = 100000):
+        self.max_connections = max_connections
+        self.connects = RateLimiter(connect_rate, connect_burst, max_keys) if connect_rate > 0 else None
+        self.ip_messages = RateLimiter(ip_message_rate, ip_message_burst, max_keys) if ip_message_rate > 0 else None
+        self.connection_message_rate = connection_message_rate
+        self.connection_message_burst = connection_message_burst
+        self.shed: Dict[str, int] = {}
+
+    def _refuse(self, reason: str) -> str:
+        self.shed[reason] = self.shed.get(reason, 0) + 1
+        return reason
+
+    def admit(self, ip: str, open_connections: int) -> Optional[str]:
+        if self.max_connections and open_connections >= self.max_connections:
+            return self._refuse("max_connections")
+        if self.connects is not None and not self.connects.allow(ip):
+            return self._refuse("connect_rate")
+        return None
+
+    def connection_bucket(self) -> Optional[Bucket]:
+        """Message bucket for one new connection, or None when per-connection limits are off"""
+        if self.connection_message_rate <= 0:
+            return None
+        return [self.connection_message_burst, time.monotonic()]
+
+    def allow_message(self, ip: str, bucket: Optional[Bucket], now: Optional[float] = None) -> Optional[str]:
+        now = time.monotonic() if now is None else now
+        if bucket is not None and not take(bucket, self.connection_message_rate, self.connection_message_burst, now):
+            return self._refuse("connection_message_rate")
+        if self.ip_messages is not None and not self.ip_messages.allow(ip, now):
+            return self._refuse("ip_message_rate")
+        return None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "shed": dict(self.shed),
+            "tracked_connect_ips": len(self.connects) if self.connects is not None else 0,
+            "tracked_message_ips": len(self.ip_messages) if self.ip_messages is not None else 0,
+        }
@@ -0,0 +1,129 @@
+import json
+from typing import Any, Dict, Optional, Union
+
+try:
+    import orjson
+except ImportError:  # orjson is optional; stdlib json is the fallback
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:  # without msgpack only the JSON wire encoding is offered
+    msgpack = None
+
+BACKEND = "orjson" if orjson is not None else "json"
+
+# Websocket subprotocols a client can offer to pick the wire encoding
+JSON_SUBPROTOCOL = "chatserver.json.v1"
+MSGPACK_SUBPROTOCOL = "chatserver.msgpack.v1"
+
+Payload = Union[str, bytes]
+
+
+if orjson is not None:
+    def dumps(obj: Any) -> str:
+        return orjson.dumps(obj).decode()
+
+    def loads(data: Union[str, bytes]) -> Any:
+        return orjson.loads(data)
+else:
+    def dumps(obj: Any) -> str:
+        return json.dumps(obj, separators=(",", ":"), ensure_ascii=False)
+
+    def loads(data: Union[str, bytes]) -> Any:
+        return json.loads(data)
+
+
+class Codec:
+    """Wire encoding of a websocket: JSON text frames or MessagePack binary frames"""
+    name = "base"
+    subprotocol: Optional[str] = None
+    binary = False
+
+    def encode(self, frame: Any) -> Payload:
+        raise NotImplementedError
+
+    def decode(self, payload: Payload) -> Any:
+        raise NotImplementedError
+
+
+class JsonCodec(Codec):
+    name = "json"
+    subprotocol = JSON_SUBPROTOCOL
+
+    def encode(self, frame):
+        return dumps(frame)
+
+    def decode(self, payload):
+        return loads(payload)
+
+
+class MsgpackCodec(Codec):
+    name = "msgpack"
+    subprotocol = MSGPACK_SUBPROTOCOL
+    binary = True
+
+    def encode(self, frame):
+        return msgpack.packb(frame)
+
+    def decode(self, payload):
+        return msgpack.unpackb(payload)
+
+
+JSON_CODEC = JsonCodec()
+MSGPACK_CODEC = MsgpackCodec() if msgpack is not None else None
+
+
+def negotiate_codec(subprotocols, encoding: Optional[str] = None) -> Codec:
+    """Pick a codec from the client's offered subprotocols, else its ``encoding`` query parameter.
+
+    JSON is the default, and the fallback when msgpack isn't installed.
+    """
+    if MSGPACK_CODEC is None or JSON_SUBPROTOCOL in subprotocols and MSGPACK_SUBPROTOCOL not in subprotocols:
+        return JSON_CODEC
+    if MSGPACK_SUBPROTOCOL in subprotocols or encoding == "msgpack":
+        return MSGPACK_CODEC
+    return JSON_CODEC
+
+
+def decode_frame(payload: Payload) -> Any:
+    """Decode a received frame: text frames are JSON, binary frames MessagePack"""
+    if isinstance(payload, bytes):
+        if MSGPACK_CODEC is None:
+            raise ValueError("Binary frames need msgpack installed")
+        return MSGPACK_CODEC.decode(payload)
+    return loads(payload)
+
+
+def accepted_subprotocol(codec: Codec, subprotocols) -> Optional[str]:
+    """The subprotocol to confirm in the handshake, if the client offered one"""
+    return codec.subprotocol if codec.subprotocol in subprotocols else None
+
+
+class EncodedFrame:
+    """A frame serialized at most once per codec. Queue it for any number of sockets without re-encoding."""
+    __slots__ = ("frame", "_payloads")
+
+    def __init__(self, frame: Any):
+        self.frame = frame
+        self._payloads: Dict[str, Payload] = {}
+
+    def payload(self, codec: Codec) -> Payload:
+        payload = self._payloads.get(codec.name)
+        if payload is None:
+            payload = self._payloads[codec.name] = codec.encode(self.frame)
+        return payload
+
+    @property
+    def text(self) -> str:
+        return self.payload(JSON_CODEC)
+
+
+def encode_frame(frame: Any) -> EncodedFrame:
+    """Wrap a frame for encode-once sending. Each codec encodes it on first use."""
+    return EncodedFrame(frame)
+
+
+def frame_payload(frame: Any, codec: Codec = JSON_CODEC) -> Payload:
+    """Wire payload for a frame that may already be encoded"""
+    return frame.payload(codec) if isinstance(frame, EncodedFrame) else codec.encode(frame)
@@ -0,0 +1,74 @@
+import asyncio
+import logging
+from datetime import datetime
+from typing import Any, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class SessionReaper:
+    """Periodically deletes expired sessions from storage.
+
+    Each run deletes in batches of ``batch_size`` so no single statement
+    holds locks on a large part of the table, then records the table size.
+    """
+
+    def __init__(self, interval: float = 300.0, batch_size: int = 1000):
+        self.interval = interval
+        self.batch_size = batch_size
+        self._storage = None
+        self._task: Optional[asyncio.Task] = None
+        self.runs = 0
+        self.reaped_total = 0
+        self.last_reaped = 0
+        self.last_run_at: Optional[datetime] = None
+        self.table_rows: Optional[int] = None
+
+    async def start(self, storage):
+        self._storage = storage
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            try:
+                await self.reap()
+            except Exception as e:
+                logger.error(f"Session reaper run failed: {e}")
+            await asyncio.sleep(self.interval)
+
+    async def reap(self) -> int:
+        """Delete every expired session, one batch per statement. Returns the number deleted."""
+        reaped = 0
+        while True:
+            deleted = await self._storage.delete_expired_sessions(self.batch_size)
+            reaped += deleted
+            if deleted < self.batch_size:
+                break
+            # Let other queries at the database between batches
+            await asyncio.sleep(0)
+        self.table_rows = await self._storage.count_sessions()
+        self.runs += 1
+        self.last_reaped = reaped
+        self.reaped_total += reaped
+        self.last_run_at = datetime.now()
+        if reaped:
+            logger.info(f"Reaped {reaped} expired sessions ({self.table_rows} remaining)")
+        return reaped
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "runs": self.runs,
+            "reaped_total": self.reaped_total,
+            "last_reaped": self.last_reaped,
+            "last_run_at": self.last_run_at.isoformat() if self.last_run_at else None,
+            "table_rows": self.table_rows,
+        }
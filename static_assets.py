@@ -0,0 +1,104 @@
+import gzip
+import hashlib
+from typing import Dict, Optional
+
+from starlette.requests import Request
+from starlette.responses import Response
+
+try:
+    import brotli
+except ImportError:  # brotli variants are optional
+    brotli = None
+
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+
+def _accepted_encodings(accept_encoding: str) -> Dict[str, float]:
+    accepted = {}
+    for part in accept_encoding.split(","):
+        name, _, params = part.strip().partition(";")
+        quality = 1.0
+        if params.strip().startswith("q="):
+            try:
+                quality = float(params.strip()[2:])
+            except ValueError:
+                quality = 0.0
+        if name:
+            accepted[name.strip().lower()] = quality
+    return accepted
+
+
+class StaticAsset:
+    """A response body built once, with precompressed variants and an ETag.
+
+    The gzip and brotli (if the ``brotli`` package is installed) variants are
+    compressed at maximum level up front, so serving costs no CPU. Variants
+    that aren't smaller than the original are not kept.
+    """
+
+    def __init__(self, body: bytes, media_type: str, cache_control: str):
+        self.media_type = media_type
+        self.cache_control = cache_control
+        self.digest = hashlib.sha256(body).hexdigest()[:16]
+        self.variants: Dict[str, bytes] = {}
+        if brotli is not None:
+            self._add_variant("br", brotli.compress(body, quality=11), body)
+        self._add_variant("gzip", gzip.compress(body, compresslevel=9, mtime=0), body)
+        self.variants["identity"] = body
+
+    def _add_variant(self, encoding: str, compressed: bytes, body: bytes):
+        if len(compressed) < len(body):
+            self.variants[encoding] = compressed
+
+    def _choose_encoding(self, accept_encoding: str) -> str:
+        accepted = _accepted_encodings(accept_encoding)
+        for encoding in ("br", "gzip"):
+            if encoding in self.variants and accepted.get(encoding, accepted.get("*", 0.0)) > 0:
+                return encoding
+        return "identity"
+
+    def _etag(self, encoding: str) -> str:
+        return f'"{self.digest}"' if encoding == "identity" else f'"{self.digest}-{encoding}"'
+
+    def _matches(self, if_none_match: str) -> bool:
+        for tag in if_none_match.split(","):
+            tag = tag.strip()
+            if tag == "*":
+                return True
+            if tag.startswith("W/"):
+                tag = tag[2:]
+            if tag.strip('"').split("-", 1)[0] == self.digest:
+                return True
+        return False
+
+    def response(self, request: Request) -> Response:
+        encoding = self._choose_encoding(request.headers.get("accept-encoding", ""))
+        headers = {
+            "ETag": self._etag(encoding),
+            "Cache-Control": self.cache_control,
+            "Vary": "Accept-Encoding",
+        }
+        if self._matches(request.headers.get("if-none-match", "")):
+            return Response(status_code=304, headers=headers)
+        if encoding != "identity":
+            headers["Content-Encoding"] = encoding
+        return Response(self.variants[encoding], media_type=self.media_type, headers=headers)
+
+
+class StaticBundle:
+    """Content-hashed assets served under ``prefix``, cacheable forever since a change means a new URL"""
+
+    def __init__(self, prefix: str = "/static"):
+        self.prefix = prefix
+        self.assets: Dict[str, StaticAsset] = {}
+
+    def add(self, name: str, body: str, media_type: str) -> str:
+        """Register an asset and return its URL, e.g. ``/static/admin.3f2a9c1d0b7e4a55.js``"""
+        asset = StaticAsset(body.encode(), media_type, IMMUTABLE_CACHE_CONTROL)
+        stem, _, extension = name.rpartition(".")
+        filename = f"{stem}.{asset.digest}.{extension}"
+        self.assets[filename] = asset
+        return f"{self.prefix}/{filename}"
+
+    def get(self, filename: str) -> Optional[StaticAsset]:
+        return self.assets.get(filename)
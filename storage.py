@@ -0,0 +1,534 @@
+"""Storage engines for users, sessions and chat messages.
+
+``postgres`` is the production engine (asyncpg, schema managed by
+migrations.py). ``sqlite`` keeps everything in one local file for a
+single-node deployment; its statements run on one dedicated thread so the
+event loop never blocks on disk. ``memory`` keeps plain dicts and loses
+everything on restart; it is meant for benchmarks and local experiments.
+"""
+import asyncio
+import logging
+import sqlite3
+from bisect import bisect_left
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+import asyncpg
+
+from message_store import MESSAGE_COLUMNS, MESSAGES_TABLE, MessageRecord
+from metrics import Histogram, TimedPool
+from migrations import (DEFAULT_ADMIN_EMAIL, DEFAULT_ADMIN_PASSWORD_HASH, DEFAULT_ADMIN_USERNAME, LATEST_VERSION,
+                        current_version, migrate)
+
+logger = logging.getLogger(__name__)
+
+MessageCursor = Tuple[datetime, int]
+
+
+class Storage:
+    """What the server needs from its database.
+
+    Users come back as dicts with id, username, email and is_admin (plus
+    password_hash from ``get_user_by_username``); messages as dicts with id,
+    client_id, sender, agent_username, message and created_at.
+    """
+    name = "base"
+    # Failed writes worth retrying as they are (database unreachable or busy); anything else means the
+    # database rejected the statement or its data
+    TRANSIENT_ERRORS: Tuple[type, ...] = (OSError, asyncio.TimeoutError)
+
+    async def start(self, auto_migrate: bool = False):
+        pass
+
+    async def close(self):
+        pass
+
+    async def get_user_by_username(self, username: str) -> Optional[Dict[str, Any]]:
+        raise NotImplementedError
+
+    async def user_exists(self, username: str, email: str) -> bool:
+        raise NotImplementedError
+
+    async def create_user(self, username: str, email: str, password_hash: str, is_admin: bool):
+        raise NotImplementedError
+
+    async def create_session(self, user_id: int, token_hash: str, expires_at: datetime,
+                             new_password_hash: Optional[str] = None):
+        """Store a session, replacing the user's password hash as well when ``new_password_hash`` is set"""
+        raise NotImplementedError
+
+    async def get_session_user(self, token_hash: str, username: str) -> Optional[Dict[str, Any]]:
+        """The user owning an unexpired session, with the session's expiry as ``session_expires_at``"""
+        raise NotImplementedError
+
+    async def delete_session(self, token_hash: str):
+        raise NotImplementedError
+
+    async def delete_expired_sessions(self, limit: int) -> int:
+        """Delete up to ``limit`` expired sessions. Returns the number deleted."""
+        raise NotImplementedError
+
+    async def count_sessions(self) -> int:
+        raise NotImplementedError
+
+    async def update_last_login(self, logins: Dict[int, datetime]):
+        raise NotImplementedError
+
+    async def insert_messages(self, records: List[MessageRecord]):
+        raise NotImplementedError
+
+    async def fetch_messages(self, conversation_id: str, before: Optional[MessageCursor],
+                             limit: int) -> List[Dict[str, Any]]:
+        """Up to ``limit`` messages older than ``before`` (created_at, id), newest first"""
+        raise NotImplementedError
+
+    def pool_stats(self) -> Dict[str, int]:
+        return {"size": 0, "idle": 0, "max_size": 0, "waiting": 0}
+
+    def is_transient_error(self, error: Exception) -> bool:
+        return isinstance(error, self.TRANSIENT_ERRORS)
+
+
+class PostgresStorage(Storage):
+    name = "postgres"
+    # Connection loss, a closing pool, the server shutting down or out of resources
+    TRANSIENT_ERRORS = Storage.TRANSIENT_ERRORS + (asyncpg.PostgresConnectionError, asyncpg.InterfaceError,
+                                                   asyncpg.InsufficientResourcesError, asyncpg.OperatorInterventionError)
+
+    def __init__(self, dsn: Optional[str], acquire_seconds: Optional[Histogram] = None):
+        self.dsn = dsn
+        self.acquire_seconds = acquire_seconds
+        self.pool = None
+
+    async def start(self, auto_migrate: bool = False):
+        """Create the connection pool and check the schema is current.
+
+        Migrations run out-of-band with ``python migrations.py upgrade``; with
+        ``auto_migrate`` they are applied here instead (e.g. in development).
+        """
+        pool = await asyncpg.create_pool(self.dsn)
+        self.pool = TimedPool(pool, self.acquire_seconds) if self.acquire_seconds is not None else pool
+
+        async with self.pool.acquire() as conn:
+            version = await current_version(conn)
+            if version < LATEST_VERSION:
+                if not auto_migrate:
+                    raise RuntimeError(f"Database schema is at version {version}, expected {LATEST_VERSION}. "
+                                       f"Run `python migrations.py upgrade`.")
+                version = await migrate(conn)
+                logger.info(f"Database schema migrated to version {version}")
+
+    async def close(self):
+        if self.pool:
+            await self.pool.close()
+
+    async def get_user_by_username(self, username: str) -> Optional[Dict[str, Any]]:
+        async with self.pool.acquire() as conn:
+            row = await conn.fetchrow(
+                "SELECT id, username, email, is_admin, password_hash FROM chatserver_users WHERE username = $1", username
+            )
+        return dict(row) if row else None
+
+    async def user_exists(self, username: str, email: str) -> bool:
+        async with self.pool.acquire() as conn:
+            row = await conn.fetchrow(
+                "SELECT id FROM chatserver_users WHERE username = $1 OR email = $2", username, email
+            )
+        return row is not None
+
+    async def create_user(self, username: str, email: str, password_hash: str, is_admin: bool):
+        async with self.pool.acquire() as conn:
+            await conn.execute(
+                "INSERT INTO chatserver_users (username, email, password_hash, is_admin) VALUES ($1, $2, $3, $4)",
+                username, email, password_hash, is_admin
+            )
+
+    async def create_session(self, user_id: int, token_hash: str, expires_at: datetime,
+                             new_password_hash: Optional[str] = None):
+        # One statement, so upgrading a legacy password hash costs no extra round-trip
+        async with self.pool.acquire() as conn:
+            await conn.execute('''
+                WITH rehash AS (
+                    UPDATE chatserver_users SET password_hash = $4 WHERE id = $1 AND $4::varchar IS NOT NULL
+                )
+                INSERT INTO chatserver_user_sessions (user_id, token_hash, expires_at) VALUES ($1, $2, $3)
+            ''', user_id, token_hash, expires_at, new_password_hash)
+
+    async def get_session_user(self, token_hash: str, username: str) -> Optional[Dict[str, Any]]:
+        async with self.pool.acquire() as conn:
+            row = await conn.fetchrow('''
+                SELECT u.id, u.username, u.email, u.is_admin, s.expires_at AS session_expires_at
+                FROM chatserver_user_sessions s JOIN chatserver_users u ON u.id = s.user_id
+                WHERE s.token_hash = $1 AND u.username = $2 AND s.expires_at > NOW()
+            ''', token_hash, username)
+        return dict(row) if row else None
+
+    async def delete_session(self, token_hash: str):
+        async with self.pool.acquire() as conn:
+            await conn.execute("DELETE FROM chatserver_user_sessions WHERE token_hash = $1", token_hash)
+
+    async def delete_expired_sessions(self, limit: int) -> int:
+        async with self.pool.acquire() as conn:
+            result = await conn.execute('''
+                DELETE FROM chatserver_user_sessions WHERE id IN (
+                    SELECT id FROM chatserver_user_sessions
+                    WHERE expires_at <= NOW() ORDER BY expires_at LIMIT $1
+                )
+            ''', limit)
+        return int(result.split()[-1])
+
+    async def count_sessions(self) -> int:
+        async with self.pool.acquire() as conn:
+            return await conn.fetchval("SELECT COUNT(*) FROM chatserver_user_sessions")
+
+    async def update_last_login(self, logins: Dict[int, datetime]):
+        async with self.pool.acquire() as conn:
+            await conn.execute('''
+                UPDATE chatserver_users u SET last_login = v.last_login
+                FROM unnest($1::int[], $2::timestamp[]) AS v(id, last_login)
+                WHERE u.id = v.id
+            ''', list(logins), list(logins.values()))
+
+    async def insert_messages(self, records: List[MessageRecord]):
+        async with self.pool.acquire() as conn:
+            await conn.copy_records_to_table(MESSAGES_TABLE, records=records, columns=MESSAGE_COLUMNS)
+
+    async def fetch_messages(self, conversation_id: str, before: Optional[MessageCursor],
+                             limit: int) -> List[Dict[str, Any]]:
+        async with self.pool.acquire() as conn:
+            if before:
+                rows = await conn.fetch(f'''
+                    SELECT id, client_id, sender, agent_username, message, created_at FROM {MESSAGES_TABLE}
+                    WHERE conversation_id = $1 AND (created_at, id) < ($2, $3)
+                    ORDER BY created_at DESC, id DESC LIMIT $4
+                ''', conversation_id, before[0], before[1], limit)
+            else:
+                rows = await conn.fetch(f'''
+                    SELECT id, client_id, sender, agent_username, message, created_at FROM {MESSAGES_TABLE}
+                    WHERE conversation_id = $1
+                    ORDER BY created_at DESC, id DESC LIMIT $2
+                ''', conversation_id, limit)
+        return [dict(row) for row in rows]
+
+    def pool_stats(self) -> Dict[str, int]:
+        if self.pool is None:
+            return super().pool_stats()
+        return {
+            "size": self.pool.get_size(),
+            "idle": self.pool.get_idle_size(),
+            "max_size": self.pool.get_max_size(),
+            "waiting": getattr(self.pool, "waiting", 0),
+        }
+
+
+# Same tables as the Postgres schema. Timestamps are stored as ISO-8601 text with microseconds,
+# which sorts in time order.
+SQLITE_SCHEMA = f'''
+    CREATE TABLE IF NOT EXISTS chatserver_users (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        username TEXT UNIQUE NOT NULL,
+        email TEXT UNIQUE NOT NULL,
+        password_hash TEXT NOT NULL,
+        is_admin INTEGER NOT NULL DEFAULT 0,
+        created_at TEXT NOT NULL,
+        last_login TEXT
+    );
+    CREATE TABLE IF NOT EXISTS chatserver_user_sessions (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL REFERENCES chatserver_users(id) ON DELETE CASCADE,
+        token_hash TEXT NOT NULL,
+        expires_at TEXT NOT NULL,
+        created_at TEXT NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS idx_chatserver_user_sessions_token_hash ON chatserver_user_sessions (token_hash);
+    CREATE INDEX IF NOT EXISTS idx_chatserver_user_sessions_expires_at ON chatserver_user_sessions (expires_at);
+    CREATE TABLE IF NOT EXISTS {MESSAGES_TABLE} (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        conversation_id TEXT NOT NULL,
+        client_id TEXT NOT NULL,
+        sender TEXT NOT NULL,
+        agent_username TEXT,
+        message TEXT NOT NULL,
+        created_at TEXT NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS idx_chatserver_messages_conversation ON {MESSAGES_TABLE} (conversation_id, created_at, id);
+'''
+
+
+def _sqlite_time(value: datetime) -> str:
+    return value.isoformat(sep=" ", timespec="microseconds")
+
+
+def _sqlite_user(row: Optional[sqlite3.Row]) -> Optional[Dict[str, Any]]:
+    if row is None:
+        return None
+    user = dict(row)
+    user["is_admin"] = bool(user["is_admin"])
+    if "session_expires_at" in user:
+        user["session_expires_at"] = datetime.fromisoformat(user["session_expires_at"])
+    return user
+
+
+class SqliteStorage(Storage):
+    """One SQLite connection, used only from a single worker thread.
+
+    sqlite3 calls block, so every statement is handed to that thread; running
+    them one at a time is also what SQLite's single writer wants. The schema
+    is created (and the default admin seeded) on start.
+    """
+    name = "sqlite"
+    # Database locked, disk I/O errors and the like
+    TRANSIENT_ERRORS = Storage.TRANSIENT_ERRORS + (sqlite3.OperationalError,)
+
+    def __init__(self, path: str):
+        self.path = path
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._conn: Optional[sqlite3.Connection] = None
+
+    async def _run(self, fn: Callable[..., Any], *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+
+    def _open(self):
+        conn = sqlite3.connect(self.path, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA foreign_keys=ON")
+        with conn:
+            conn.executescript(SQLITE_SCHEMA)
+            seeded = conn.execute('''
+                INSERT OR IGNORE INTO chatserver_users (username, email, password_hash, is_admin, created_at)
+                VALUES (?, ?, ?, 1, ?)
+            ''', (DEFAULT_ADMIN_USERNAME, DEFAULT_ADMIN_EMAIL, DEFAULT_ADMIN_PASSWORD_HASH, _sqlite_time(datetime.now())))
+        if seeded.rowcount:
+            logger.info(f"Default admin user created in {self.path} (username: admin, password: admin123)")
+        self._conn = conn
+
+    async def start(self, auto_migrate: bool = False):
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sqlite")
+        await self._run(self._open)
+
+    async def close(self):
+        if self._executor is None:
+            return
+        if self._conn is not None:
+            await self._run(self._conn.close)
+            self._conn = None
+        self._executor.shutdown()
+        self._executor = None
+
+    def _query_one(self, sql: str, params: Iterable[Any]) -> Optional[sqlite3.Row]:
+        return self._conn.execute(sql, tuple(params)).fetchone()
+
+    def _write(self, sql: str, params: Iterable[Any]) -> int:
+        with self._conn:
+            return self._conn.execute(sql, tuple(params)).rowcount
+
+    def _write_many(self, sql: str, rows: List[Tuple[Any, ...]]):
+        with self._conn:
+            self._conn.executemany(sql, rows)
+
+    async def get_user_by_username(self, username: str) -> Optional[Dict[str, Any]]:
+        row = await self._run(self._query_one,
+                              "SELECT id, username, email, is_admin, password_hash FROM chatserver_users WHERE username = ?",
+                              (username,))
+        return _sqlite_user(row)
+
+    async def user_exists(self, username: str, email: str) -> bool:
+        row = await self._run(self._query_one, "SELECT id FROM chatserver_users WHERE username = ? OR email = ?",
+                              (username, email))
+        return row is not None
+
+    async def create_user(self, username: str, email: str, password_hash: str, is_admin: bool):
+        await self._run(self._write, '''
+            INSERT INTO chatserver_users (username, email, password_hash, is_admin, created_at) VALUES (?, ?, ?, ?, ?)
+        ''', (username, email, password_hash, int(is_admin), _sqlite_time(datetime.now())))
+
+    def _create_session(self, user_id: int, token_hash: str, expires_at: datetime, new_password_hash: Optional[str]):
+        with self._conn:
+            if new_password_hash is not None:
+                self._conn.execute("UPDATE chatserver_users SET password_hash = ? WHERE id = ?", (new_password_hash, user_id))
+            self._conn.execute('''
+                INSERT INTO chatserver_user_sessions (user_id, token_hash, expires_at, created_at) VALUES (?, ?, ?, ?)
+            ''', (user_id, token_hash, _sqlite_time(expires_at), _sqlite_time(datetime.now())))
+
+    async def create_session(self, user_id: int, token_hash: str, expires_at: datetime,
+                             new_password_hash: Optional[str] = None):
+        await self._run(self._create_session, user_id, token_hash, expires_at, new_password_hash)
+
+    async def get_session_user(self, token_hash: str, username: str) -> Optional[Dict[str, Any]]:
+        row = await self._run(self._query_one, '''
+            SELECT u.id, u.username, u.email, u.is_admin, s.expires_at AS session_expires_at
+            FROM chatserver_user_sessions s JOIN chatserver_users u ON u.id = s.user_id
+            WHERE s.token_hash = ? AND u.username = ? AND s.expires_at > ?
+        ''', (token_hash, username, _sqlite_time(datetime.now())))
+        return _sqlite_user(row)
+
+    async def delete_session(self, token_hash: str):
+        await self._run(self._write, "DELETE FROM chatserver_user_sessions WHERE token_hash = ?", (token_hash,))
+
+    async def delete_expired_sessions(self, limit: int) -> int:
+        return await self._run(self._write, '''
+            DELETE FROM chatserver_user_sessions WHERE id IN (
+                SELECT id FROM chatserver_user_sessions
+                WHERE expires_at <= ? ORDER BY expires_at LIMIT ?
+            )
+        ''', (_sqlite_time(datetime.now()), limit))
+
+    async def count_sessions(self) -> int:
+        row = await self._run(self._query_one, "SELECT COUNT(*) FROM chatserver_user_sessions", ())
+        return row[0]
+
+    async def update_last_login(self, logins: Dict[int, datetime]):
+        await self._run(self._write_many, "UPDATE chatserver_users SET last_login = ? WHERE id = ?",
+                        [(_sqlite_time(when), user_id) for user_id, when in logins.items()])
+
+    async def insert_messages(self, records: List[MessageRecord]):
+        await self._run(self._write_many,
+                        f"INSERT INTO {MESSAGES_TABLE} ({', '.join(MESSAGE_COLUMNS)}) VALUES (?, ?, ?, ?, ?, ?)",
+                        [record[:-1] + (_sqlite_time(record[-1]),) for record in records])
+
+    def _fetch_messages(self, conversation_id: str, before: Optional[MessageCursor], limit: int) -> List[Dict[str, Any]]:
+        if before:
+            rows = self._conn.execute(f'''
+                SELECT id, client_id, sender, agent_username, message, created_at FROM {MESSAGES_TABLE}
+                WHERE conversation_id = ? AND (created_at, id) < (?, ?)
+                ORDER BY created_at DESC, id DESC LIMIT ?
+            ''', (conversation_id, _sqlite_time(before[0]), before[1], limit)).fetchall()
+        else:
+            rows = self._conn.execute(f'''
+                SELECT id, client_id, sender, agent_username, message, created_at FROM {MESSAGES_TABLE}
+                WHERE conversation_id = ?
+                ORDER BY created_at DESC, id DESC LIMIT ?
+            ''', (conversation_id, limit)).fetchall()
+        messages = [dict(row) for row in rows]
+        for message in messages:
+            message["created_at"] = datetime.fromisoformat(message["created_at"])
+        return messages
+
+    async def fetch_messages(self, conversation_id: str, before: Optional[MessageCursor],
+                             limit: int) -> List[Dict[str, Any]]:
+        return await self._run(self._fetch_messages, conversation_id, before, limit)
+
+    def pool_stats(self) -> Dict[str, int]:
+        # The work queue of the single SQLite thread stands in for pool waiters
+        waiting = self._executor._work_queue.qsize() if self._executor else 0
+        return {"size": 1 if self._conn else 0, "idle": 0, "max_size": 1, "waiting": waiting}
+
+
+class MemoryStorage(Storage):
+    """Dicts in this process. Nothing survives a restart and nothing is shared between workers."""
+    name = "memory"
+
+    def __init__(self):
+        self._users: Dict[int, Dict[str, Any]] = {}
+        self._user_ids: Dict[str, int] = {}  # username -> id
+        self._emails: set = set()
+        self._sessions: Dict[str, Tuple[int, datetime]] = {}  # token_hash -> (user_id, expires_at)
+        # conversation_id -> messages in insertion order, with their (created_at, id) keys for bisecting
+        self._messages: Dict[str, List[Dict[str, Any]]] = {}
+        self._message_keys: Dict[str, List[MessageCursor]] = {}
+        self._next_user_id = 1
+        self._next_message_id = 1
+
+    async def start(self, auto_migrate: bool = False):
+        if DEFAULT_ADMIN_USERNAME not in self._user_ids:
+            await self.create_user(DEFAULT_ADMIN_USERNAME, DEFAULT_ADMIN_EMAIL, DEFAULT_ADMIN_PASSWORD_HASH, True)
+        logger.warning("Using in-memory storage: users, sessions and messages are lost on restart")
+
+    async def get_user_by_username(self, username: str) -> Optional[Dict[str, Any]]:
+        user_id = self._user_ids.get(username)
+        return dict(self._users[user_id]) if user_id is not None else None
+
+    async def user_exists(self, username: str, email: str) -> bool:
+        return username in self._user_ids or email in self._emails
+
+    async def create_user(self, username: str, email: str, password_hash: str, is_admin: bool):
+        if username in self._user_ids or email in self._emails:
+            raise ValueError(f"User {username} or email {email} already exists")
+        user_id = self._next_user_id
+        self._next_user_id += 1
+        self._users[user_id] = {"id": user_id, "username": username, "email": email, "is_admin": is_admin,
+                                "password_hash": password_hash, "created_at": datetime.now(), "last_login": None}
+        self._user_ids[username] = user_id
+        self._emails.add(email)
+
+    async def create_session(self, user_id: int, token_hash: str, expires_at: datetime,
+                             new_password_hash: Optional[str] = None):
+        if new_password_hash is not None:
+            self._users[user_id]["password_hash"] = new_password_hash
+        self._sessions[token_hash] = (user_id, expires_at)
+
+    async def get_session_user(self, token_hash: str, username: str) -> Optional[Dict[str, Any]]:
+        session = self._sessions.get(token_hash)
+        if session is None or session[1] <= datetime.now():
+            return None
+        user = self._users.get(session[0])
+        if user is None or user["username"] != username:
+            return None
+        return {"id": user["id"], "username": user["username"], "email": user["email"], "is_admin": user["is_admin"],
+                "session_expires_at": session[1]}
+
+    async def delete_session(self, token_hash: str):
+        self._sessions.pop(token_hash, None)
+
+    async def delete_expired_sessions(self, limit: int) -> int:
+        now = datetime.now()
+        expired = []
+        for token_hash, (_, expires_at) in self._sessions.items():
+            if expires_at <= now:
+                expired.append(token_hash)
+                if len(expired) >= limit:
+                    break
+        for token_hash in expired:
+            del self._sessions[token_hash]
+        return len(expired)
+
+    async def count_sessions(self) -> int:
+        return len(self._sessions)
+
+    async def update_last_login(self, logins: Dict[int, datetime]):
+        for user_id, when in logins.items():
+            user = self._users.get(user_id)
+            if user is not None:
+                user["last_login"] = when
+
+    async def insert_messages(self, records: List[MessageRecord]):
+        for conversation_id, client_id, sender, agent_username, message, created_at in records:
+            message_id = self._next_message_id
+            self._next_message_id += 1
+            messages = self._messages.setdefault(conversation_id, [])
+            keys = self._message_keys.setdefault(conversation_id, [])
+            entry = {"id": message_id, "client_id": client_id, "sender": sender, "agent_username": agent_username,
+                     "message": message, "created_at": created_at}
+            key = (created_at, message_id)
+            if not keys or keys[-1] < key:
+                messages.append(entry)
+                keys.append(key)
+            else:
+                # A record stamped before the last stored one (clock step); keep the lists sorted
+                index = bisect_left(keys, key)
+                messages.insert(index, entry)
+                keys.insert(index, key)
+
+    async def fetch_messages(self, conversation_id: str, before: Optional[MessageCursor],
+                             limit: int) -> List[Dict[str, Any]]:
+        messages = self._messages.get(conversation_id, [])
+        end = bisect_left(self._message_keys[conversation_id], before) if before and messages else len(messages)
+        return [dict(message) for message in reversed(messages[max(0, end - limit):end])]
+
+
+STORAGE_ENGINES = ("postgres", "sqlite", "memory")
+
+
+def create_storage(engine: str, database_url: Optional[str] = None, sqlite_path: str = "chatserver.db",
+                   acquire_seconds: Optional[Histogram] = None) -> Storage:
+    """Build the configured storage engine: ``postgres``, ``sqlite`` or ``memory``"""
+    if engine == "postgres":
+        return PostgresStorage(database_url, acquire_seconds)
+    if engine == "sqlite":
+        return SqliteStorage(sqlite_path)
+    if engine == "memory":
+        return MemoryStorage()
+    raise ValueError(f"Unknown storage engine '{engine}'. Choose one of: {', '.join(STORAGE_ENGINES)}")
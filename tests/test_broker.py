@@ -0,0 +1,254 @@
+"""Two ConnectionManager nodes talking through the in-process broker, and a BrokerHub round trip.
+
+Run with ``python -m pytest tests``.
+"""
+import asyncio
+import json
+import os
+import sys
+import tempfile
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import main  # noqa: E402
+from broker import BrokerHub, InProcessBroker, InProcessHub, UnixSocketBroker  # noqa: E402
+from main import ClientSession, ConnectionManager  # noqa: E402
+
+
+class FakeWebSocket:
+    """Enough of a Starlette WebSocket for the manager; records the frames sent to it"""
+
+    def __init__(self, query_params=None, host="10.0.0.1"):
+        self.scope = {"subprotocols": []}
+        self.query_params = query_params or {}
+        self.headers = {"user-agent": "test-agent"}
+        self.client = SimpleNamespace(host=host)
+        self.frames = []
+        self.closed_with = None
+
+    async def accept(self, subprotocol=None):
+        pass
+
+    async def send_text(self, text):
+        self.frames.append(json.loads(text))
+
+    async def send_bytes(self, data):
+        self.frames.append(json.loads(data))
+
+    async def close(self, code=1000, reason=""):
+        self.closed_with = code
+
+    def of_type(self, frame_type):
+        return [frame for frame in self.frames if frame.get("type") == frame_type]
+
+
+async def eventually(condition, timeout=2.0):
+    deadline = asyncio.get_running_loop().time() + timeout
+    while not condition():
+        assert asyncio.get_running_loop().time() < deadline, "condition not met in time"
+        await asyncio.sleep(0.01)
+
+
+async def start_nodes():
+    hub = InProcessHub()
+    a = ConnectionManager(broker=InProcessBroker(hub, node_id="node-a"))
+    b = ConnectionManager(broker=InProcessBroker(hub, node_id="node-b"))
+    await a.start()
+    await b.start()
+    return a, b
+
+
+async def stop_nodes(*managers):
+    for manager in managers:
+        await manager.stop()
+
+
+async def connect_agent(manager, username="agent"):
+    websocket = FakeWebSocket()
+    agent = await manager.connect_admin(websocket, {"username": username, "is_admin": True}, max_clients=5)
+    return agent, websocket
+
+
+async def connect_visitor(manager, conversation_id="conv-1"):
+    websocket = FakeWebSocket({"conversation_id": conversation_id})
+    session = await manager.request_connection(websocket)
+    return session, websocket
+
+
+def pending_adds(websocket):
+    return [op["request"] for frame in websocket.of_type("pending_requests_delta")
+            for op in frame["ops"] if op["op"] == "add"]
+
+
+def test_agent_up_and_down_are_mirrored():
+    async def run():
+        a, b = await start_nodes()
+        try:
+            agent, _ = await connect_agent(a)
+            await eventually(lambda: agent.agent_id in b.agents)
+            assert not b.agents[agent.agent_id].is_local
+            assert b.agents[agent.agent_id].node_id == "node-a"
+
+            await a.disconnect_admin(agent)
+            await eventually(lambda: agent.agent_id not in b.agents)
+        finally:
+            await stop_nodes(a, b)
+
+    asyncio.run(run())
+
+
+def test_visitor_is_routed_to_an_agent_on_another_node():
+    async def run():
+        a, b = await start_nodes()
+        try:
+            agent, agent_ws = await connect_agent(a)
+            await eventually(lambda: agent.agent_id in b.agents)
+
+            session, _ = await connect_visitor(b, "conv-routed")
+            assert session.state == ClientSession.PENDING
+            assert session.agent_id == agent.agent_id
+
+            await eventually(lambda: session.client_id in a.pending_connections)
+            assert not a.pending_connections[session.client_id].is_local
+            await eventually(lambda: pending_adds(agent_ws))
+            assert pending_adds(agent_ws)[0]["request_id"] == session.client_id
+            assert pending_adds(agent_ws)[0]["conversation_id"] == "conv-routed"
+        finally:
+            await stop_nodes(a, b)
+
+    asyncio.run(run())
+
+
+def test_admin_response_and_messages_cross_nodes():
+    async def run():
+        a, b = await start_nodes()
+        try:
+            agent, agent_ws = await connect_agent(a)
+            await eventually(lambda: agent.agent_id in b.agents)
+            session, visitor_ws = await connect_visitor(b)
+            await eventually(lambda: session.client_id in a.pending_connections)
+
+            # The agent's node relays the decision to the node owning the visitor
+            await a.handle_admin_response(agent, session.client_id, "accept")
+            await eventually(lambda: visitor_ws.of_type("connection_approved"))
+            assert session.state == ClientSession.ACTIVE
+            await eventually(lambda: session.client_id in a.active_clients)
+
+            await a.forward_admin_message_to_client(agent, session.client_id, "hello from node a")
+            await eventually(lambda: visitor_ws.of_type("admin_message"))
+            assert visitor_ws.of_type("admin_message")[0]["message"] == "hello from node a"
+
+            await b.forward_user_message_to_admin(session.client_id, "hello from node b")
+            await eventually(lambda: agent_ws.of_type("user_message"))
+            assert agent_ws.of_type("user_message")[0]["message"] == "hello from node b"
+        finally:
+            await stop_nodes(a, b)
+
+    asyncio.run(run())
+
+
+def test_node_down_drops_the_nodes_agents_and_sessions():
+    async def run():
+        a, b = await start_nodes()
+        try:
+            agent_a, agent_ws = await connect_agent(a, "agent-a")
+            agent_b, _ = await connect_agent(b, "agent-b")
+            await eventually(lambda: agent_b.agent_id in a.agents and agent_a.agent_id in b.agents)
+            # Fill agent-b so the visitor goes to agent-a
+            b.agents[agent_b.agent_id].max_clients = 0
+            session, _ = await connect_visitor(b)
+            await eventually(lambda: session.client_id in a.pending_connections)
+            assert session.agent_id == agent_a.agent_id
+
+            await b.stop()
+            await eventually(lambda: agent_b.agent_id not in a.agents)
+            assert session.client_id not in a.pending_connections
+            assert session.client_id not in agent_a.client_ids
+            await eventually(lambda: any(op["op"] == "remove" for frame in agent_ws.of_type("pending_requests_delta")
+                                         for op in frame["ops"]))
+        finally:
+            await stop_nodes(a)
+
+    asyncio.run(run())
+
+
+def test_unix_socket_round_trip():
+    async def run():
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "hub.sock")
+            hub = BrokerHub(path)
+            hub_task = asyncio.create_task(hub.serve_forever())
+            await eventually(lambda: os.path.exists(path))
+
+            received = {"one": [], "two": []}
+            brokers = {name: UnixSocketBroker(path, node_id=name) for name in received}
+
+            async def on_connect():
+                pass
+
+            for name, broker in brokers.items():
+                async def handler(event, name=name):
+                    received[name].append(event)
+                await broker.start(handler, on_connect)
+            await eventually(lambda: len(hub.nodes) == 2)
+
+            await brokers["one"].publish({"op": "ping", "payload": [1, 2, 3]})
+            await brokers["two"].publish({"op": "direct", "to": "one"})
+            await eventually(lambda: received["two"] and received["one"])
+            assert received["two"] == [{"op": "ping", "payload": [1, 2, 3], "node": "one"}]
+            assert received["one"] == [{"op": "direct", "to": "one", "node": "two"}]
+
+            await brokers["two"].stop()
+            await eventually(lambda: len(received["one"]) == 2)
+            assert received["one"][1] == {"op": "node_down", "node": "two"}
+
+            await brokers["one"].stop()
+            hub_task.cancel()
+
+    asyncio.run(run())
+
+
+def test_unknown_admin_action_leaves_the_request_pending():
+    async def run():
+        a, b = await start_nodes()
+        try:
+            agent, agent_ws = await connect_agent(a)
+            await eventually(lambda: agent.agent_id in b.agents)
+            session, visitor_ws = await connect_visitor(b)
+            await eventually(lambda: session.client_id in a.pending_connections)
+
+            await a.handle_admin_response(agent, session.client_id, "maybe")
+            await eventually(lambda: agent_ws.of_type("error"))
+            assert "Unknown action" in agent_ws.of_type("error")[0]["message"]
+            assert session.state == ClientSession.PENDING
+            assert session.client_id in b.pending_connections
+            assert visitor_ws.closed_with is None
+        finally:
+            await stop_nodes(a, b)
+
+    asyncio.run(run())
+
+
+def test_failed_send_to_a_visitor_removes_their_session():
+    async def run():
+        a, b = await start_nodes()
+        try:
+            agent, agent_ws = await connect_agent(a)
+            session, visitor_ws = await connect_visitor(a)
+            assert session.client_id in agent.client_ids
+
+            async def broken_send(text):
+                raise ConnectionResetError("peer went away")
+
+            visitor_ws.send_text = broken_send
+            await a.send_to_client(session, {"type": "status_update", "message": "still there?"})
+            await eventually(lambda: session.state == ClientSession.CLOSED)
+            assert session.client_id not in agent.client_ids
+            assert session.client_id not in a.pending_connections
+            await eventually(lambda: session.client_id not in b.pending_connections)
+            await eventually(lambda: visitor_ws.closed_with == 1011)
+        finally:
+            await stop_nodes(a, b)
+
+    asyncio.run(run())
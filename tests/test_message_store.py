@@ -0,0 +1,72 @@
+"""MessageWriter against the SQLite engine.
+
+Run with ``python -m pytest tests``.
+"""
+import asyncio
+import os
+import sqlite3
+import sys
+import tempfile
+from datetime import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from message_store import SENDER_USER, MessageWriter  # noqa: E402
+from storage import SqliteStorage  # noqa: E402
+
+
+def run_with_storage(test):
+    async def run():
+        with tempfile.TemporaryDirectory() as tmp:
+            storage = SqliteStorage(os.path.join(tmp, "chat.db"))
+            await storage.start()
+            try:
+                await test(storage)
+            finally:
+                await storage.close()
+
+    asyncio.run(run())
+
+
+def test_rejected_record_is_dropped_and_the_rest_written():
+    async def test(storage):
+        writer = MessageWriter(batch_size=10)
+        writer._storage, writer._flush_lock = storage, asyncio.Lock()
+        writer.record("conv-1", "client-1", SENDER_USER, "before")
+        # Bypasses record()'s type check, as a record the database rejects
+        writer._buffer.append(("conv-1", "client-1", SENDER_USER, None, {"not": "text"}, datetime.now()))
+        writer.record("conv-2", "client-2", SENDER_USER, "unrelated conversation")
+
+        assert await writer.flush()
+        assert writer.written == 2
+        assert writer.dead_lettered == writer.dropped == 1
+        assert not writer._buffer
+        assert [m["message"] for m in await storage.fetch_messages("conv-2", None, 10)] == ["unrelated conversation"]
+
+    run_with_storage(test)
+
+
+def test_unavailable_database_keeps_the_batch():
+    async def test(storage):
+        writer = MessageWriter(batch_size=10)
+        writer._storage, writer._flush_lock = storage, asyncio.Lock()
+        writer.record("conv-1", "client-1", SENDER_USER, "hello")
+
+        async def locked(records):
+            raise sqlite3.OperationalError("database is locked")
+
+        insert_messages, storage.insert_messages = storage.insert_messages, locked
+        assert not await writer.flush()
+        assert writer.failed_batches == 1 and len(writer._buffer) == 1 and writer.dropped == 0
+
+        storage.insert_messages = insert_messages
+        assert await writer.flush()
+        assert writer.written == 1
+
+    run_with_storage(test)
+
+
+def test_record_refuses_non_text():
+    writer = MessageWriter()
+    assert writer.record("conv-1", "client-1", SENDER_USER, {"a": 1}) is None
+    assert writer.dropped == 1 and not writer._buffer
@@ -0,0 +1,44 @@
+"""OutboundQueue failure handling.
+
+Run with ``python -m pytest tests``.
+"""
+import asyncio
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from outbound import DROP_OLDEST, OutboundQueue  # noqa: E402
+
+
+class BrokenWebSocket:
+    def __init__(self):
+        self.closed_with = None
+
+    async def send_text(self, text):
+        raise ConnectionResetError("peer went away")
+
+    async def close(self, code=1000, reason=""):
+        self.closed_with = code
+
+
+def test_failed_send_runs_on_failure_and_closes_the_socket():
+    async def run():
+        websocket = BrokenWebSocket()
+        queue = OutboundQueue(websocket, "test", 10, DROP_OLDEST)
+        cleaned_up = asyncio.Event()
+
+        async def on_failure():
+            # The owner's cleanup closes the queue, as disconnect handling does
+            await queue.aclose()
+            cleaned_up.set()
+
+        queue.on_failure = on_failure
+        assert queue.send({"type": "hello"})
+        await asyncio.wait_for(cleaned_up.wait(), 1)
+        await asyncio.sleep(0)
+        assert queue.closed
+        assert not queue.send({"type": "again"})
+        assert websocket.closed_with == 1011
+
+    asyncio.run(run())